@@ -109,11 +109,15 @@ export async function POST(request: NextRequest): Promise<NextResponse> {
       let stdoutData = '';
       let stderrData = '';
       let processStarted = false;
+      // 长时间运行的进程只保留最近的输出，避免内存无限增长
+      const MAX_BUFFERED_OUTPUT = 64 * 1024;
+      const keepTail = (buffer: string) =>
+        buffer.length > MAX_BUFFERED_OUTPUT ? buffer.slice(-MAX_BUFFERED_OUTPUT) : buffer;
 
       pythonProcess.stdout.on('data', (data) => {
         processStarted = true;
         const text = data.toString();
-        stdoutData += text;
+        stdoutData = keepTail(stdoutData + text);
         console.log('Python stdout:', text);
         // 发送状态更新
         resolve(NextResponse.json({
@@ -126,7 +130,7 @@ export async function POST(request: NextRequest): Promise<NextResponse> {
       pythonProcess.stderr.on('data', (data) => {
         processStarted = true;
         const text = data.toString();
-        stderrData += text;
+        stderrData = keepTail(stderrData + text);
         console.error('Python stderr:', text);
         // 发送错误信息
         resolve(NextResponse.json({
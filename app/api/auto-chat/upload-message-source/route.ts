@@ -4,9 +4,44 @@ import { existsSync } from 'fs';
 import path from 'path';
 import { verifyAuth } from '@/lib/auth';
 import { NextRequest } from 'next/server';
+import { spawn } from 'child_process';
 
 export const dynamic = 'force-dynamic';
 
+// 编译并校验消息源，生成 .pack 和错误报告；失败时不影响上传结果
+function compileMessageSource(sourceDir: string): Promise<any> {
+  return new Promise((resolve) => {
+    const scriptPath = path.join(process.cwd(), 'scripts', 'compile_source.py');
+    const pythonProcess = spawn('python3', [scriptPath, '--source-dir', sourceDir], {
+      env: {
+        ...process.env,
+        PYTHONIOENCODING: 'utf-8'
+      }
+    });
+
+    let output = '';
+    pythonProcess.stdout.on('data', (data) => {
+      output += data.toString();
+    });
+
+    pythonProcess.stderr.on('data', (data) => {
+      console.error('Compile message source error:', data.toString());
+    });
+
+    pythonProcess.on('close', () => {
+      try {
+        const lines = output.trim().split('\n');
+        const result = JSON.parse(lines[lines.length - 1]);
+        resolve(result.data || null);
+      } catch {
+        resolve(null);
+      }
+    });
+
+    pythonProcess.on('error', () => resolve(null));
+  });
+}
+
 export async function POST(request: NextRequest) {
   try {
     // 验证用户身份
@@ -60,10 +95,13 @@ export async function POST(request: NextRequest) {
       })
     );
 
+    const compileReport = await compileMessageSource(sourceDir);
+
     return NextResponse.json({
       success: true,
       message: 'Message source uploaded successfully',
-      mediaResults
+      mediaResults,
+      compileReport
     });
 
   } catch (error: any) {
@@ -1,9 +1,8 @@
 import { NextRequest } from 'next/server'
 import { createReadStream } from 'fs'
 import { stat, readdir } from 'fs/promises'
+import { spawn } from 'child_process'
 import path from 'path'
-import archiver from 'archiver'
-import { Readable } from 'stream'
 import { verifyAuth, handleAuthError } from '@/lib/auth'
 
 export async function POST(request: NextRequest) {
@@ -31,9 +30,9 @@ export async function POST(request: NextRequest) {
       try {
         const files = await readdir(groupDir)
         
-        // 查找匹配的CSV文件（包括.tmp文件）
+        // 查找匹配的CSV文件（包括.tmp文件和转入冷存储的.zst文件）
         let targetFiles = files.filter(f => {
-          const isCSV = f.endsWith('.csv') || f.endsWith('.csv.tmp')
+          const isCSV = f.endsWith('.csv') || f.endsWith('.csv.tmp') || f.endsWith('.csv.zst') || f.endsWith('.csv.tmp.zst')
           if (!isCSV) return false
           
           // 如果指定了日期范围，匹配文件名
@@ -86,11 +85,31 @@ export async function POST(request: NextRequest) {
       try {
         await stat(fullPath)
       } catch (error) {
-        return new Response('File not found', { status: 404 })
+        // 文件可能已被压缩到冷存储
+        try {
+          await stat(`${fullPath}.zst`)
+          fullPath = `${fullPath}.zst`
+        } catch {
+          return new Response('File not found', { status: 404 })
+        }
       }
     }
 
-    if (type === 'csv') {
+    if (type === 'csv' && fullPath.endsWith('.zst')) {
+      // 冷存储中的 CSV 由 storage_manager.py 边解压边输出
+      const csvPath = fullPath.slice(0, -'.zst'.length)
+      const scriptPath = path.join(process.cwd(), 'scripts', 'storage_manager.py')
+      const pythonProcess = spawn('python3', [scriptPath, 'cat', csvPath])
+      pythonProcess.stderr.on('data', (data) => {
+        console.error('storage_manager cat error:', data.toString())
+      })
+      return new Response(pythonProcess.stdout as unknown as ReadableStream, {
+        headers: {
+          'Content-Type': 'text/csv',
+          'Content-Disposition': `attachment; filename="${path.basename(csvPath)}"`,
+        },
+      })
+    } else if (type === 'csv') {
       const fileStream = createReadStream(fullPath)
       return new Response(fileStream as unknown as ReadableStream, {
         headers: {
@@ -99,24 +118,20 @@ export async function POST(request: NextRequest) {
         },
       })
     } else if (type === 'all') {
-      // 创建一个 ZIP 文件流
-      const archive = archiver('zip', {
-        zlib: { level: 9 }
+      // 由 export_archive.py 边遍历目录边输出 ZIP，下载立即开始；已压缩的媒体直接存储
+      const scriptPath = path.join(process.cwd(), 'scripts', 'export_archive.py')
+      const pythonProcess = spawn('python3', [scriptPath, '--group-folder', fullPath, '--format', 'zip'])
+      pythonProcess.stderr.on('data', (data) => {
+        console.error('export_archive error:', data.toString())
       })
-
-      // 设置错误处理
-      archive.on('error', (err) => {
-        console.error('Archiver error:', err)
+      // 客户端取消下载时停止打包
+      request.signal.addEventListener('abort', () => {
+        if (!pythonProcess.killed) {
+          pythonProcess.kill('SIGTERM')
+        }
       })
 
-      // 将整个目录添加到 ZIP
-      archive.directory(fullPath, false)
-
-      // 完成打包
-      archive.finalize()
-
-      // 将 archive 流转换为 ReadableStream
-      return new Response(Readable.from(archive) as unknown as ReadableStream, {
+      return new Response(pythonProcess.stdout as unknown as ReadableStream, {
         headers: {
           'Content-Type': 'application/zip',
           'Content-Disposition': `attachment; filename="${path.basename(fullPath)}.zip"`,
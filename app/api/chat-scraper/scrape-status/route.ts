@@ -0,0 +1,52 @@
+import { NextRequest, NextResponse } from 'next/server'
+import { readFile } from 'fs/promises'
+import path from 'path'
+import { verifyAuth, handleAuthError } from '@/lib/auth'
+
+export const dynamic = 'force-dynamic'
+
+// 读取抓取脚本原子写入的状态文件，前端可轮询而无需保持 stdout 管道
+export async function GET(request: NextRequest) {
+  try {
+    // 验证用户身份
+    const auth = await verifyAuth(request)
+    if (!auth.success || !auth.user) {
+      return handleAuthError(auth.error!)
+    }
+
+    const group = request.nextUrl.searchParams.get('group')
+    if (!group) {
+      return NextResponse.json(
+        { success: false, message: 'Group is required' },
+        { status: 400 }
+      )
+    }
+
+    // 与 scrape_messages.py 的 sanitize_filename 保持一致
+    const groupName = group.split('').filter(c => /[\p{L}\p{N} \-_.]/u.test(c)).join('')
+    const userDir = path.join(process.cwd(), 'scraped_data', auth.user.email)
+    const statusFile = path.join(userDir, groupName, 'scrape_status.json')
+    if (!groupName || !statusFile.startsWith(userDir + path.sep)) {
+      return NextResponse.json(
+        { success: false, message: 'Invalid group' },
+        { status: 400 }
+      )
+    }
+
+    try {
+      const status = JSON.parse(await readFile(statusFile, 'utf-8'))
+      return NextResponse.json({ success: true, status })
+    } catch {
+      return NextResponse.json(
+        { success: false, message: 'No scrape status available' },
+        { status: 404 }
+      )
+    }
+  } catch (error) {
+    console.error('Error reading scrape status:', error)
+    return NextResponse.json(
+      { success: false, message: 'Internal server error' },
+      { status: 500 }
+    )
+  }
+}
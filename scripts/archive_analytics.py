@@ -0,0 +1,351 @@
+"""
+Vectorized activity analytics over scraped exports
+
+Each export CSV is parsed once, in chunks, into a few NumPy columns
+(timestamp, message type, poster, counters). The columns are saved as a
+`.npz` file in the analytics cache and the aggregates of each file as JSON,
+both keyed by the CSV's mtime and size, so a report over many groups only
+re-reads the exports that changed since the last run. Reports cover:
+
+    messages per hour of day / weekday / day, media-type mix, top posters
+    (exports with a username column), reply rate and view totals (exports
+    with statistics columns, see message_stats.py)
+
+Usage:
+    python3 archive_analytics.py --user-email a@b.c                 # all groups
+    python3 archive_analytics.py --user-email a@b.c --group g1 --group g2 --top 20
+    python3 archive_analytics.py --file export.csv --file other.csv
+
+Environment:
+    ANALYTICS_CACHE_DIR   cache location (default: <project>/.cache/analytics)
+"""
+import os
+import csv
+import sys
+import json
+import time
+import hashlib
+import argparse
+from collections import Counter
+from datetime import datetime, timezone
+from config import MEDIA_DIR, ROOT_DIR
+from storage_manager import COMPRESSED_SUFFIX, open_text, resolve
+
+try:
+    import numpy as np
+except ImportError:
+    # main() 给出安装提示
+    np = None
+
+CACHE_DIR = os.environ.get('ANALYTICS_CACHE_DIR', os.path.join(ROOT_DIR, '.cache', 'analytics'))
+# 缓存格式变化时递增，旧缓存自动失效
+CACHE_VERSION = 2
+
+# 每次转换成数组的行数
+CHUNK_ROWS = 200_000
+
+# 消息类型编码（scrape_messages.get_message_content 的取值），其余类型归为 other
+TYPES = ('text', 'photo', 'video', 'sticker', 'file', 'media')
+OTHER_TYPE = len(TYPES)
+
+STAT_COLUMNS = ('views', 'forwards', 'replies', 'reactions')
+
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+
+def _cache_paths(csv_path):
+    key = hashlib.sha1(os.path.abspath(csv_path).encode('utf-8')).hexdigest()[:16]
+    stem = os.path.join(CACHE_DIR, f'{os.path.basename(csv_path)}.{key}')
+    return f'{stem}.npz', f'{stem}.json'
+
+def _file_key(csv_path):
+    # 导出被压缩到冷存储后按压缩文件计算，缓存随之重建
+    stat = os.stat(resolve(csv_path))
+    return [CACHE_VERSION, stat.st_mtime_ns, stat.st_size]
+
+# 列式读取
+class _ColumnBuilder:
+    """Turns chunks of CSV values into NumPy columns"""
+
+    def __init__(self, fieldnames):
+        self.has_users = 'username' in fieldnames
+        self.stats = [name for name in STAT_COLUMNS if name in fieldnames]
+        self.users = {'': -1}
+        self.parts = {'ts': [], 'type': [], 'user': []}
+        for name in self.stats:
+            self.parts[name] = []
+
+    def add(self, chunk):
+        # ISO 时间取前 19 位（UTC，秒精度），空值解析为 NaT
+        dates = np.asarray(chunk['date'], dtype='U19').astype('datetime64[s]')
+        self.parts['ts'].append(dates.astype(np.int64))
+
+        types = np.asarray(chunk['type'])
+        codes = np.full(len(types), OTHER_TYPE, dtype=np.uint8)
+        for code, name in enumerate(TYPES):
+            codes[types == name] = code
+        self.parts['type'].append(codes)
+
+        if self.has_users:
+            names, inverse = np.unique(np.asarray(chunk['username']), return_inverse=True)
+            lookup = np.array([self.users.setdefault(name, len(self.users) - 1) for name in names], dtype=np.int32)
+            self.parts['user'].append(lookup[inverse])
+
+        for name in self.stats:
+            values = np.asarray(chunk[name])
+            # 缺失的计数记为 -1
+            self.parts[name].append(np.where(values == '', '-1', values).astype(np.int64))
+
+    def columns(self):
+        columns = {name: np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+                   for name, parts in self.parts.items() if name != 'user' or self.has_users}
+        if self.has_users:
+            names = sorted(self.users, key=self.users.get)[1:]  # 去掉 '' -> -1
+            # 定长 unicode 数组，缓存读取时无需 pickle
+            columns['user_names'] = np.array(names, dtype=str)
+        return columns
+
+def _read_columns(csv_path):
+    csv.field_size_limit(sys.maxsize)
+    with open_text(csv_path) as f:
+        reader = csv.reader(f)
+        header = next(reader, None) or []
+        builder = _ColumnBuilder(header)
+        wanted = ['date', 'type'] + (['username'] if builder.has_users else []) + builder.stats
+        if 'date' not in header or 'type' not in header:
+            raise ValueError(f'{csv_path} is not a message export (no date/type columns)')
+        indexes = [header.index(name) for name in wanted]
+        width = len(header)
+
+        chunk = {name: [] for name in wanted}
+        for row in reader:
+            if len(row) != width:
+                continue
+            for name, index in zip(wanted, indexes):
+                chunk[name].append(row[index])
+            if len(chunk['date']) >= CHUNK_ROWS:
+                builder.add(chunk)
+                chunk = {name: [] for name in wanted}
+        if chunk['date']:
+            builder.add(chunk)
+    return builder.columns()
+
+def load_columns(csv_path, use_cache=True):
+    """Columns of an export as {name: ndarray}, from the columnar cache when it is current"""
+    npz_path, _ = _cache_paths(csv_path)
+    key = _file_key(csv_path)
+    if use_cache and os.path.exists(npz_path):
+        try:
+            # 缓存目录可能被他人写入，禁止反序列化 pickle 对象
+            with np.load(npz_path, allow_pickle=False) as data:
+                if data['key'].tolist() == key:
+                    return {name: data[name] for name in data.files if name != 'key'}
+        except (OSError, ValueError, KeyError):
+            pass
+
+    columns = _read_columns(csv_path)
+    if use_cache:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_path = f'{npz_path}.{os.getpid()}.tmp.npz'
+        np.savez(tmp_path, key=np.array(key), **columns)
+        os.replace(tmp_path, npz_path)
+    return columns
+
+# 聚合
+def _day_label(day):
+    return datetime.fromtimestamp(int(day) * 86400, tz=timezone.utc).strftime('%Y-%m-%d')
+
+def aggregate(columns):
+    """Per-export aggregates (JSON-serialisable, and mergeable across exports)"""
+    ts = columns['ts']
+    valid = ts != np.iinfo(np.int64).min  # NaT
+    ts = ts[valid]
+    days = ts // 86400
+
+    result = {
+        'rows': int(len(columns['ts'])),
+        'first': int(ts.min()) if len(ts) else None,
+        'last': int(ts.max()) if len(ts) else None,
+        'by_hour': np.bincount((ts // 3600) % 24, minlength=24).tolist(),
+        # 1970-01-01 是星期四
+        'by_weekday': np.bincount((days + 3) % 7, minlength=7).tolist(),
+        'types': np.bincount(columns['type'], minlength=OTHER_TYPE + 1).tolist()
+    }
+    unique_days, day_counts = np.unique(days, return_counts=True)
+    result['by_day'] = {_day_label(day): int(count) for day, count in zip(unique_days, day_counts)}
+
+    if 'user' in columns:
+        users = columns['user']
+        counts = np.bincount(users[users >= 0], minlength=len(columns['user_names']))
+        nonzero = np.flatnonzero(counts)
+        result['posters'] = {str(columns['user_names'][i]): int(counts[i]) for i in nonzero}
+
+    for name in STAT_COLUMNS:
+        if name in columns:
+            values = columns[name]
+            known = values >= 0
+            result[name] = {
+                'known': int(known.sum()),
+                'sum': int(values[known].sum()),
+                'nonzero': int((values > 0).sum())
+            }
+    return result
+
+def file_aggregates(csv_path, use_cache=True):
+    """Aggregates of one export, cached by the file's mtime and size"""
+    _, json_path = _cache_paths(csv_path)
+    key = _file_key(csv_path)
+    if use_cache and os.path.exists(json_path):
+        try:
+            with open(json_path, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+            if cached.get('key') == key:
+                return cached['aggregates']
+        except (OSError, ValueError):
+            pass
+
+    result = aggregate(load_columns(csv_path, use_cache))
+    if use_cache:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_path = f'{json_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'key': key, 'path': os.path.abspath(csv_path), 'aggregates': result}, f, ensure_ascii=False)
+        os.replace(tmp_path, json_path)
+    return result
+
+def merge(aggregates):
+    """Combine per-export aggregates into one"""
+    merged = {
+        'rows': 0, 'first': None, 'last': None,
+        'by_hour': [0] * 24, 'by_weekday': [0] * 7, 'types': [0] * (OTHER_TYPE + 1), 'by_day': Counter()
+    }
+    posters = None
+    stats = {}
+    for agg in aggregates:
+        merged['rows'] += agg['rows']
+        for bound, pick in (('first', min), ('last', max)):
+            if agg[bound] is not None:
+                merged[bound] = agg[bound] if merged[bound] is None else pick(merged[bound], agg[bound])
+        for name in ('by_hour', 'by_weekday', 'types'):
+            merged[name] = [a + b for a, b in zip(merged[name], agg[name])]
+        merged['by_day'].update(agg['by_day'])
+        if 'posters' in agg:
+            posters = posters or Counter()
+            posters.update(agg['posters'])
+        for name in STAT_COLUMNS:
+            if name in agg:
+                total = stats.setdefault(name, {'known': 0, 'sum': 0, 'nonzero': 0})
+                for field in total:
+                    total[field] += agg[name][field]
+    merged['by_day'] = dict(sorted(merged['by_day'].items()))
+    if posters is not None:
+        merged['posters'] = posters
+    merged.update(stats)
+    return merged
+
+def summarize(agg, top=10):
+    """Readable report section from (merged) aggregates"""
+    rows = agg['rows']
+    types = dict(zip(TYPES + ('other',), agg['types']))
+    days = agg['by_day']
+    summary = {
+        'messages': rows,
+        'first_message': datetime.fromtimestamp(agg['first'], tz=timezone.utc).isoformat() if agg['first'] is not None else None,
+        'last_message': datetime.fromtimestamp(agg['last'], tz=timezone.utc).isoformat() if agg['last'] is not None else None,
+        'active_days': len(days),
+        'messages_per_active_day': round(rows / len(days), 1) if days else 0,
+        'busiest_day': max(days.items(), key=lambda item: item[1]) if days else None,
+        'by_hour_utc': agg['by_hour'],
+        'by_weekday': dict(zip(WEEKDAYS, agg['by_weekday'])),
+        'by_day': days,
+        'media_mix': {name: round(count / rows, 4) for name, count in types.items() if count} if rows else {},
+        'type_counts': {name: count for name, count in types.items() if count}
+    }
+    posters = agg.get('posters')
+    if posters is not None:
+        summary['posters'] = len(posters)
+        summary['top_posters'] = [{'username': name, 'messages': count}
+                                  for name, count in Counter(posters).most_common(top)]
+    if 'replies' in agg and agg['replies']['known']:
+        replies = agg['replies']
+        summary['reply_rate'] = round(replies['nonzero'] / replies['known'], 4)
+        summary['replies_per_message'] = round(replies['sum'] / replies['known'], 3)
+    for name in ('views', 'forwards', 'reactions'):
+        if name in agg and agg[name]['known']:
+            summary[f'{name}_total'] = agg[name]['sum']
+            summary[f'{name}_per_message'] = round(agg[name]['sum'] / agg[name]['known'], 2)
+    return summary
+
+def find_exports(user_email, groups=None):
+    """{group folder name: [export CSV paths]} under the user's data directory"""
+    user_dir = os.path.join(MEDIA_DIR, user_email)
+    exports = {}
+    try:
+        folders = sorted(os.listdir(user_dir))
+    except OSError:
+        return exports
+    for folder in folders:
+        if groups and folder not in groups:
+            continue
+        group_dir = os.path.join(user_dir, folder)
+        if not os.path.isdir(group_dir):
+            continue
+        names = {name[:-len(COMPRESSED_SUFFIX)] if name.endswith(COMPRESSED_SUFFIX) else name for name in os.listdir(group_dir)}
+        paths = [os.path.join(group_dir, name) for name in sorted(names) if name.endswith('.csv')]
+        if paths:
+            exports[folder] = paths
+    return exports
+
+def build_report(exports, top=10, use_cache=True):
+    """Report with one section per group and a combined section; exports is {group: [csv paths]}"""
+    started = time.perf_counter()
+    groups = {}
+    all_aggregates = []
+    errors = {}
+    for group, paths in exports.items():
+        aggregates = []
+        for path in paths:
+            try:
+                aggregates.append(file_aggregates(path, use_cache))
+            except (OSError, ValueError) as e:
+                errors[path] = str(e)
+        if aggregates:
+            groups[group] = summarize(merge(aggregates), top)
+            all_aggregates.extend(aggregates)
+    report = {
+        'groups': groups,
+        'combined': summarize(merge(all_aggregates), top),
+        'elapsed_s': round(time.perf_counter() - started, 3)
+    }
+    if errors:
+        report['errors'] = errors
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description='Activity statistics over scraped message exports')
+    parser.add_argument('--user-email', help='Report on this user\'s scraped groups')
+    parser.add_argument('--group', action='append', help='Only this group folder (repeatable)')
+    parser.add_argument('--file', action='append', help='Export CSV to include (repeatable)')
+    parser.add_argument('--top', type=int, default=10, help='Number of top posters to list')
+    parser.add_argument('--no-cache', action='store_true', help='Ignore and do not write the analytics cache')
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+    args = parser.parse_args()
+
+    if np is None:
+        print(json.dumps({'type': 'error', 'message': 'archive_analytics requires numpy: pip install -r requirements.txt'}), file=sys.stderr)
+        sys.exit(1)
+    if not args.user_email and not args.file:
+        parser.error('--user-email or --file is required')
+
+    exports = find_exports(args.user_email, set(args.group or ())) if args.user_email else {}
+    for path in args.file or ():
+        exports.setdefault(os.path.basename(os.path.dirname(os.path.abspath(path))), []).append(path)
+
+    report = build_report(exports, args.top, not args.no_cache)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    else:
+        print(json.dumps(report, ensure_ascii=False))
+
+if __name__ == '__main__':
+    main()
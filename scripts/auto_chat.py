@@ -1,18 +1,11 @@
+from fast_start import check_dependencies as find_missing_packages, mark
 import sys
-import subprocess
 import io
-import itertools
-import json
 import os
-import pandas as pd
-from telethon import TelegramClient, types
 import asyncio
 import random
-from telethon.tl.types import InputPeerChannel, ReactionEmoji, DocumentAttributeVideo, DocumentAttributeAnimated
-from telethon.tl.functions.messages import GetHistoryRequest, SendReactionRequest
-import emoji
-from telethon.tl.functions.channels import JoinChannelRequest
 import argparse
+import logging
 from config import (
     API_ID,
     API_HASH,
@@ -21,45 +14,42 @@ from config import (
     REACTION_EMOJIS,
     PROXY_CONFIGS
 )
-
-# 立即输出启动信息
-print("=== Auto Chat Script Starting ===")
-print(f"Python version: {sys.version}")
-print(f"Current working directory: {os.getcwd()}")
-print(f"Script directory: {os.path.dirname(os.path.abspath(__file__))}")
-sys.stdout.flush()  # 确保立即输出
+from sticker_index import load_sticker_index
+from message_source import load_message_source
+from instrumentation import instrument_client
+from structured_log import setup_logging, emit
 
 # Set UTF-8 as default encoding for stdout
 sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
 
+# 日志经队列由后台线程写出（JSON 行）；生产环境默认只输出警告以上
+log = setup_logging('auto_chat')
+
+# 立即输出启动信息（协议行，不受日志级别影响，web 端据此确认进程已启动）
+emit({
+    'type': 'info',
+    'message': 'Auto chat script starting',
+    'pid': os.getpid(),
+    'python': sys.version.split()[0],
+    'cwd': os.getcwd(),
+    'script_dir': os.path.dirname(os.path.abspath(__file__))
+})
+
+REQUIRED_PACKAGES = {
+    'telethon': 'Telethon',
+    'python_socks': 'python-socks[asyncio]'
+}
+
 def check_dependencies():
-    """检查所需的包是否已安装"""
-    required_packages = {
-        'telethon': 'Telethon',
-        'pandas': 'pandas',
-        'emoji': 'emoji',
-        'python_socks': 'python-socks[asyncio]'
-    }
-    
-    missing_packages = []
-    
-    for import_name, package_name in required_packages.items():
-        try:
-            __import__(import_name)
-            print(f"Package {package_name} is installed")
-        except ImportError as e:
-            print(f"Failed to import {package_name}: {str(e)}")
-            missing_packages.append(package_name)
+    """检查所需的包是否已安装（只查找不导入，按需调用：--check-deps 或导入失败时）"""
+    missing_packages = find_missing_packages(REQUIRED_PACKAGES)
     
     if missing_packages:
-        print("\nMissing required packages:", ", ".join(missing_packages))
-        print("Please install them using: pip install -r requirements.txt")
-        sys.exit(1)
-    else:
-        print("\nAll required packages are installed")
-
-# Check dependencies
-check_dependencies()
+        log.error(f"Missing required packages: {', '.join(missing_packages)}")
+        log.error("Please install them using: pip install -r requirements.txt")
+        return False
+    log.info("All required packages are installed")
+    return True
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Auto chat script')
@@ -76,50 +66,46 @@ def parse_args():
     parser.add_argument('--reaction-probability', type=float, default=30.0, help='Probability (0-100) of reacting to a message')
     return parser.parse_args()
 
-async def try_connect_with_proxy(session_file, proxy_config, user_email):
-    """Try to connect using specific proxy"""
+async def try_connect_with_proxy(session_file, user_email, proxies=None):
+    """Connect a session through the healthiest of the configured proxies"""
     client = None
     try:
-        print(f"\nTrying to connect with session {session_file} using proxy {proxy_config['addr']}:{proxy_config['port']}")
+        log.debug(f"Trying to connect with session {session_file}")
         
         # 构建完整的session文件路径
         session_path = os.path.join(SESSIONS_DIR, user_email, session_file)
-        print(f"Session file path: {session_path}")
-        print(f"Session file exists: {os.path.exists(session_path)}")
-        
-        # 创建代理配置
-        proxy = {
-            'proxy_type': proxy_config['proxy_type'],
-            'addr': proxy_config['addr'],
-            'port': proxy_config['port'],
-            'username': proxy_config['username'],
-            'password': proxy_config['password'],
-            'rdns': True
-        }
-        
-        # 创建客户端
+        log.debug(f"Session file path: {session_path}")
+        log.debug(f"Session file exists: {os.path.exists(session_path)}")
+        
+        # 创建客户端（telethon 延迟到真正连接时才导入）
+        from telethon import TelegramClient
+        from session_store import open_session
+        from proxy_pool import connect_client, proxy_key
         client = TelegramClient(
-            session_path,
+            open_session(session_path),
             API_ID,
-            API_HASH,
-            proxy=proxy
+            API_HASH
         )
+        instrument_client(client)
         
-        print("Connecting to Telegram...")
-        await client.connect()
+        log.debug("Connecting to Telegram...")
+        # 按健康状况对代理排序并竞速，失败时自动换下一个
+        proxy = await connect_client(client, PROXY_CONFIGS if proxies is None else proxies)
+        if proxy is not None:
+            log.debug(f"Connected through {proxy_key(proxy)}")
         
         if not await client.is_user_authorized():
-            print(f"[FAILED] Session {session_file} is not authorized")
+            log.warning(f"[FAILED] Session {session_file} is not authorized")
             await client.disconnect()
             return None
             
         me = await client.get_me()
-        print(f"[SUCCESS] Connected successfully with {session_file}")
-        print(f"       Account: {me.first_name} (@{me.username})")
+        mark('connected')
+        log.info(f"[SUCCESS] Connected successfully with {session_file} as {me.first_name} (@{me.username})")
         return client
         
     except Exception as e:
-        print(f"[FAILED] Connection failed for {session_file} using proxy {proxy_config['addr']}: {str(e)}")
+        log.warning(f"[FAILED] Connection failed for {session_file}: {str(e)}")
         if client:
             try:
                 await client.disconnect()
@@ -128,198 +114,210 @@ async def try_connect_with_proxy(session_file, proxy_config, user_email):
         return None
 
 async def init_clients(user_email):
-    """Initialize all clients with proxy rotation"""
+    """Initialize all clients, each through the healthiest proxy"""
     try:
         # 构建用户特定的session目录
         user_sessions_dir = os.path.join(SESSIONS_DIR, user_email)
-        print(f"\nInitializing clients for user: {user_email}")
-        print(f"Sessions directory: {user_sessions_dir}")
-        print(f"Sessions directory exists: {os.path.exists(user_sessions_dir)}")
-        print(f"Current working directory: {os.getcwd()}")
+        log.debug(f"Initializing clients for user: {user_email}")
+        log.debug(f"Sessions directory: {user_sessions_dir}")
+        log.debug(f"Sessions directory exists: {os.path.exists(user_sessions_dir)}")
+        log.debug(f"Current working directory: {os.getcwd()}")
         
         if not os.path.exists(user_sessions_dir):
-            print(f"Creating sessions directory: {user_sessions_dir}")
+            log.debug(f"Creating sessions directory: {user_sessions_dir}")
             os.makedirs(user_sessions_dir, exist_ok=True)
             
-        session_files = [f for f in os.listdir(user_sessions_dir) if f.endswith('.session')]
-        print(f"\nFound {len(session_files)} session files:")
+        # 与 telethon 一样延迟导入
+        from session_db import list_session_files
+        session_files = list_session_files(user_sessions_dir)
+        log.debug(f"Found {len(session_files)} session files:")
         for sf in session_files:
-            print(f" - {sf}")
+            log.debug(f" - {sf}")
         
         if not session_files:
-            print("\nNo session files found. Please generate sessions first.")
+            log.error("No session files found. Please generate sessions first.")
             return []
             
-        print("\nTesting proxy configurations:")
-        for i, proxy in enumerate(PROXY_CONFIGS):
-            print(f" {i+1}. {proxy['proxy_type']}://{proxy['addr']}:{proxy['port']}")
+        # 并行检查所有代理一次，之后各会话按测得的延迟竞速
+        from proxy_pool import check_proxies, proxy_key
+        ranked = await check_proxies(PROXY_CONFIGS)
+        log.debug("Proxy ranking:")
+        for i, proxy in enumerate(ranked):
+            log.debug(f" {i+1}. {proxy_key(proxy)}")
             
         clients = []
         successful_clients = 0
         
         for session_file in session_files:
-            print(f"\nTrying to connect with session: {session_file}")
-            client = None
-            
-            # Try all proxies
-            for proxy in PROXY_CONFIGS:
-                client = await try_connect_with_proxy(session_file, proxy, user_email)
-                if client:
-                    clients.append(client)
-                    successful_clients += 1
-                    print(f"Successfully connected {successful_clients}/{len(session_files)} clients")
-                    break
-            
-            if not client:
-                print(f"Warning: {session_file} failed to connect with all proxies!")
+            log.debug(f"Trying to connect with session: {session_file}")
+            client = await try_connect_with_proxy(session_file, user_email)
+            if client:
+                clients.append(client)
+                successful_clients += 1
+                log.debug(f"Successfully connected {successful_clients}/{len(session_files)} clients")
+            else:
+                log.warning(f"Warning: {session_file} failed to connect with all proxies!")
         
-        print(f"\nClient initialization complete:")
-        print(f"Total sessions: {len(session_files)}")
-        print(f"Successful connections: {successful_clients}")
+        log.info(f"Client initialization complete: {successful_clients}/{len(session_files)} sessions connected")
         
         return clients
         
     except Exception as e:
-        print(f"Error initializing clients: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.error(f"Error initializing clients: {str(e)}", exc_info=True)
         return []
 
+class ClientContext:
+    """Per-client cache of the account identity and the target group entity
+
+    Resolved once when the chat loop starts; invalidated after an error so the
+    next use fetches fresh values.
+    """
+
+    def __init__(self, client, target_group):
+        self.client = client
+        self.target_group = target_group
+        self.me = None
+        self.channel = None
+
+    async def resolve(self):
+        """Fetch whatever is not cached yet"""
+        if self.me is None:
+            self.me = await self.client.get_me()
+        if self.channel is None:
+            self.channel = await self.client.get_entity(self.target_group)
+        return self
+
+    def invalidate(self):
+        self.me = None
+        self.channel = None
+
 async def join_group(client, target_group):
+    from telethon.tl.functions.channels import JoinChannelRequest
     try:
-        print(f"Attempting to join group: {target_group}")
+        log.debug(f"Attempting to join group: {target_group}")
         await client(JoinChannelRequest(target_group))
-        print(f"Successfully joined {target_group}")
+        log.debug(f"Successfully joined {target_group}")
     except Exception as e:
-        print(f"Failed to join group: {str(e)}")
+        log.warning(f"Failed to join group: {str(e)}")
 
-async def get_recent_messages(client, target_group, limit=5, use_topic=False, topic_id=None):
+async def get_recent_messages(client, channel, limit=5, use_topic=False, topic_id=None):
     try:
-        print(f"Getting recent messages - Group: {target_group}, Topic mode: {use_topic}, Topic ID: {topic_id}")
-        channel = await client.get_entity(target_group)
+        log.debug(f"Getting recent messages - Group: {channel.title}, Topic mode: {use_topic}, Topic ID: {topic_id}")
         messages = []
         kwargs = {}
         if use_topic:
             kwargs['reply_to'] = topic_id
         async for message in client.iter_messages(channel, limit=limit, **kwargs):
             messages.append(message)
-        print(f"Successfully retrieved {len(messages)} messages")
+        log.debug(f"Successfully retrieved {len(messages)} messages")
         return messages[::-1]  # Reverse message list
     except Exception as e:
-        print(f"Failed to get messages: {str(e)}")
+        log.warning(f"Failed to get messages: {str(e)}")
         return []
 
-async def get_sticker_from_message(client, message_data, media_dir):
-    """Get sticker object from message"""
+async def get_sticker_from_message(client, message_data, sticker_refs):
+    """Get sticker object from message using the preloaded sticker index"""
     try:
         media_file = message_data.get('media_file')
-        if not media_file or pd.isna(media_file):
+        if not media_file:
             return None
             
         # 处理 media_file 路径，确保正确的格式
         if media_file.startswith('media/'):
             media_file = media_file[6:]  # 去掉 'media/' 前缀
             
-        # 构建 JSON 文件路径 (将 .webp 替换为 .json)
+        # 索引以不带扩展名的文件名为键
         base_name = os.path.splitext(media_file)[0]
-        json_path = os.path.join(media_dir, base_name + '.json')
-        
-        print(f"\nDebug sticker info:")
-        print(f"Looking for sticker info at: {json_path}")
+        sticker_info = sticker_refs.get(base_name)
         
-        if not os.path.exists(json_path):
-            print(f"Sticker info not found: {json_path}")
+        if not sticker_info:
+            log.warning(f"Sticker info not found in index: {base_name}")
             return None
             
-        # 加载 sticker 信息
-        with open(json_path, 'r') as f:
-            sticker_info = json.load(f)
-            print(f"Loaded sticker info: {sticker_info}")
-            
         # 创建 InputDocument
+        from telethon import types
+        doc_id, access_hash, file_reference = sticker_info
         input_doc = types.InputDocument(
-            id=int(sticker_info['id']),
-            access_hash=int(sticker_info['access_hash']),
-            file_reference=bytes.fromhex(sticker_info['file_reference'])
+            id=doc_id,
+            access_hash=access_hash,
+            file_reference=file_reference
         )
-        print(f"Created InputDocument with id: {input_doc.id}")
+        log.debug(f"Created InputDocument with id: {input_doc.id}")
         return input_doc
         
     except Exception as e:
-        print(f"Error getting sticker: {str(e)}")
-        traceback.print_exc()
+        log.warning(f"Error getting sticker: {str(e)}", exc_info=log.isEnabledFor(logging.DEBUG))
     return None
 
-async def process_message(client, message_data, target_group, recent_messages, topic_id=None, media_dir=None, reply_probability=30.0, reaction_probability=30.0):
+async def process_message(ctx, message_data, recent_messages, topic_id=None, media_dir=None, reply_probability=30.0, reaction_probability=30.0, sticker_refs=None):
     """Process a single message
     
     Args:
+        ctx: ClientContext with the resolved account and target group
         reply_probability: Probability (0-100) of replying to a message
         reaction_probability: Probability (0-100) of reacting to a message
+        sticker_refs: Preloaded sticker index of the message source
     """
+    from telethon import types
+    from telethon.tl.types import ReactionEmoji
+    from telethon.tl.functions.messages import SendReactionRequest
     try:
-        print(f"\nProcessing message data:")
-        print(f"Type: {message_data['type']}")
-        print(f"Content: {message_data['content'][:50]}..." if not pd.isna(message_data['content']) else "No content")
-        print(f"Media file: {message_data['media_file']}" if not pd.isna(message_data['media_file']) else "No media")
-        print(f"Topic ID: {topic_id}")
-        print(f"Reply probability: {reply_probability}%, Reaction probability: {reaction_probability}%")
-        
-        # 获取目标群组实体
-        try:
-            channel = await client.get_entity(target_group)
-            print(f"Successfully got channel entity: {channel.title}")
-        except Exception as e:
-            print(f"Failed to get channel entity: {str(e)}")
-            raise
+        log.debug("Processing message data:")
+        log.debug(f"Type: {message_data['type']}")
+        log.debug(f"Content: {message_data['content'][:50]}..." if message_data['content'] else "No content")
+        log.debug(f"Media file: {message_data['media_file']}" if message_data['media_file'] else "No media")
+        log.debug(f"Topic ID: {topic_id}")
+        log.debug(f"Reply probability: {reply_probability}%, Reaction probability: {reaction_probability}%")
+        
+        # 使用缓存的客户端和群组实体
+        client = ctx.client
+        channel = ctx.channel
         
         # 基础发送参数
         kwargs = {}
         if topic_id:  # 如果指定了topic_id，所有消息都需要发送到对应的topic
             kwargs['reply_to'] = topic_id
-            print(f"Setting reply_to topic: {topic_id}")
+            log.debug(f"Setting reply_to topic: {topic_id}")
             
         # 转换概率为0-1范围
         reply_prob = reply_probability / 100.0
         reaction_prob = reaction_probability / 100.0
         
         random_value = random.random()
-        print(f"Random value for interaction: {random_value}")
+        log.debug(f"Random value for interaction: {random_value}")
         
         # 根据设定的概率回复消息
         if random_value < reply_prob and recent_messages:
             target_message = recent_messages[-1]  # 回复最新消息
             kwargs['reply_to'] = target_message.id
-            print(f"Will reply to message: {target_message.id}")
+            log.debug(f"Will reply to message: {target_message.id}")
         
         # 根据设定的概率添加表情回应
         elif random_value < (reply_prob + reaction_prob) and recent_messages:
             target_message = recent_messages[-1]
             reaction = random.choice(REACTION_EMOJIS)
-            print(f"Will react with {reaction} to message: {target_message.id}")
+            log.debug(f"Will react with {reaction} to message: {target_message.id}")
             try:
                 await client(SendReactionRequest(
                     peer=channel,
                     msg_id=target_message.id,
                     reaction=[ReactionEmoji(emoticon=reaction)]
                 ))
-                me = await client.get_me()
-                print(f"[{me.first_name}] Successfully reacted with {reaction}")
+                log.info(f"[{ctx.me.first_name}] Successfully reacted with {reaction}")
                 return
             except Exception as e:
-                print(f"Failed to add reaction: {str(e)}")
-                traceback.print_exc()
+                log.warning(f"Failed to add reaction: {str(e)}", exc_info=log.isEnabledFor(logging.DEBUG))
             return
             
         # 发送消息（包括普通发送和回复）
         if message_data['type'] in ['photo', 'file', 'sticker']:
-            print(f"\nProcessing media message:")
-            print(f"Media directory: {media_dir}")
-            print(f"Media type: {message_data['type']}")
+            log.debug("Processing media message:")
+            log.debug(f"Media directory: {media_dir}")
+            log.debug(f"Media type: {message_data['type']}")
             
-            # 检查media_file是否为空或NaN
-            if pd.isna(message_data['media_file']):
-                print("Warning: media_file is NaN")
+            # 检查media_file是否为空
+            if not message_data['media_file']:
+                log.warning("Warning: media_file is empty")
                 return
                 
             # 获取media_file，确保不重复media路径
@@ -330,21 +328,23 @@ async def process_message(client, message_data, target_group, recent_messages, t
                 
             # 构建完整路径
             media_path = os.path.normpath(os.path.join(media_dir, media_file))
-            print(f"Full media path: {media_path}")
-            print(f"File exists: {os.path.exists(media_path)}")
+            log.debug(f"Full media path: {media_path}")
+            # 预编译的消息源已在编译时校验过媒体文件
+            media_exists = message_data.get('media_verified') or os.path.exists(media_path)
+            log.debug(f"File exists: {media_exists}")
             
-            if os.path.exists(media_path):
+            if media_exists:
                 # 检查文件扩展名
                 file_ext = os.path.splitext(media_path)[1].lower()
-                print(f"File extension: {file_ext}")
+                log.debug(f"File extension: {file_ext}")
                 
                 if message_data['type'] == 'sticker':
-                    print("Processing sticker...")
+                    log.debug("Processing sticker...")
                     # 尝试使用 sticker ID 发送
-                    sticker = await get_sticker_from_message(client, message_data, media_dir)
+                    sticker = await get_sticker_from_message(client, message_data, sticker_refs or {})
                     if sticker:
                         try:
-                            print(f"Got sticker ID: {sticker.id}")
+                            log.debug(f"Got sticker ID: {sticker.id}")
                             # 创建 InputMediaDocument
                             media = types.InputMediaDocument(
                                 id=sticker,
@@ -359,14 +359,13 @@ async def process_message(client, message_data, target_group, recent_messages, t
                                 file=media,  # 使用 media 参数
                                 **kwargs
                             )
-                            print(f"Successfully sent sticker using ID: {sticker.id}")
+                            log.debug(f"Successfully sent sticker using ID: {sticker.id}")
                             return
                         except Exception as e:
-                            print(f"Failed to send sticker using ID: {str(e)}")
-                            traceback.print_exc()
+                            log.warning(f"Failed to send sticker using ID: {str(e)}", exc_info=log.isEnabledFor(logging.DEBUG))
                     
                     # 如果使用 ID 发送失败，尝试直接发送文件
-                    print("Falling back to sending sticker as file...")
+                    log.debug("Falling back to sending sticker as file...")
                     try:
                         await client.send_file(
                             channel,
@@ -374,38 +373,37 @@ async def process_message(client, message_data, target_group, recent_messages, t
                             force_document=True,  # 强制作为文档发送
                             **kwargs
                         )
-                        print(f"Successfully sent sticker as file: {media_path}")
+                        log.debug(f"Successfully sent sticker as file: {media_path}")
                         return
                     except Exception as e:
-                        print(f"Failed to send sticker as file: {str(e)}")
-                        traceback.print_exc()
+                        log.warning(f"Failed to send sticker as file: {str(e)}", exc_info=log.isEnabledFor(logging.DEBUG))
                         return
                         
                 elif message_data['type'] == 'photo':
-                    print("Sending photo...")
+                    log.debug("Sending photo...")
                     await client.send_file(
                         channel,
                         media_path,
                         **kwargs
                     )
-                    print("Successfully sent photo")
+                    log.debug("Successfully sent photo")
                 else:  # file
-                    print("Sending file...")
+                    log.debug("Sending file...")
                     await client.send_file(
                         channel,
                         media_path,
                         **kwargs
                     )
-                    print("Successfully sent file")
+                    log.debug("Successfully sent file")
             else:
-                print(f"Error: Media file not found: {media_path}")
-                print(f"Current working directory: {os.getcwd()}")
+                log.warning(f"Error: Media file not found: {media_path}")
+                log.debug(f"Current working directory: {os.getcwd()}")
                 return
                 
         elif message_data['type'] == 'text':
-            print("Sending text message...")
-            if pd.isna(message_data['content']):
-                print("Error: Message content is empty")
+            log.debug("Sending text message...")
+            if not message_data['content']:
+                log.warning("Error: Message content is empty")
                 return
                 
             await client.send_message(
@@ -413,166 +411,162 @@ async def process_message(client, message_data, target_group, recent_messages, t
                 message_data['content'],
                 **kwargs
             )
-            print("Successfully sent text message")
+            log.debug("Successfully sent text message")
             
-        me = await client.get_me()
-        content_preview = message_data['content'][:50] if not pd.isna(message_data['content']) else "[Media message]"
-        print(f"[{me.first_name}] Successfully sent message: {content_preview}...")
+        content_preview = message_data['content'][:50] if message_data['content'] else "[Media message]"
+        log.info(f"[{ctx.me.first_name}] Successfully sent message: {content_preview}...")
         
     except Exception as e:
-        print(f"Failed to process message: {str(e)}")
-        traceback.print_exc()
+        log.debug(f"Failed to process message: {str(e)}")
         raise  # 重新抛出异常，让上层函数处理
 
-async def run_chat_loop(clients, df, args, media_dir):
+async def run_chat_loop(clients, source, args, media_dir, sticker_refs=None):
     """运行主聊天循环"""
-    print("\nStarting chat loop...")
+    log.debug("Starting chat loop...")
     
     if not clients:
-        print("Error: No clients available")
+        log.error("Error: No clients available")
         return
         
-    if df.empty:
-        print("Error: No messages to send (DataFrame is empty)")
+    if not len(source):
+        log.error("Error: No messages to send (message source is empty)")
         return
         
     try:
         # 获取目标群组
         target_group = args.target_group
-        print(f"Connecting to target group: {target_group}")
+        log.debug(f"Connecting to target group: {target_group}")
         
-        # 连接到群组
+        # 连接到群组，并为每个客户端缓存账号和群组实体
         active_clients = []
         for client in clients:
             try:
                 await join_group(client, target_group)
-                print(f"Successfully joined group with client {client.session.filename}")
-                active_clients.append(client)
+                log.info(f"Successfully joined group with client {client.session.filename}")
+                active_clients.append(await ClientContext(client, target_group).resolve())
             except Exception as e:
-                print(f"Error joining group with client {client.session.filename}: {str(e)}")
+                log.warning(f"Error joining group with client {client.session.filename}: {str(e)}")
                 continue
                 
         if not active_clients:
-            print("Error: No clients could join the target group")
+            log.error("Error: No clients could join the target group")
             return
             
         while True:  # 添加外部循环
-            print("\n=== Starting new message cycle ===")
+            log.debug("=== Starting new message cycle ===")
             
             # 随机选择起始位置
-            total_messages = len(df)
+            total_messages = len(source)
             start_index = random.randint(0, total_messages - 1)
             
-            # 反转DataFrame的顺序（从最新到最旧）
-            df_reversed = df.iloc[::-1].reset_index(drop=True)
-            
             # 创建消息发送序列：从随机位置开始，到末尾，然后从头开始（如果启用循环）
-            # 计算实际的起始位置（在反转后的DataFrame中）
-            print(f"\nStarting message loop with {len(active_clients)} active clients")
-            print(f"Total messages available: {total_messages}")
-            print(f"Starting from random position: {start_index + 1}/{total_messages}")
-            print("Messages will be sent from this position onwards (newest to oldest order)")
+            # 按反转后的顺序读取（row_reversed 直接按下标访问，不复制数据）
+            log.info(f"Starting message loop with {len(active_clients)} active clients from position {start_index + 1}/{total_messages}")
+            log.debug("Messages will be sent from this position onwards (newest to oldest order)")
             
             # 开始消息循环
             message_count = 0
             current_index = start_index
             
-            while current_index < len(df_reversed):
+            while current_index < total_messages:
                 # 获取当前消息
                 
-                row = df_reversed.iloc[current_index]
+                row = source.row_reversed(current_index)
                 index = current_index
                 try:
                     # 随机选择一个客户端
-                    client = random.choice(active_clients)
-                    me = await client.get_me()
-                    print(f"\nProcessing message {index + 1}/{len(df_reversed)} (position in reversed order)")
-                    print(f"Using client: {me.username} ({client.session.filename})")
+                    ctx = random.choice(active_clients)
+                    client = ctx.client
+                    await ctx.resolve()
+                    log.debug(f"Processing message {index + 1}/{total_messages} (position in reversed order)")
+                    log.debug(f"Using client: {ctx.me.username} ({client.session.filename})")
                     
                     # 获取最近消息用于上下文
                     try:
                         recent_messages = await get_recent_messages(
                             client, 
-                            target_group,
+                            ctx.channel,
                             use_topic=args.topic,
                             topic_id=args.topic_id
                         )
-                        print(f"Retrieved {len(recent_messages)} recent messages for context")
+                        log.debug(f"Retrieved {len(recent_messages)} recent messages for context")
                     except Exception as e:
-                        print(f"Error getting recent messages: {str(e)}")
+                        log.warning(f"Error getting recent messages: {str(e)}")
                         recent_messages = []
                     
                     # 检查消息数据
-                    if pd.isna(row['content']) and pd.isna(row['media']):
-                        print("Warning: Empty message data, skipping...")
+                    if not row['content'] and not row['media_file']:
+                        log.warning("Warning: Empty message data, skipping...")
                         continue
                         
                     # 处理并发送消息
                     try:
                         await process_message(
-                            client,
+                            ctx,
                             row,
-                            target_group,
                             recent_messages,
                             topic_id=args.topic_id if args.topic else None,
                             media_dir=media_dir,
                             reply_probability=args.reply_probability,
-                            reaction_probability=args.reaction_probability
+                            reaction_probability=args.reaction_probability,
+                            sticker_refs=sticker_refs
                         )
                         message_count += 1
-                        print(f"Successfully sent message {message_count}")
+                        log.debug(f"Successfully sent message {message_count}")
                     except Exception as e:
-                        print(f"Error processing message: {str(e)}")
+                        log.warning(f"Error processing message: {str(e)}")
+                        # 出错后下次使用时重新获取账号和群组实体
+                        ctx.invalidate()
                         # 如果是认证错误，从活动客户端列表中移除
                         if "auth" in str(e).lower():
-                            print(f"Removing client {client.session.filename} due to auth error")
-                            active_clients.remove(client)
+                            log.warning(f"Removing client {client.session.filename} due to auth error")
+                            active_clients.remove(ctx)
                             if not active_clients:
-                                print("Error: No active clients remaining")
+                                log.error("Error: No active clients remaining")
                                 return
                         continue
                     
                     # 等待随机时间间隔
                     interval = random.uniform(args.min_interval, args.max_interval)
-                    print(f"Waiting {interval:.1f} seconds before next message...")
+                    log.debug(f"Waiting {interval:.1f} seconds before next message...")
                     await asyncio.sleep(interval)
                     
                 except Exception as e:
-                    print(f"Error in message loop: {str(e)}")
+                    log.warning(f"Error in message loop: {str(e)}")
                 finally:
                     # 移动到下一条消息
                     current_index += 1
             
-            print(f"\nMessage cycle completed. Sent {message_count} messages successfully.")
+            log.info(f"Message cycle completed. Sent {message_count} messages successfully.")
             
             # 检查是否启用了循环
             if not args.enable_loop:
-                print("Loop mode not enabled, exiting...")
+                log.info("Loop mode not enabled, exiting...")
                 break
                 
-            print("\nLoop mode enabled, waiting before starting next cycle...")
+            log.info("Loop mode enabled, waiting before starting next cycle...")
             # 在循环之间添加额外的延迟
             await asyncio.sleep(random.uniform(args.min_interval * 2, args.max_interval * 2))
         
     except Exception as e:
-        print(f"Fatal error in chat loop: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.error(f"Fatal error in chat loop: {str(e)}", exc_info=True)
 
 async def main():
     try:
         # Parse command line arguments
         args = parse_args()
-        
-        print("\n=== Starting Auto Chat ===")
-        print(f"Target group: {args.target_group}")
-        print(f"Is topic group: {args.topic}")
-        print(f"Topic ID: {args.topic_id}")
-        print(f"Message interval: {args.min_interval}-{args.max_interval}")
-        print(f"Message source: {args.message_source}")
-        print(f"Root directory: {args.root_dir}")
-        print(f"User email: {args.user_email}")
-        print(f"Loop mode: {args.enable_loop}")
+        mark('args_parsed')
+        
+        log.info("Starting auto chat", extra={'fields': {
+            'target_group': args.target_group,
+            'topic': args.topic,
+            'topic_id': args.topic_id,
+            'interval': [args.min_interval, args.max_interval],
+            'message_source': args.message_source,
+            'root_dir': args.root_dir,
+            'user_email': args.user_email,
+            'loop': args.enable_loop
+        }})
         
         # 检查消息源文件
         message_source_path = os.path.join(
@@ -582,25 +576,35 @@ async def main():
             args.message_source,
             f"{args.message_source}_messages.csv"
         )
-        print(f"\nChecking message source file: {message_source_path}")
+        log.debug(f"Checking message source file: {message_source_path}")
         
-        if not os.path.exists(message_source_path):
-            print(f"Error: Message source file not found: {message_source_path}")
+        # CSV 可能已被压缩到冷存储（.zst），按实际存在的文件判断
+        from storage_manager import resolve
+        try:
+            csv_mtime = os.path.getmtime(resolve(message_source_path))
+        except FileNotFoundError:
+            log.error(f"Error: Message source file not found: {message_source_path}")
             sys.exit(1)
             
+        # 优先使用 compile_source.py 生成的预编译消息源（需比 CSV 新）
+        pack_path = os.path.splitext(message_source_path)[0] + '.pack'
+        if os.path.exists(pack_path) and os.path.getmtime(pack_path) >= csv_mtime:
+            log.info(f"Using compiled message source: {pack_path}")
+            message_source_path = pack_path
+            
         try:
-            df = pd.read_csv(message_source_path)
-            print(f"Successfully loaded message source file. Found {len(df)} messages.")
+            source = load_message_source(message_source_path)
+            log.info(f"Successfully loaded message source file. Found {len(source)} messages.")
         except Exception as e:
-            print(f"Error reading message source file: {str(e)}")
+            log.error(f"Error reading message source file: {str(e)}")
             sys.exit(1)
         
         # 检查会话目录
         session_dir = os.path.join(args.root_dir, SESSIONS_DIR, args.user_email)
-        print(f"\nChecking session directory: {session_dir}")
+        log.debug(f"Checking session directory: {session_dir}")
         
         if not os.path.exists(session_dir):
-            print(f"Creating session directory: {session_dir}")
+            log.debug(f"Creating session directory: {session_dir}")
             os.makedirs(session_dir, exist_ok=True)
         
         # 检查媒体目录
@@ -611,45 +615,49 @@ async def main():
             args.message_source,
             'media'
         )
-        print(f"\nChecking media directory: {media_dir}")
+        log.debug(f"Checking media directory: {media_dir}")
         
         if not os.path.exists(media_dir):
-            print(f"Creating media directory: {media_dir}")
+            log.debug(f"Creating media directory: {media_dir}")
             os.makedirs(media_dir, exist_ok=True)
         
+        # 一次性加载贴纸索引（旧的 sticker_*.json 会自动迁移）
+        sticker_refs = load_sticker_index(media_dir)
+        log.info(f"Loaded {len(sticker_refs)} sticker references")
+        
         try:
+            # 连接前才检查依赖（只查找模块，不导入）
+            if not check_dependencies():
+                sys.exit(1)
+            
             # 初始化客户端
-            print("\nInitializing Telegram clients...")
+            log.debug("Initializing Telegram clients...")
             clients = await init_clients(args.user_email)
             
             if not clients:
-                print("Error: No valid clients found")
+                log.error("Error: No valid clients found")
                 sys.exit(1)
                 
-            print(f"Successfully initialized {len(clients)} clients")
+            log.info(f"Successfully initialized {len(clients)} clients")
             
             # 运行主循环
-            print("\nStarting chat loop...")
-            await run_chat_loop(clients, df, args, media_dir)
+            log.debug("Starting chat loop...")
+            await run_chat_loop(clients, source, args, media_dir, sticker_refs)
             
         except Exception as e:
-            print(f"Error in main function: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            log.error(f"Error in main function: {str(e)}", exc_info=True)
             sys.exit(1)
             
     except Exception as e:
-        print(f"Fatal error in main: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.error(f"Fatal error in main: {str(e)}", exc_info=True)
         sys.exit(1)
 
 if __name__ == "__main__":
+    if '--check-deps' in sys.argv:
+        sys.exit(0 if check_dependencies() else 1)
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
-        print("\nReceived keyboard interrupt, stopping...")
+        log.info("Received keyboard interrupt, stopping...")
     except Exception as e:
-        print(f"Fatal error: {str(e)}")
-        import traceback
-        traceback.print_exc()
\ No newline at end of file
+        log.error(f"Fatal error: {str(e)}", exc_info=True)
\ No newline at end of file
@@ -0,0 +1,264 @@
+"""
+Offline benchmark suite for the scraper and message-source loading
+
+Each scenario runs in its own subprocess against FakeTelegramClient (no
+network) inside a temporary directory, and reports rows/sec, media MB/sec,
+peak RSS and bytes written to disk.
+
+Usage:
+    python bench_scrape.py                      # all scenarios
+    python bench_scrape.py --scenario scrape_text --scale 0.1
+    python bench_scrape.py --output bench.json
+"""
+import os
+import sys
+import csv
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 场景参数：group 传给 SyntheticGroup，client 传给 FakeTelegramClient
+SCENARIOS = {
+    'scrape_text': {
+        'description': '100k text-only messages, media skipped',
+        'group': {'size': 100000, 'media_mix': {}},
+        'scrape': {'limit': 100000, 'skip_media': True}
+    },
+    'scrape_mixed_media': {
+        'description': '5k messages with the default media mix, media downloaded',
+        'group': {'size': 5000},
+        'scrape': {'limit': 5000, 'skip_media': False}
+    },
+    'scrape_topics_bots': {
+        'description': '50k messages in 10 topics with 20% bot senders, one topic scraped',
+        'group': {'size': 50000, 'topics': 10, 'bot_ratio': 0.2, 'media_mix': {}},
+        'scrape': {'limit': 50000, 'skip_media': True, 'topic_id': 3}
+    },
+    'scrape_date_range': {
+        'description': '40k messages, date range covering the middle half',
+        'group': {'size': 40000, 'media_mix': {}, 'interval_seconds': 60},
+        'scrape': {'date_range': (0.25, 0.75), 'skip_media': True}
+    },
+    'scrape_latency_flood': {
+        'description': '10k messages with 5ms latency per round trip and a 1s flood wait every 50 requests',
+        'group': {'size': 10000, 'media_mix': {}},
+        'client': {'latency': 0.005, 'flood_every': 50, 'flood_seconds': 1},
+        'scrape': {'limit': 10000, 'skip_media': True}
+    },
+    'message_source_load': {
+        'description': 'Load a 200k-row message source from CSV and from a compiled pack, walking every row',
+        'group': {'size': 200000},
+        'source': True
+    }
+}
+
+def _proc_write_bytes():
+    """Bytes passed to write() by this process so far (Linux only)"""
+    try:
+        with open('/proc/self/io', 'r') as f:
+            for line in f:
+                if line.startswith('wchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 以字节为单位，Linux 以 KB 为单位
+    return round(peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024, 1)
+
+def _folder_size(path):
+    total = 0
+    for dir_path, _, file_names in os.walk(path):
+        for name in file_names:
+            try:
+                total += os.path.getsize(os.path.join(dir_path, name))
+            except OSError:
+                pass
+    return total
+
+def _count_csv_rows(path):
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        return sum(1 for _ in csv.DictReader(f))
+
+def _scaled(value, scale):
+    return max(1, int(value * scale))
+
+async def _run_scrape(spec, scale, work_dir):
+    import scrape_messages
+    from fake_telegram import SyntheticGroup, FakeTelegramClient
+
+    group_params = dict(spec['group'])
+    group_params['size'] = _scaled(group_params['size'], scale)
+    group = SyntheticGroup(**group_params)
+    client = FakeTelegramClient(group, **spec.get('client', {}))
+    scrape_messages.DATA_DIR = os.path.join(work_dir, 'scraped_data')
+
+    params = dict(spec['scrape'])
+    user_email = 'bench@local'
+    start = time.perf_counter()
+    if 'date_range' in params:
+        first, last = params['date_range']
+        start_date = group.date_of(int(group.size * first) or 1)
+        end_date = group.date_of(int(group.size * last) or 1)
+        await scrape_messages.scrape_group_by_date_range(
+            client, group.entity.username, start_date, end_date, user_email,
+            params.get('topic_id'), params['skip_media'])
+    else:
+        await scrape_messages.scrape_group(
+            client, group.entity.username, _scaled(params['limit'], scale), user_email,
+            params.get('topic_id'), params['skip_media'])
+    elapsed = time.perf_counter() - start
+
+    group_folder = os.path.join(scrape_messages.DATA_DIR, user_email, group.entity.username)
+    rows = sum(_count_csv_rows(os.path.join(group_folder, name))
+               for name in os.listdir(group_folder) if name.endswith('.csv'))
+    return {
+        'elapsed': elapsed,
+        'rows': rows,
+        'media_bytes': client.stats['downloaded_bytes'],
+        'requests': client.stats['requests'],
+        'flood_wait_seconds': client.stats['flood_wait_seconds'],
+        'output_bytes': _folder_size(group_folder)
+    }
+
+def _run_source_load(spec, scale, work_dir):
+    from fake_telegram import SyntheticGroup
+    from message_source import load_message_source, write_pack, iter_csv_rows
+
+    group = SyntheticGroup(**dict(spec['group'], size=_scaled(spec['group']['size'], scale)))
+    csv_file = os.path.join(work_dir, 'bench_messages.csv')
+    with open(csv_file, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['id', 'date', 'type', 'content', 'media_file'])
+        for msg_id in range(group.size, 0, -1):
+            msg = group.build(None, msg_id)
+            kind = msg.media_kind
+            writer.writerow([msg_id, msg.date.isoformat(), kind or 'text',
+                             msg.text or f'[{(kind or "").upper()}]', f'media/{kind}_{msg_id}' if kind else ''])
+
+    def walk(source):
+        for i in range(len(source)):
+            source.row_reversed(i)
+        return len(source)
+
+    start = time.perf_counter()
+    rows = walk(load_message_source(csv_file))
+    csv_elapsed = time.perf_counter() - start
+
+    pack_file = os.path.join(work_dir, 'bench_messages.pack')
+    write_pack(pack_file, (r[1:] for r in iter_csv_rows(csv_file)))
+    start = time.perf_counter()
+    walk(load_message_source(pack_file))
+    pack_elapsed = time.perf_counter() - start
+
+    return {
+        'elapsed': csv_elapsed + pack_elapsed,
+        'rows': rows * 2,
+        'csv_rows_per_sec': round(rows / csv_elapsed, 1) if csv_elapsed else None,
+        'pack_rows_per_sec': round(rows / pack_elapsed, 1) if pack_elapsed else None,
+        'media_bytes': 0,
+        'output_bytes': os.path.getsize(pack_file)
+    }
+
+def run_one(name, scale, result_file):
+    """Child process entry: run one scenario in the current (temporary) directory"""
+    spec = SCENARIOS[name]
+    work_dir = os.getcwd()
+    rss_before = _peak_rss_mb()
+    written_before = _proc_write_bytes()
+
+    if spec.get('source'):
+        result = _run_source_load(spec, scale, work_dir)
+    else:
+        result = asyncio.run(_run_scrape(spec, scale, work_dir))
+
+    written_after = _proc_write_bytes()
+    elapsed = result.pop('elapsed')
+    disk_bytes = None
+    if written_before is not None and written_after is not None:
+        # 扣除被重定向到文件的 stdout/stderr 输出
+        console_bytes = sum(os.path.getsize(os.path.join(work_dir, n)) for n in ('stdout.log', 'stderr.log'))
+        disk_bytes = written_after - written_before - console_bytes
+
+    result.update({
+        'scenario': name,
+        'scale': scale,
+        'seconds': round(elapsed, 3),
+        'rows_per_sec': round(result['rows'] / elapsed, 1) if elapsed else None,
+        'media_mb_per_sec': round(result['media_bytes'] / (1024 * 1024) / elapsed, 2) if elapsed else None,
+        'baseline_rss_mb': rss_before,
+        'peak_rss_mb': _peak_rss_mb(),
+        'disk_bytes_written': disk_bytes
+    })
+    with open(result_file, 'w', encoding='utf-8') as f:
+        json.dump(result, f)
+
+def run_scenario(name, scale, keep=False):
+    """Run a scenario in a fresh subprocess and temporary directory"""
+    work_dir = tempfile.mkdtemp(prefix=f'bench_{name}_')
+    result_file = os.path.join(work_dir, 'result.json')
+    env = dict(os.environ, PYTHONPATH=SCRIPT_DIR + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    try:
+        with open(os.path.join(work_dir, 'stdout.log'), 'wb') as out, \
+             open(os.path.join(work_dir, 'stderr.log'), 'wb') as err:
+            proc = subprocess.run(
+                [sys.executable, os.path.join(SCRIPT_DIR, 'bench_scrape.py'),
+                 '--run-one', name, '--scale', str(scale), '--result-file', result_file],
+                cwd=work_dir, env=env, stdout=out, stderr=err
+            )
+        if proc.returncode != 0 or not os.path.exists(result_file):
+            with open(os.path.join(work_dir, 'stderr.log'), 'r', encoding='utf-8', errors='replace') as f:
+                tail = f.read()[-2000:]
+            return {'scenario': name, 'error': f'exit code {proc.returncode}', 'stderr': tail}
+        with open(result_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    finally:
+        if keep:
+            print(f'Kept work directory: {work_dir}', file=sys.stderr)
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline scraper benchmarks')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS), help='Scenario to run (repeatable, default: all)')
+    parser.add_argument('--scale', type=float, default=1.0, help='Multiply message counts (e.g. 0.1 for a quick run)')
+    parser.add_argument('--output', help='Also write results to this JSON file')
+    parser.add_argument('--keep', action='store_true', help='Keep the temporary work directories')
+    parser.add_argument('--list', action='store_true', help='List scenarios and exit')
+    parser.add_argument('--run-one', help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        run_one(args.run_one, args.scale, args.result_file)
+        return
+
+    if args.list:
+        for name, spec in SCENARIOS.items():
+            print(f'{name:24} {spec["description"]}')
+        return
+
+    results = []
+    for name in args.scenario or list(SCENARIOS):
+        result = run_scenario(name, args.scale, args.keep)
+        results.append(result)
+        print(json.dumps(result), flush=True)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,386 @@
+"""
+Record/replay cassettes for Telethon traffic
+
+Recording wraps a live TelegramClient in place and writes the high-level
+call stream (entities, history pages, single-message fetches, downloads,
+auth checks) with timings to a gzip JSON-lines cassette. ReplayClient
+reads a cassette back and serves the same results offline, sleeping for
+the recorded durations scaled by `speed` (0 = no delays).
+
+Media content is not stored, only its size; replayed downloads write
+filler data of the recorded size.
+
+Cassette lines:
+    {"c": call, "l": label, "m": method, "k": key, "t": start}   call started
+    {"c": call, "dt": offset, "msg": {...}}                      iter_messages item
+    {"c": call, "dt": offset, "r": result}                       call finished
+    {"c": call, "dt": offset, "e": {"type": ..., "msg": ..., "seconds": ...}}
+"""
+import os
+import json
+import gzip
+import time
+import atexit
+import asyncio
+import contextvars
+from collections import defaultdict, deque
+
+from fake_telegram import FakeMessage, FakeUser, FakeEntity, FakeFile, write_filler
+
+# 参与调用匹配的关键字参数（其余参数不影响结果）
+KEY_ARGS = ('limit', 'offset_date', 'offset_id', 'reverse', 'reply_to', 'min_id', 'max_id',
+            'ids', 'filter', 'from_user', 'search')
+
+# 参与匹配的前置位置参数个数；实体对象在录制和回放时类型不同，不参与匹配
+KEY_POSITIONAL = {'get_entity': 1, 'get_input_entity': 1}
+
+def _jsonable(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(v) for v in value]
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    if isinstance(value, type):
+        return value.__name__
+    if type(value).__name__.startswith('InputMessagesFilter'):
+        return type(value).__name__
+    return None
+
+def call_key(method, args, kwargs):
+    """Stable key for matching a replayed call to a recorded one"""
+    key = {name: _jsonable(kwargs[name]) for name in KEY_ARGS if kwargs.get(name) is not None}
+    positional = args[:KEY_POSITIONAL.get(method, 0)]
+    if positional:
+        key['args'] = _jsonable(list(positional))
+    return json.dumps([method, key], sort_keys=True)
+
+def _media_kind(message):
+    if not getattr(message, 'media', None):
+        return None
+    if getattr(message, 'photo', None):
+        return 'photo'
+    for kind in ('sticker', 'video', 'voice', 'audio'):
+        if getattr(message, kind, None):
+            return kind
+    if getattr(message, 'document', None):
+        return 'document'
+    return 'other'
+
+def serialize_message(message):
+    """Keep the message fields the scripts read"""
+    sender = getattr(message, 'sender', None)
+    record = {
+        'id': message.id,
+        'date': message.date.isoformat() if message.date else None,
+        'text': message.text or '',
+        'views': getattr(message, 'views', None),
+        'forwards': getattr(message, 'forwards', None)
+    }
+    if sender is not None:
+        record['sender'] = {
+            'id': getattr(sender, 'id', 0),
+            'bot': bool(getattr(sender, 'bot', False)),
+            'username': getattr(sender, 'username', None),
+            'first_name': getattr(sender, 'first_name', None),
+            'last_name': getattr(sender, 'last_name', None)
+        }
+    reply_to = getattr(message, 'reply_to', None)
+    if reply_to is not None:
+        record['topic'] = getattr(reply_to, 'reply_to_top_id', None) or getattr(reply_to, 'reply_to_msg_id', None)
+
+    kind = _media_kind(message)
+    if kind:
+        record['kind'] = kind
+        file = getattr(message, 'file', None)
+        if file is not None:
+            record['file'] = {'id': file.id, 'name': file.name, 'size': file.size}
+        document = getattr(message, 'document', None)
+        if document is not None:
+            record['doc'] = {
+                'id': document.id,
+                'access_hash': document.access_hash,
+                'file_reference': bytes(document.file_reference or b'').hex(),
+                'mime_type': getattr(document, 'mime_type', None)
+            }
+    return record
+
+def deserialize_message(client, record):
+    """Rebuild a FakeMessage from a serialized message"""
+    from datetime import datetime
+
+    sender = None
+    if 'sender' in record:
+        info = record['sender']
+        sender = FakeUser(info['id'], bot=info['bot'])
+        sender.username = info['username']
+        sender.first_name = info['first_name']
+        sender.last_name = info['last_name']
+
+    file_info = record.get('file') or {}
+    message = FakeMessage(
+        client, record['id'],
+        datetime.fromisoformat(record['date']) if record.get('date') else None,
+        sender or FakeUser(0),
+        record.get('text', ''),
+        record.get('kind'),
+        file_info.get('size') or 0,
+        record.get('topic')
+    )
+    if sender is None:
+        message.sender = None
+    message.views = record.get('views')
+    message.forwards = record.get('forwards')
+    if file_info:
+        message.file = FakeFile(file_info.get('id'), file_info.get('name'), file_info.get('size'))
+    doc = record.get('doc')
+    if doc and message.document is not None:
+        document = message.document
+        document.id = doc['id']
+        document.access_hash = doc['access_hash']
+        document.file_reference = bytes.fromhex(doc['file_reference'])
+        document.mime_type = doc['mime_type'] or document.mime_type
+    return message
+
+def serialize_entity(entity):
+    return {
+        'id': getattr(entity, 'id', None),
+        'username': getattr(entity, 'username', None),
+        'title': getattr(entity, 'title', None) or getattr(entity, 'first_name', None),
+        'bot': getattr(entity, 'bot', None),
+        'first_name': getattr(entity, 'first_name', None),
+        'last_name': getattr(entity, 'last_name', None),
+        'phone': getattr(entity, 'phone', None)
+    }
+
+def deserialize_entity(record):
+    entity = FakeEntity(record['id'], record['username'], record['title'])
+    for name in ('bot', 'first_name', 'last_name', 'phone'):
+        setattr(entity, name, record.get(name))
+    return entity
+
+class TotalList(list):
+    """List with the `total` count of the recorded result (telethon.helpers.TotalList without telethon)"""
+    total = 0
+
+def _serialize_error(e):
+    return {'type': type(e).__name__, 'msg': str(e), 'seconds': getattr(e, 'seconds', None)}
+
+def _raise_recorded(error):
+    if error['type'] == 'FloodWaitError':
+        # 回放不加载 telethon，只有重放录下的 flood wait 时才需要
+        from telethon.errors import FloodWaitError
+        raise FloodWaitError(request=None, capture=error['seconds'] or 0)
+    raise ConnectionError(f"{error['type']}: {error['msg']}")
+
+class CassetteWriter:
+    """Append-only cassette file shared by every recorded client of a process"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = gzip.open(path, 'wt', encoding='utf-8')
+        self._start = time.monotonic()
+        self._next_call = 0
+        atexit.register(self.close)
+
+    def _write(self, record):
+        self._file.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+    def begin(self, label, method, key):
+        self._next_call += 1
+        call = self._next_call
+        self._write({'c': call, 'l': label, 'm': method, 'k': key, 't': round(time.monotonic() - self._start, 4)})
+        return call, time.monotonic()
+
+    def item(self, call, started, message):
+        self._write({'c': call, 'dt': round(time.monotonic() - started, 4), 'msg': serialize_message(message)})
+
+    def end(self, call, started, result=None, error=None):
+        record = {'c': call, 'dt': round(time.monotonic() - started, 4)}
+        if error is not None:
+            record['e'] = _serialize_error(error)
+        else:
+            record['r'] = result
+        self._write(record)
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+# telethon 的 get_messages 内部调用 iter_messages，此时不重复录制
+_inside_call = contextvars.ContextVar('cassette_inside_call', default=False)
+
+def record_client(client, writer, label=''):
+    """Patch a TelegramClient instance so its calls are written to the cassette
+
+    Methods are replaced on the instance, so calls made through messages
+    (message.download_media -> client.download_media) are recorded too.
+    """
+
+    def wrap(method, serialize):
+        original = getattr(client, method)
+
+        async def wrapper(*args, **kwargs):
+            call, started = writer.begin(label, method, call_key(method, args, kwargs))
+            token = _inside_call.set(True)
+            try:
+                result = await original(*args, **kwargs)
+            except Exception as e:
+                writer.end(call, started, error=e)
+                raise
+            finally:
+                _inside_call.reset(token)
+            writer.end(call, started, result=serialize(result, args, kwargs))
+            return result
+        setattr(client, method, wrapper)
+
+    def serialize_messages(result, args, kwargs):
+        if result is None:
+            return None
+        if isinstance(result, list):
+            return {'list': [serialize_message(m) if m else None for m in result],
+                    'total': getattr(result, 'total', None)}
+        return serialize_message(result)
+
+    def serialize_download(result, args, kwargs):
+        size = os.path.getsize(result) if isinstance(result, str) and os.path.exists(result) else None
+        return {'path': result if isinstance(result, str) else None, 'size': size}
+
+    wrap('connect', lambda r, a, k: None)
+    wrap('is_user_authorized', lambda r, a, k: bool(r))
+    wrap('get_me', lambda r, a, k: serialize_entity(r) if r else None)
+    wrap('get_entity', lambda r, a, k: serialize_entity(r))
+    wrap('get_input_entity', lambda r, a, k: serialize_entity(r))
+    wrap('get_messages', serialize_messages)
+    wrap('download_media', serialize_download)
+
+    original_iter = client.iter_messages
+
+    async def record_iter(entity, *args, **kwargs):
+        call, started = writer.begin(label, 'iter_messages', call_key('iter_messages', args, kwargs))
+        error = None
+        try:
+            async for message in original_iter(entity, *args, **kwargs):
+                writer.item(call, started, message)
+                yield message
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            writer.end(call, started, error=error)
+
+    def iter_messages(entity, *args, **kwargs):
+        if _inside_call.get():
+            return original_iter(entity, *args, **kwargs)
+        return record_iter(entity, *args, **kwargs)
+    client.iter_messages = iter_messages
+    return client
+
+def load_cassette(path):
+    """Read a cassette into {(label, key): deque of calls}"""
+    calls = {}
+    by_key = defaultdict(deque)
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            call_id = record['c']
+            if 'm' in record:
+                call = {'method': record['m'], 'items': [], 'dt': 0, 'result': None, 'error': None}
+                calls[call_id] = call
+                by_key[(record['l'], record['k'])].append(call)
+            elif 'msg' in record:
+                calls[call_id]['items'].append((record['dt'], record['msg']))
+            else:
+                call = calls.pop(call_id)
+                call['dt'] = record['dt']
+                call['result'] = record.get('r')
+                call['error'] = record.get('e')
+    return by_key
+
+class ReplayClient:
+    """Offline client that answers from a recorded cassette
+
+    Calls are matched by (label, method, key arguments) in recorded order;
+    when a key runs out, its last recording is reused.
+    """
+
+    def __init__(self, cassette, label='', speed=1.0):
+        self.calls = load_cassette(cassette) if isinstance(cassette, str) else cassette
+        self.label = label
+        self.speed = speed
+        self._last = {}
+
+    def _next(self, method, args, kwargs):
+        key = (self.label, call_key(method, args, kwargs))
+        queue = self.calls.get(key)
+        if queue:
+            self._last[key] = queue.popleft()
+        call = self._last.get(key)
+        if call is None:
+            raise ConnectionError(f'No recorded {method} call for {key[1]}')
+        return call
+
+    async def _wait(self, seconds):
+        if self.speed and seconds > 0:
+            await asyncio.sleep(seconds / self.speed)
+
+    async def _replay(self, method, args, kwargs):
+        call = self._next(method, args, kwargs)
+        await self._wait(call['dt'])
+        if call['error']:
+            _raise_recorded(call['error'])
+        return call['result']
+
+    async def connect(self):
+        await self._replay('connect', (), {})
+
+    async def disconnect(self):
+        pass
+
+    def is_connected(self):
+        return True
+
+    async def is_user_authorized(self):
+        return await self._replay('is_user_authorized', (), {})
+
+    async def get_me(self, *args, **kwargs):
+        result = await self._replay('get_me', args, kwargs)
+        return deserialize_entity(result) if result else None
+
+    async def get_entity(self, *args, **kwargs):
+        return deserialize_entity(await self._replay('get_entity', args, kwargs))
+
+    async def get_input_entity(self, *args, **kwargs):
+        return deserialize_entity(await self._replay('get_input_entity', args, kwargs))
+
+    async def get_messages(self, *args, **kwargs):
+        result = await self._replay('get_messages', args, kwargs)
+        if result is None:
+            return None
+        if 'list' in result:
+            messages = [deserialize_message(self, m) if m else None for m in result['list']]
+            if result.get('total') is not None:
+                total_list = TotalList(messages)
+                total_list.total = result['total']
+                return total_list
+            return messages
+        return deserialize_message(self, result)
+
+    async def iter_messages(self, *args, **kwargs):
+        call = self._next('iter_messages', args, kwargs)
+        started = time.monotonic()
+        for dt, record in call['items']:
+            if self.speed:
+                await self._wait(dt - (time.monotonic() - started) * self.speed)
+            yield deserialize_message(self, record)
+        if call['error']:
+            _raise_recorded(call['error'])
+
+    async def download_media(self, message, file=None, *args, **kwargs):
+        result = await self._replay('download_media', (), kwargs)
+        if not result or result.get('size') is None:
+            return None
+        if isinstance(file, str):
+            write_filler(file, result['size'])
+            return file
+        return result.get('path')
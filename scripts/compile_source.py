@@ -0,0 +1,146 @@
+"""
+Offline compiler and validator for uploaded message sources
+
+Streams `<source>_messages.csv`, resolves every media_file against a single
+scan of the media folder, checks sticker references, and writes a
+pre-validated `<source>_messages.pack` for auto_chat together with a
+`<source>_messages.report.json` listing every rejected or degraded row.
+"""
+import os
+import sys
+import json
+import argparse
+from config import MEDIA_DIR
+from message_source import iter_csv_rows, write_pack
+from sticker_index import load_sticker_index
+from storage_manager import exists
+
+# auto_chat 能发送的消息类型
+MEDIA_TYPES = {'photo', 'file', 'sticker'}
+SUPPORTED_TYPES = MEDIA_TYPES | {'text'}
+
+def print_json(data, file=sys.stdout):
+    """Print JSON with forced flush for real-time streaming"""
+    print(json.dumps(data, ensure_ascii=False), flush=True, file=file)
+
+def scan_media_folder(media_dir):
+    """Walk the media folder once and return {relative_path: size}"""
+    files = {}
+    for dir_path, _, file_names in os.walk(media_dir):
+        rel_dir = os.path.relpath(dir_path, media_dir)
+        for name in file_names:
+            rel_path = name if rel_dir == '.' else f"{rel_dir.replace(os.sep, '/')}/{name}"
+            try:
+                files[rel_path] = os.stat(os.path.join(dir_path, name)).st_size
+            except OSError:
+                continue
+    return files
+
+def normalize_media_path(media_file):
+    """Return the path relative to the media folder ('media/a.jpg', '.\\media\\a.jpg' -> 'a.jpg')"""
+    path = media_file.strip().replace('\\', '/')
+    while path.startswith('./'):
+        path = path[2:]
+    while path.startswith('media/'):
+        path = path[6:]
+    return path.lstrip('/')
+
+def compile_source(csv_file, media_dir, pack_file, report_file):
+    """Validate a message source and write the pack and report; return the summary"""
+    media_files = scan_media_folder(media_dir) if os.path.isdir(media_dir) else {}
+    sticker_refs = load_sticker_index(media_dir)
+    issues = []
+    stats = {'rows': 0, 'accepted': 0, 'rejected': 0, 'warnings': 0}
+
+    def issue(line, msg_id, level, code, message):
+        issues.append({'line': line, 'id': msg_id, 'level': level, 'code': code, 'message': message})
+        stats['rejected' if level == 'error' else 'warnings'] += 1
+
+    def accepted_rows():
+        for line, msg_id, msg_type, content, media_file in iter_csv_rows(csv_file):
+            stats['rows'] += 1
+            if msg_id is None:
+                issue(line, None, 'error', 'invalid_id', 'Message id is not an integer')
+                continue
+            if msg_type not in SUPPORTED_TYPES:
+                issue(line, msg_id, 'error', 'unsupported_type', f'Type "{msg_type}" cannot be sent by auto chat')
+                continue
+
+            if msg_type == 'text':
+                if not content:
+                    issue(line, msg_id, 'error', 'empty_text', 'Text message has no content')
+                    continue
+                media_file = None
+            else:
+                if not media_file:
+                    issue(line, msg_id, 'error', 'missing_media_path', f'{msg_type} message has no media_file')
+                    continue
+                rel_path = normalize_media_path(media_file)
+                size = media_files.get(rel_path)
+                if size is None:
+                    issue(line, msg_id, 'error', 'media_not_found', f'Media file not found: media/{rel_path}')
+                    continue
+                if size == 0:
+                    issue(line, msg_id, 'error', 'media_empty', f'Media file is empty: media/{rel_path}')
+                    continue
+                media_file = f'media/{rel_path}'
+
+                if msg_type == 'sticker':
+                    if not rel_path.lower().endswith(('.webp', '.tgs', '.webm')):
+                        issue(line, msg_id, 'warning', 'sticker_format', f'Unexpected sticker file type: {rel_path}')
+                    if os.path.splitext(rel_path)[0] not in sticker_refs:
+                        issue(line, msg_id, 'warning', 'sticker_ref_missing',
+                              'No sticker reference in stickers.db; it will be sent as a file')
+
+            stats['accepted'] += 1
+            yield msg_id, msg_type, content, media_file
+
+    write_pack(pack_file, accepted_rows())
+
+    summary = {
+        'csvFile': csv_file,
+        'packFile': pack_file,
+        'mediaFiles': len(media_files),
+        'stickerRefs': len(sticker_refs),
+        **stats
+    }
+    tmp_report = f'{report_file}.tmp'
+    with open(tmp_report, 'w', encoding='utf-8') as f:
+        json.dump({'summary': summary, 'issues': issues}, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_report, report_file)
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description='Compile and validate a message source for auto chat')
+    parser.add_argument('--user-email', help='User email of the message source owner')
+    parser.add_argument('--message-source', help='Name of the message source folder')
+    parser.add_argument('--source-dir', help='Explicit path to the message source folder (overrides --user-email)')
+    args = parser.parse_args()
+
+    if args.source_dir:
+        source_dir = os.path.abspath(args.source_dir)
+        source_name = os.path.basename(source_dir.rstrip(os.sep))
+    elif args.user_email and args.message_source:
+        source_dir = os.path.join(MEDIA_DIR, args.user_email, args.message_source)
+        source_name = args.message_source
+    else:
+        parser.error('either --source-dir or --user-email and --message-source are required')
+
+    csv_file = os.path.join(source_dir, f'{source_name}_messages.csv')
+    if not exists(csv_file):
+        print_json({'type': 'error', 'message': f'Message source file not found: {csv_file}'}, file=sys.stderr)
+        sys.exit(1)
+
+    base = os.path.splitext(csv_file)[0]
+    try:
+        summary = compile_source(csv_file, os.path.join(source_dir, 'media'), f'{base}.pack', f'{base}.report.json')
+    except Exception as e:
+        print_json({'type': 'error', 'message': f'Failed to compile message source: {str(e)}'}, file=sys.stderr)
+        sys.exit(1)
+
+    print_json({'type': 'result', 'data': summary})
+    if summary['accepted'] == 0:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -4,11 +4,25 @@ Configuration file for Telegram bot scripts
 import os
 
 # Constants
-import dotenv
 from pathlib import Path
 
-# 加载环境变量
-dotenv.load_dotenv()
+def _find_env_file():
+    """与 dotenv.find_dotenv() 相同：从本文件所在目录向上查找 .env"""
+    path = os.path.dirname(os.path.abspath(__file__))
+    while True:
+        candidate = os.path.join(path, '.env')
+        if os.path.isfile(candidate):
+            return candidate
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+# 加载环境变量（没有 .env 文件时不导入 dotenv，加快脚本启动）
+_env_file = _find_env_file()
+if _env_file:
+    import dotenv
+    dotenv.load_dotenv(_env_file)
 
 # Telegram API credentials - 从环境变量读取
 API_ID = int(os.environ.get('API_ID', '22453265'))
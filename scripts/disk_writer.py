@@ -0,0 +1,186 @@
+"""
+Dedicated writer thread for scraper file I/O
+
+Checkpoints, CSV files, the sticker index and status files are written by a
+single background thread so the asyncio event loop keeps serving downloads
+and history requests while data hits the disk.
+
+Jobs run in submission order (a later job on the same file always sees the
+earlier ones). The queue is bounded: when the writer falls behind, submit()
+blocks and put() awaits, which throttles the producer instead of buffering
+without limit. Jobs submitted with a `key` replace queued jobs with the same
+key that have not started yet, so a burst of status rewrites costs one write.
+"""
+import os
+import csv
+import queue
+import atexit
+import asyncio
+import logging
+import tempfile
+import threading
+from concurrent.futures import Future
+
+MAX_PENDING = 256
+
+_STOP = object()
+
+class _Job:
+    __slots__ = ('fn', 'args', 'key', 'future')
+
+    def __init__(self, fn, args, key):
+        self.fn = fn
+        self.args = args
+        self.key = key
+        self.future = Future()
+
+class DiskWriter:
+    def __init__(self, max_pending=MAX_PENDING, name='disk-writer'):
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._closed = False
+        self._thread.start()
+
+    def submit(self, fn, *args, key=None):
+        """Queue fn(*args); blocks while the queue is full. Returns a concurrent Future"""
+        if self._closed or not self._thread.is_alive():
+            # 写线程已停止（如进程退出阶段），直接在当前线程写入
+            job = _Job(fn, args, key)
+            self._execute(job)
+            return job.future
+        job = _Job(fn, args, key)
+        self._queue.put(job)
+        return job.future
+
+    async def put(self, fn, *args, key=None):
+        """Like submit() but waits for queue space without blocking the event loop"""
+        if self._closed:
+            return asyncio.wrap_future(self.submit(fn, *args, key=key))
+        try:
+            return asyncio.wrap_future(self.submit_nowait(fn, *args, key=key))
+        except queue.Full:
+            future = await asyncio.to_thread(self.submit, fn, *args, key=key)
+            return asyncio.wrap_future(future)
+
+    def submit_nowait(self, fn, *args, key=None):
+        job = _Job(fn, args, key)
+        self._queue.put_nowait(job)
+        return job.future
+
+    async def run(self, fn, *args):
+        """Run fn(*args) on the writer thread after everything queued before it; returns its result"""
+        return await (await self.put(fn, *args))
+
+    async def drain(self):
+        """Wait until every job queued so far has been written"""
+        await self.run(lambda: None)
+
+    def close(self):
+        """Finish all queued jobs and stop the thread"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+
+    @staticmethod
+    def _execute(job):
+        if not job.future.set_running_or_notify_cancel():
+            return
+        try:
+            job.future.set_result(job.fn(*job.args))
+        except BaseException as e:
+            job.future.set_exception(e)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            # 同一 key 只执行最后一次提交的任务
+            latest = {job.key: job for job in batch if job is not _STOP and job.key is not None}
+            stop = False
+            for job in batch:
+                if job is _STOP:
+                    stop = True
+                    continue
+                if job.key is not None and latest[job.key] is not job:
+                    job.future.set_result(None)
+                    continue
+                self._execute(job)
+            if stop:
+                return
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def get_disk_writer():
+    """Process-wide DiskWriter, started on first use and drained at exit"""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = DiskWriter()
+            atexit.register(_writer.close)
+        return _writer
+
+def log_failure(description):
+    """Done-callback for fire-and-forget jobs: log the error instead of dropping it"""
+    def callback(future):
+        if not future.cancelled() and future.exception() is not None:
+            logging.getLogger('disk_writer').warning(f'{description} failed: {future.exception()}')
+    return callback
+
+# 进程的 umask（只能通过设置再恢复读取，在导入时读一次）
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+def _file_mode(path):
+    """Permission bits a rewrite of path should keep: the existing file's, else the umask default"""
+    try:
+        return os.stat(path).st_mode & 0o777
+    except OSError:
+        return 0o666 & ~_UMASK
+
+# 常用的写入任务（在写线程中执行）
+def _replace_atomic(path, write):
+    """Call write(f) on a temp file next to path, then rename it over path"""
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        # mkstemp 创建的文件是 0600，替换前恢复正常权限，否则 Web 端可能读不到导出
+        os.chmod(tmp_path, _file_mode(path))
+        with os.fdopen(fd, 'w', newline='', encoding='utf-8') as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def write_atomic(path, text):
+    """Write text to path so readers never see a partial file"""
+    _replace_atomic(path, lambda f: f.write(text))
+
+def write_csv_atomic(path, rows, fieldnames):
+    """Write a complete CSV (header + rows) to path atomically"""
+    def write(f):
+        writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+    _replace_atomic(path, write)
+
+def append_csv_rows(path, rows, fieldnames, header=False):
+    """Append rows to a CSV in one write; with header=True the file is started over"""
+    with open(path, 'w' if header else 'a', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction='ignore')
+        if header:
+            writer.writeheader()
+        writer.writerows(rows)
@@ -0,0 +1,215 @@
+"""
+Stream a scraped group folder (CSV + media/) as a zip or tar.zst archive
+
+The archive is written straight to stdout, a file or a TCP socket while the
+folder is walked, so large downloads start immediately and memory stays
+bounded to a single chunk per file.
+"""
+import os
+import sys
+import json
+import socket
+import tarfile
+import zipfile
+import argparse
+from config import MEDIA_DIR
+
+CHUNK_SIZE = 1024 * 1024  # 每次读写 1MB
+
+# 已经压缩过的媒体格式，直接存储不再重复压缩
+PRECOMPRESSED_EXTENSIONS = {
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.webm',
+    '.mp4', '.mov', '.mkv', '.mp3', '.m4a', '.ogg', '.oga', '.opus',
+    '.zip', '.gz', '.rar', '.7z', '.zst', '.tgs'
+}
+
+def print_json(data, file=sys.stderr):
+    """Print JSON status lines to stderr (stdout may carry the archive)"""
+    print(json.dumps(data), flush=True, file=file)
+
+def sanitize_filename(filename):
+    """Clean filename, remove illegal characters"""
+    return "".join(c for c in filename if c.isalnum() or c in (' ', '-', '_', '.'))
+
+def is_precompressed(path):
+    return os.path.splitext(path)[1].lower() in PRECOMPRESSED_EXTENSIONS
+
+def iter_group_files(group_folder):
+    """Yield (arcname, full_path, size) for every file under the group folder, in stable order"""
+    stack = ['']
+    while stack:
+        rel_dir = stack.pop()
+        abs_dir = os.path.join(group_folder, rel_dir)
+        try:
+            entries = sorted(os.scandir(abs_dir), key=lambda e: e.name)
+        except OSError:
+            continue
+        sub_dirs = []
+        for entry in entries:
+            rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            if entry.is_dir(follow_symlinks=False):
+                sub_dirs.append(rel_path)
+            elif entry.is_file(follow_symlinks=False):
+                yield rel_path, entry.path, entry.stat().st_size
+        # 逆序压栈，保证按字母顺序遍历子目录
+        stack.extend(reversed(sub_dirs))
+
+def load_skip_list(path):
+    """Load arcnames the receiver already has (one per line) for resuming"""
+    if not path:
+        return set()
+    with open(path, 'r', encoding='utf-8') as f:
+        return {line.strip() for line in f if line.strip()}
+
+def write_zip(out, files):
+    """Stream files into a zip archive; works on non-seekable outputs"""
+    count = 0
+    with zipfile.ZipFile(out, 'w', allowZip64=True) as zf:
+        for arcname, path, size in files:
+            zinfo = zipfile.ZipInfo.from_file(path, arcname)
+            if is_precompressed(path):
+                zinfo.compress_type = zipfile.ZIP_STORED
+            else:
+                zinfo.compress_type = zipfile.ZIP_DEFLATED
+            with open(path, 'rb') as src, zf.open(zinfo, 'w', force_zip64=size > 0x7fffffff) as dst:
+                while True:
+                    chunk = src.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+            count += 1
+    return count
+
+class ZstdFrameWriter:
+    """File-like zstd writer that can switch compression level between frames
+
+    Concatenated zstd frames decode as one stream, so already-compressed media
+    goes through a fast frame while CSVs get a normal one. zstd has no way to
+    store data outside a frame, but it writes incompressible blocks raw, so the
+    fast frame costs little more than a copy.
+    """
+
+    def __init__(self, out, level=3, fast_level=-5):
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError('tar.zst export requires the zstandard package: pip install -r requirements.txt')
+        self._out = out
+        self._compressors = {
+            False: zstandard.ZstdCompressor(level=level),
+            True: zstandard.ZstdCompressor(level=fast_level)
+        }
+        self._fast = False
+        self._cobj = self._compressors[False].compressobj()
+        self._written = 0
+
+    def use_fast(self, fast):
+        """End the current frame and start a new one at the requested level"""
+        if fast == self._fast:
+            return
+        self._out.write(self._cobj.flush())
+        self._fast = fast
+        self._cobj = self._compressors[fast].compressobj()
+
+    def write(self, data):
+        chunk = self._cobj.compress(data)
+        if chunk:
+            self._out.write(chunk)
+        self._written += len(data)
+        return len(data)
+
+    def tell(self):
+        # tarfile 的 'w' 模式只在打开时用它记录起始偏移，不会 seek
+        return self._written
+
+    def close(self):
+        self._out.write(self._cobj.flush())
+        self._out.flush()
+
+def write_tar_zst(out, files):
+    """Stream files into a zstd-compressed tar archive"""
+    count = 0
+    writer = ZstdFrameWriter(out)
+    # 用 'w' 而不是流模式 'w|'：成员直接写入 writer，不在 tarfile 里缓冲，切换压缩级别正好落在成员边界
+    with tarfile.open(fileobj=writer, mode='w', copybufsize=CHUNK_SIZE) as tar:
+        for arcname, path, size in files:
+            writer.use_fast(is_precompressed(path))
+            with open(path, 'rb') as src:
+                tar.addfile(tar.gettarinfo(path, arcname), src)
+            count += 1
+    writer.close()
+    return count
+
+def open_output(args):
+    """Return (binary_stream, closer) for the requested destination"""
+    if args.socket:
+        host, _, port = args.socket.rpartition(':')
+        sock = socket.create_connection((host, int(port)))
+        stream = sock.makefile('wb', buffering=CHUNK_SIZE)
+
+        def close():
+            stream.close()
+            sock.close()
+        return stream, close
+    if args.output and args.output != '-':
+        stream = open(args.output, 'wb', buffering=CHUNK_SIZE)
+        return stream, stream.close
+    return sys.stdout.buffer, sys.stdout.buffer.flush
+
+def main():
+    parser = argparse.ArgumentParser(description='Stream a scraped group folder as an archive')
+    parser.add_argument('--user-email', help='User email of the scraped data owner')
+    parser.add_argument('--group', help='Group username (folder name under scraped_data/<email>)')
+    parser.add_argument('--group-folder', help='Explicit path to the group folder (overrides --user-email/--group)')
+    parser.add_argument('--format', choices=['zip', 'tar.zst'], default='zip', help='Archive format')
+    parser.add_argument('--output', default='-', help='Output file path, "-" for stdout')
+    parser.add_argument('--socket', help='Stream to HOST:PORT instead of stdout')
+    parser.add_argument('--skip-list', help='File with arcnames already received, one per line (resume)')
+    parser.add_argument('--list', action='store_true', help='Only print the file manifest as JSON lines')
+    args = parser.parse_args()
+
+    if args.group_folder:
+        group_folder = args.group_folder
+    elif args.user_email and args.group:
+        group_folder = os.path.join(MEDIA_DIR, args.user_email, sanitize_filename(args.group.lstrip('@')))
+    else:
+        parser.error('either --group-folder or --user-email and --group are required')
+
+    if not os.path.isdir(group_folder):
+        print_json({'type': 'error', 'message': f'Group folder not found: {group_folder}'})
+        sys.exit(1)
+
+    skip = load_skip_list(args.skip_list)
+    files = (f for f in iter_group_files(group_folder) if f[0] not in skip)
+
+    if args.list:
+        for arcname, _, size in files:
+            print(json.dumps({'name': arcname, 'size': size}), flush=True)
+        return
+
+    out, close = open_output(args)
+    try:
+        if args.format == 'zip':
+            count = write_zip(out, files)
+        else:
+            count = write_tar_zst(out, files)
+    except (BrokenPipeError, ConnectionError) as e:
+        print_json({'type': 'error', 'message': f'Receiver closed the stream: {str(e)}'})
+        sys.exit(1)
+    except Exception as e:
+        print_json({'type': 'error', 'message': str(e)})
+        sys.exit(1)
+    finally:
+        try:
+            close()
+        except Exception:
+            pass
+
+    print_json({
+        'type': 'complete',
+        'message': f'Exported {count} files',
+        'skipped': len(skip)
+    })
+
+if __name__ == '__main__':
+    main()
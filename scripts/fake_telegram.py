@@ -0,0 +1,300 @@
+"""
+In-process fake Telegram client for offline benchmarks
+
+Implements the parts of the TelegramClient surface the scripts use
+(get_input_entity / get_entity / iter_messages / get_messages /
+download_media) over a synthetic group. Messages are derived from their id
+and a seed, so 100k+ message groups cost no memory up front. Latency,
+download bandwidth and flood waits are tunable.
+"""
+import os
+import random
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+PAGE_SIZE = 100  # 与 GetHistoryRequest 每页条数一致
+
+# 媒体类型 -> (最小字节, 最大字节)
+MEDIA_SIZES = {
+    'photo': (60 * 1024, 300 * 1024),
+    'video': (1024 * 1024, 4 * 1024 * 1024),
+    'sticker': (15 * 1024, 45 * 1024),
+    'document': (10 * 1024, 2 * 1024 * 1024),
+    'voice': (8 * 1024, 120 * 1024),
+    'audio': (1024 * 1024, 5 * 1024 * 1024)
+}
+
+DEFAULT_MEDIA_MIX = {'photo': 0.12, 'video': 0.03, 'sticker': 0.08, 'document': 0.03, 'voice': 0.02, 'audio': 0.01}
+
+_FILL = os.urandom(1024 * 1024)  # 下载时重复写入的随机数据
+
+def write_filler(path, size):
+    """Write `size` bytes of filler data to path (stands in for downloaded media)"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'wb') as f:
+        remaining = size
+        while remaining > 0:
+            remaining -= f.write(_FILL[:min(remaining, len(_FILL))])
+
+class FakeEntity:
+    def __init__(self, entity_id, username, title):
+        self.id = entity_id
+        self.username = username
+        self.title = title
+        self.access_hash = entity_id * 7
+
+class FakeUser:
+    def __init__(self, user_id, bot=False):
+        self.id = user_id
+        self.bot = bot
+        self.username = f'user{user_id}' if user_id % 3 else None
+        self.first_name = f'First{user_id}'
+        self.last_name = f'Last{user_id}' if user_id % 2 else None
+
+class FakePhoto:
+    def __init__(self, photo_id, size):
+        self.id = photo_id
+        self.size = size
+
+class FakeDocument:
+    def __init__(self, doc_id, size, mime_type, file_name=''):
+        self.id = doc_id
+        self.access_hash = doc_id * 31
+        self.file_reference = doc_id.to_bytes(8, 'little')
+        self.size = size
+        self.mime_type = mime_type
+        self.file_name = file_name
+
+class FakePhotoMedia:
+    def __init__(self, photo):
+        self.photo = photo
+
+class FakeDocumentMedia:
+    def __init__(self, document):
+        self.document = document
+
+class FakeOtherMedia:
+    """Media without photo/document (web page previews, polls, geo...)"""
+
+class FakeFile:
+    def __init__(self, file_id, name, size):
+        self.id = file_id
+        self.name = name
+        self.size = size
+
+class FakeReplyHeader:
+    def __init__(self, top_id):
+        self.reply_to_top_id = top_id
+        self.reply_to_msg_id = top_id
+        self.forum_topic = True
+
+class FakeMessage:
+    """Minimal stand-in for telethon's Message"""
+
+    def __init__(self, client, msg_id, date, sender, text='', media_kind=None, size=0, topic_id=None):
+        self.client = client
+        self.id = msg_id
+        self.date = date
+        self.sender = sender
+        self.sender_id = sender.id
+        self.text = text
+        self.message = text
+        self.media_kind = media_kind
+        self.reply_to = FakeReplyHeader(topic_id) if topic_id else None
+        self.topic_id = topic_id
+        self.media = None
+        self.photo = None
+        self.document = None
+        self.sticker = None
+        self.video = None
+        self.voice = None
+        self.audio = None
+        self.file = None
+
+        if media_kind == 'photo':
+            self.photo = FakePhoto(msg_id, size)
+            self.media = FakePhotoMedia(self.photo)
+            self.file = FakeFile(f'photo{msg_id}', None, size)
+        elif media_kind == 'other':
+            self.media = FakeOtherMedia()
+        elif media_kind:
+            mime_types = {
+                'video': 'video/mp4', 'sticker': 'image/webp', 'voice': 'audio/ogg',
+                'audio': 'audio/mpeg', 'document': 'application/pdf'
+            }
+            file_name = f'file_{msg_id}.pdf' if media_kind == 'document' else ''
+            self.document = FakeDocument(msg_id, size, mime_types[media_kind], file_name)
+            self.media = FakeDocumentMedia(self.document)
+            self.file = FakeFile(f'doc{msg_id}', file_name or None, size)
+            if media_kind in ('sticker', 'video', 'voice', 'audio'):
+                setattr(self, media_kind, self.document)
+
+    async def download_media(self, file=None):
+        return await self.client.download_media(self, file)
+
+class SyntheticGroup:
+    """Deterministic synthetic group; message `n` is rebuilt from (seed, n) on demand"""
+
+    def __init__(self, size=100000, media_mix=None, bot_ratio=0.05, topics=0, users=200, seed=1,
+                 username='bench_group', start_date=None, interval_seconds=30):
+        self.size = size
+        self.media_mix = DEFAULT_MEDIA_MIX if media_mix is None else media_mix
+        self.bot_ratio = bot_ratio
+        self.topics = topics
+        self.users = users
+        self.seed = seed
+        self.entity = FakeEntity(1000000000 + seed, username, f'Bench {username}')
+        self.start_date = start_date or datetime(2024, 1, 1, tzinfo=timezone.utc)
+        self.interval = timedelta(seconds=interval_seconds)
+
+    def date_of(self, msg_id):
+        return self.start_date + self.interval * (msg_id - 1)
+
+    def id_at_or_after(self, date):
+        """Smallest message id whose date is >= date"""
+        if date <= self.start_date:
+            return 1
+        delta = (date - self.start_date).total_seconds()
+        step = self.interval.total_seconds()
+        return int(-(-delta // step)) + 1
+
+    def topic_of(self, msg_id):
+        if not self.topics:
+            return None
+        return random.Random(self.seed * 7919 + msg_id).randint(1, self.topics)
+
+    def build(self, client, msg_id):
+        rng = random.Random(self.seed * 1000003 + msg_id)
+        user_id = rng.randint(1, self.users)
+        sender = FakeUser(user_id, bot=rng.random() < self.bot_ratio)
+
+        media_kind = None
+        roll = rng.random()
+        for kind, share in self.media_mix.items():
+            if roll < share:
+                media_kind = kind
+                break
+            roll -= share
+
+        size = 0
+        text = ''
+        if media_kind:
+            low, high = MEDIA_SIZES[media_kind]
+            size = rng.randint(low, high)
+        else:
+            text = ' '.join(f'w{rng.randint(0, 5000)}' for _ in range(rng.randint(1, 40)))
+        return FakeMessage(client, msg_id, self.date_of(msg_id), sender, text, media_kind, size, self.topic_of(msg_id))
+
+class FakeTelegramClient:
+    """Offline TelegramClient replacement backed by a SyntheticGroup
+
+    Args:
+        latency: seconds added to every API round trip (one history page counts as one)
+        bandwidth: download speed in bytes/sec (None = unlimited)
+        flood_every: inject a flood wait every N round trips (0 = never)
+        flood_seconds: length of each injected flood wait
+        flood_sleep_threshold: waits up to this are slept through like telethon does;
+            longer ones raise FloodWaitError
+    """
+
+    def __init__(self, group, latency=0.0, bandwidth=None, flood_every=0, flood_seconds=1,
+                 flood_sleep_threshold=60):
+        self.group = group
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.flood_every = flood_every
+        self.flood_seconds = flood_seconds
+        self.flood_sleep_threshold = flood_sleep_threshold
+        self.stats = {'requests': 0, 'flood_waits': 0, 'flood_wait_seconds': 0, 'downloaded_bytes': 0}
+        self._connected = False
+
+    async def _round_trip(self):
+        self.stats['requests'] += 1
+        if self.flood_every and self.stats['requests'] % self.flood_every == 0:
+            self.stats['flood_waits'] += 1
+            self.stats['flood_wait_seconds'] += self.flood_seconds
+            if self.flood_seconds > self.flood_sleep_threshold:
+                from telethon.errors import FloodWaitError
+                raise FloodWaitError(request=None, capture=self.flood_seconds)
+            await asyncio.sleep(self.flood_seconds)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    # 连接相关
+    async def connect(self):
+        self._connected = True
+
+    async def disconnect(self):
+        self._connected = False
+
+    def is_connected(self):
+        return self._connected
+
+    async def is_user_authorized(self):
+        return True
+
+    async def get_me(self):
+        await self._round_trip()
+        return FakeUser(1)
+
+    # 实体
+    async def get_input_entity(self, peer):
+        await self._round_trip()
+        return self.group.entity
+
+    async def get_entity(self, peer):
+        await self._round_trip()
+        return self.group.entity
+
+    # 消息
+    async def iter_messages(self, entity, limit=None, offset_date=None, reverse=False, reply_to=None,
+                            min_id=0, max_id=0, ids=None, **kwargs):
+        if ids is not None:
+            for msg in await self.get_messages(entity, ids=ids):
+                yield msg
+            return
+
+        group = self.group
+        low = max(1, min_id + 1)
+        high = group.size if not max_id else min(group.size, max_id - 1)
+        if offset_date is not None:
+            if reverse:
+                low = max(low, group.id_at_or_after(offset_date))
+            else:
+                high = min(high, group.id_at_or_after(offset_date) - 1)
+        ids_range = range(low, high + 1) if reverse else range(high, low - 1, -1)
+
+        yielded = 0
+        in_page = PAGE_SIZE
+        for msg_id in ids_range:
+            if limit is not None and yielded >= limit:
+                return
+            if reply_to is not None and group.topic_of(msg_id) != int(reply_to):
+                continue
+            if in_page >= PAGE_SIZE:
+                await self._round_trip()
+                in_page = 0
+            in_page += 1
+            yielded += 1
+            yield group.build(self, msg_id)
+
+    async def get_messages(self, entity, ids=None, limit=None, **kwargs):
+        if ids is None:
+            return [msg async for msg in self.iter_messages(entity, limit=limit, **kwargs)]
+        await self._round_trip()
+        if isinstance(ids, int):
+            return self.group.build(self, ids) if 1 <= ids <= self.group.size else None
+        return [self.group.build(self, i) if 1 <= i <= self.group.size else None for i in ids]
+
+    async def download_media(self, message, file=None):
+        media = getattr(message, 'photo', None) or getattr(message, 'document', None)
+        if media is None:
+            return None
+        await self._round_trip()
+        size = media.size
+        if isinstance(file, str):
+            write_filler(file, size)
+        if self.bandwidth:
+            await asyncio.sleep(size / self.bandwidth)
+        self.stats['downloaded_bytes'] += size
+        return file
@@ -0,0 +1,116 @@
+"""
+Fast-start helpers: on-demand dependency checks and a built-in import-time report
+
+Import this module first in a script. When TG_IMPORT_REPORT is set, every
+module imported afterwards is timed (self and cumulative, like
+`python -X importtime`), and a report is emitted at exit together with the
+startup milestones recorded by mark().
+
+Environment:
+    TG_IMPORT_REPORT   "1" prints the report as a JSON line on stderr at exit;
+                       any other value is a path the JSON report is written to
+"""
+import os
+import sys
+import json
+import time
+import atexit
+import importlib.util
+
+_START = time.perf_counter()
+_marks = {}
+_report = None
+
+def check_dependencies(required):
+    """Return the pip names of packages in {import_name: pip_name} that are not installed
+
+    Uses importlib.util.find_spec, so nothing is actually imported.
+    """
+    missing = []
+    for import_name, package_name in required.items():
+        try:
+            found = importlib.util.find_spec(import_name) is not None
+        except (ImportError, ValueError):
+            found = False
+        if not found:
+            missing.append(package_name)
+    return missing
+
+def mark(name):
+    """Record the first time a startup milestone is reached (ms since this module was imported)"""
+    if name not in _marks:
+        _marks[name] = round((time.perf_counter() - _START) * 1000, 1)
+
+class _ImportTimer:
+    """sys.meta_path hook that times module execution
+
+    The spec comes from the remaining finders; only the per-module loader
+    instance gets a timed exec_module, so import semantics are unchanged.
+    """
+
+    def __init__(self):
+        self.records = []  # (name, self_us, cumulative_us, depth)
+        self._stack = []   # [start, children_us]
+
+    def find_spec(self, name, path=None, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        loader = spec.loader
+        # 内置/冻结模块的 loader 是类本身（全局共享），不做包装
+        if loader is None or isinstance(loader, type) or not hasattr(loader, 'exec_module'):
+            return spec
+        exec_module = loader.exec_module
+
+        def timed_exec_module(module):
+            depth = len(self._stack)
+            self._stack.append([time.perf_counter(), 0])
+            try:
+                exec_module(module)
+            finally:
+                start, children = self._stack.pop()
+                cumulative = int((time.perf_counter() - start) * 1_000_000)
+                self.records.append((name, cumulative - children, cumulative, depth))
+                if self._stack:
+                    self._stack[-1][1] += cumulative
+
+        loader.exec_module = timed_exec_module
+        return spec
+
+class ImportReport:
+    def __init__(self, output):
+        self.output = output
+        self.timer = _ImportTimer()
+        sys.meta_path.insert(0, self.timer)
+        atexit.register(self.dump)
+
+    def summary(self, top=30):
+        records = self.timer.records
+        slowest = sorted(records, key=lambda r: r[2], reverse=True)
+        return {
+            'script': os.path.basename(sys.argv[0]),
+            'modules': len(records),
+            'import_ms': round(sum(r[2] for r in records if r[3] == 0) / 1000, 1),
+            'marks_ms': dict(_marks),
+            'slowest': [
+                {'module': name, 'self_ms': round(self_us / 1000, 1), 'cumulative_ms': round(cum_us / 1000, 1)}
+                for name, self_us, cum_us, _ in slowest[:top]
+            ]
+        }
+
+    def dump(self):
+        mark('exit')
+        summary = self.summary()
+        if self.output != '1':
+            with open(self.output, 'w', encoding='utf-8') as f:
+                json.dump(summary, f, indent=2)
+        else:
+            print(json.dumps({'type': 'import_report', 'data': summary}), file=sys.stderr, flush=True)
+
+if os.environ.get('TG_IMPORT_REPORT'):
+    _report = ImportReport(os.environ['TG_IMPORT_REPORT'])
@@ -3,32 +3,45 @@ import sys
 import json
 import asyncio
 import argparse
-from telethon import TelegramClient
 from config import (
     API_ID,
     API_HASH,
-    PROXY_CONFIGS,
     BASE_SESSIONS_DIR
 )
+from instrumentation import instrument_client
+from proxy_pool import check_proxies, connect_client
 
-async def get_session_info(session_path):
-    """Get user information from a session file"""
+async def get_session_info(session_path, cassette_writer=None, replay_calls=None, replay_speed=1.0):
+    """Get user information from a session file
+
+    Args:
+        cassette_writer: CassetteWriter to record this session's traffic to
+        replay_calls: Loaded cassette to answer from instead of connecting
+    """
     try:
         session_name = os.path.basename(session_path)
         phone = session_name.replace('.session', '')
         
-        # 使用第一个代理配置
-        proxy_config = PROXY_CONFIGS[0]
-        
-        client = TelegramClient(
-            session_path.replace('.session', ''),
-            API_ID,
-            API_HASH,
-            proxy=proxy_config
-        )
+        if replay_calls is not None:
+            from cassette import ReplayClient
+            client = ReplayClient(replay_calls, label=session_name, speed=replay_speed)
+        else:
+            # telethon 只在真正连接时导入，回放不需要
+            from telethon import TelegramClient
+            from session_store import open_session
+            # 代理由 connect_client 按健康状况选择
+            client = TelegramClient(
+                open_session(session_path),
+                API_ID,
+                API_HASH
+            )
+            instrument_client(client)
+            if cassette_writer is not None:
+                from cassette import record_client
+                record_client(client, cassette_writer, label=session_name)
         
         try:
-            await client.connect()
+            await connect_client(client)
             
             if not await client.is_user_authorized():
                 print(json.dumps({
@@ -71,7 +84,7 @@ async def get_session_info(session_path):
         }))
         return None
 
-async def get_all_sessions_info(user_email):
+async def get_all_sessions_info(user_email, cassette_writer=None, replay_calls=None, replay_speed=1.0):
     """Get information for all sessions of a user"""
     sessions_dir = os.path.join(BASE_SESSIONS_DIR, user_email)
     
@@ -82,7 +95,8 @@ async def get_all_sessions_info(user_email):
         }))
         return []
     
-    session_files = [f for f in os.listdir(sessions_dir) if f.endswith('.session')]
+    from session_db import list_session_files
+    session_files = list_session_files(sessions_dir)
     
     if not session_files:
         print(json.dumps({
@@ -91,10 +105,14 @@ async def get_all_sessions_info(user_email):
         }))
         return []
     
+    # 先并行检查所有代理，之后每个会话直接使用最快的
+    if replay_calls is None:
+        await check_proxies()
+    
     results = []
     for session_file in session_files:
         session_path = os.path.join(sessions_dir, session_file)
-        info = await get_session_info(session_path)
+        info = await get_session_info(session_path, cassette_writer, replay_calls, replay_speed)
         if info:
             results.append(info)
     
@@ -103,10 +121,22 @@ async def get_all_sessions_info(user_email):
 async def main():
     parser = argparse.ArgumentParser(description='Get Telegram session information')
     parser.add_argument('--user-email', required=True, help='User email')
+    parser.add_argument('--record', help='Record Telegram traffic to this cassette file')
+    parser.add_argument('--replay', help='Replay Telegram traffic from this cassette file instead of connecting')
+    parser.add_argument('--replay-speed', type=float, default=1.0, help='Replay timing multiplier (0 = no delays)')
     args = parser.parse_args()
     
+    cassette_writer = None
+    replay_calls = None
+    if args.record:
+        from cassette import CassetteWriter
+        cassette_writer = CassetteWriter(args.record)
+    elif args.replay:
+        from cassette import load_cassette
+        replay_calls = load_cassette(args.replay)
+    
     try:
-        await get_all_sessions_info(args.user_email)
+        await get_all_sessions_info(args.user_email, cassette_writer, replay_calls, args.replay_speed)
     except Exception as e:
         print(json.dumps({
             "type": "error",
@@ -0,0 +1,288 @@
+"""
+Optional RPC instrumentation and profiling hooks
+
+Disabled unless TG_INSTRUMENT is set, so the scripts pay nothing by default.
+
+Environment:
+    TG_INSTRUMENT   "1" prints the summary as a JSON line on stderr at exit;
+                    any other value is a path the JSON summary is written to
+    TG_PROFILE      "cpu", "mem" or "both": profile the whole run
+                    (cProfile / tracemalloc), dumped next to the summary
+
+While instrumentation is on, SIGUSR1 toggles an on-demand cProfile +
+tracemalloc capture; the second signal writes the snapshot files.
+
+The summary holds per-request-type latency histograms (every RPC goes
+through TelegramClient._call), flood-wait counts and seconds, file bytes
+transferred, and event-loop lag.
+
+Flood waits are counted by flood_wait_counter() even without TG_INSTRUMENT:
+waits telethon sleeps through are read from its own log records, waits
+raised to a script are recorded by the script, so each is counted once.
+"""
+import os
+import sys
+import json
+import time
+import atexit
+import logging
+import signal
+import asyncio
+import tempfile
+from collections import defaultdict
+
+# 延迟直方图的桶上限（毫秒）
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000)
+
+class Histogram:
+    """Fixed-bucket latency histogram"""
+
+    __slots__ = ('count', 'errors', 'total', 'max', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+
+    def add(self, seconds, error=False):
+        ms = seconds * 1000
+        self.count += 1
+        self.errors += error
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        for i, limit in enumerate(BUCKETS_MS):
+            if ms <= limit:
+                self.buckets[i] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    def percentile(self, p):
+        """Upper bound (ms) of the bucket containing the p-th percentile"""
+        if not self.count:
+            return None
+        target = self.count * p / 100
+        max_ms = round(self.max * 1000, 1)
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= target:
+                return min(BUCKETS_MS[i], max_ms) if i < len(BUCKETS_MS) else max_ms
+        return max_ms
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'total_s': round(self.total, 3),
+            'mean_ms': round(self.total / self.count * 1000, 2) if self.count else None,
+            'p50_ms': self.percentile(50),
+            'p95_ms': self.percentile(95),
+            'p99_ms': self.percentile(99),
+            'max_ms': round(self.max * 1000, 2),
+            'buckets_ms': {str(limit): n for limit, n in zip(BUCKETS_MS + ('inf',), self.buckets) if n}
+        }
+
+# telethon 自行休眠的 flood wait 只会留下这条日志（见 telethon/client/users.py 的 _fmt_flood）
+FLOOD_LOGGER = 'telethon.client.users'
+FLOOD_LOG_MESSAGE = 'Sleeping%s for %ds (%s) on %s flood wait'
+
+class FloodWaitCounter(logging.Filter):
+    """Process-wide flood-wait count and seconds
+
+    Installed as a filter on telethon's users logger; it counts the waits
+    telethon sleeps through and lets records through only at the level the
+    logger would have had without it.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.count = 0
+        self.seconds = 0
+
+    def record(self, seconds):
+        self.count += 1
+        self.seconds += seconds
+
+    def filter(self, record):
+        # ' early' 是对已统计过的等待补睡剩余时间，不再计数
+        if record.msg == FLOOD_LOG_MESSAGE and len(record.args) == 4 and not record.args[0]:
+            self.record(record.args[1])
+        parent = logging.getLogger(FLOOD_LOGGER).parent
+        return record.levelno >= parent.getEffectiveLevel()
+
+_flood_counter = None
+
+def flood_wait_counter():
+    """Return the process-wide FloodWaitCounter, hooking telethon's logger on first use"""
+    global _flood_counter
+    if _flood_counter is None:
+        _flood_counter = FloodWaitCounter()
+        logger = logging.getLogger(FLOOD_LOGGER)
+        logger.addFilter(_flood_counter)
+        # 过滤器只在记录达到 logger 级别时才会被调用
+        if logger.getEffectiveLevel() > logging.INFO:
+            logger.setLevel(logging.INFO)
+    return _flood_counter
+
+class Instrumentation:
+    def __init__(self, output, profile):
+        self.output = output
+        self.started = time.time()
+        self.rpc = defaultdict(Histogram)
+        self.flood_waits = flood_wait_counter()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.loop_lag = Histogram()
+        self._lag_loops = set()
+        self._profiler = None
+        self._profile_mem = False
+
+        base = output if output and output != '1' else os.path.join(
+            tempfile.gettempdir(), f'instrumentation_{os.path.basename(sys.argv[0])}_{os.getpid()}')
+        self.profile_base = os.path.splitext(base)[0]
+
+        if profile in ('cpu', 'mem', 'both'):
+            self.start_profile(cpu=profile in ('cpu', 'both'), mem=profile in ('mem', 'both'))
+        if hasattr(signal, 'SIGUSR1'):
+            try:
+                signal.signal(signal.SIGUSR1, self._on_signal)
+            except ValueError:
+                pass  # 不在主线程
+        atexit.register(self.dump)
+
+    # 记录
+    def record_rpc(self, name, seconds, error=False):
+        self.rpc[name].add(seconds, error)
+
+    # 性能分析
+    def start_profile(self, cpu=True, mem=True):
+        if cpu and self._profiler is None:
+            import cProfile
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        if mem:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(25)
+            self._profile_mem = True
+
+    def stop_profile(self, suffix=''):
+        """Stop profiling and write <base><suffix>.pstats / .tracemalloc.txt; returns written paths"""
+        written = []
+        if self._profiler is not None:
+            self._profiler.disable()
+            path = f'{self.profile_base}{suffix}.pstats'
+            self._profiler.dump_stats(path)
+            written.append(path)
+            self._profiler = None
+        if self._profile_mem:
+            import tracemalloc
+            if tracemalloc.is_tracing():
+                path = f'{self.profile_base}{suffix}.tracemalloc.txt'
+                snapshot = tracemalloc.take_snapshot()
+                current, peak = tracemalloc.get_traced_memory()
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(f'current={current} peak={peak}\n')
+                    for stat in snapshot.statistics('lineno')[:50]:
+                        f.write(f'{stat}\n')
+                tracemalloc.stop()
+                written.append(path)
+            self._profile_mem = False
+        return written
+
+    def _on_signal(self, signum, frame):
+        if self._profiler is None and not self._profile_mem:
+            self.start_profile()
+            print(json.dumps({'type': 'info', 'message': 'On-demand profiling started'}), file=sys.stderr, flush=True)
+        else:
+            paths = self.stop_profile(suffix=f'_{int(time.time())}')
+            print(json.dumps({'type': 'info', 'message': f'Profile written: {", ".join(paths)}'}), file=sys.stderr, flush=True)
+
+    # 事件循环延迟
+    def ensure_lag_monitor(self, interval=0.1):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if loop in self._lag_loops:
+            return
+        self._lag_loops.add(loop)
+        loop.create_task(self._monitor_lag(loop, interval))
+
+    async def _monitor_lag(self, loop, interval):
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            self.loop_lag.add(max(0.0, loop.time() - start - interval))
+
+    # 汇总
+    def summary(self):
+        return {
+            'script': os.path.basename(sys.argv[0]),
+            'pid': os.getpid(),
+            'wall_s': round(time.time() - self.started, 3),
+            'rpc': {name: h.summary() for name, h in sorted(self.rpc.items())},
+            'flood_waits': self.flood_waits.count,
+            'flood_wait_s': self.flood_waits.seconds,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'loop_lag': self.loop_lag.summary()
+        }
+
+    def dump(self):
+        summary = self.summary()
+        summary['profiles'] = self.stop_profile()
+        if self.output and self.output != '1':
+            with open(self.output, 'w', encoding='utf-8') as f:
+                json.dump(summary, f, indent=2)
+        else:
+            print(json.dumps({'type': 'instrumentation', 'data': summary}), file=sys.stderr, flush=True)
+
+_instrumentation = None
+
+def get_instrumentation():
+    """Return the process-wide Instrumentation, or None when disabled"""
+    global _instrumentation
+    if _instrumentation is None and os.environ.get('TG_INSTRUMENT'):
+        _instrumentation = Instrumentation(os.environ['TG_INSTRUMENT'], os.environ.get('TG_PROFILE', ''))
+    return _instrumentation
+
+def instrument_client(client):
+    """Time every RPC of a TelegramClient; no-op unless TG_INSTRUMENT is set
+
+    The wrapper only observes: telethon still sleeps through and retries
+    flood waits under its own flood_sleep_threshold and request_retries.
+    """
+    inst = get_instrumentation()
+    if inst is None:
+        return client
+    inst.ensure_lag_monitor()
+    original = getattr(client, '_call', None)
+    if original is None or getattr(original, '_instrumented', False):
+        return client
+
+    async def _call(sender, request, ordered=False, flood_sleep_threshold=None):
+        # 只在外部计时；flood wait 的休眠和重试仍由 telethon 自己处理（计入本次耗时）
+        name = type(request).__name__
+        start = time.perf_counter()
+        try:
+            result = await original(sender, request, ordered=ordered, flood_sleep_threshold=flood_sleep_threshold)
+        except Exception:
+            inst.record_rpc(name, time.perf_counter() - start, error=True)
+            raise
+        inst.record_rpc(name, time.perf_counter() - start)
+
+        data = getattr(request, 'bytes', None)
+        if isinstance(data, bytes):
+            inst.bytes_out += len(data)
+        data = getattr(result, 'bytes', None)
+        if isinstance(data, bytes):
+            inst.bytes_in += len(data)
+        return result
+
+    _call._instrumented = True
+    client._call = _call
+    return client
@@ -0,0 +1,321 @@
+"""
+Small preview images for scraped media
+
+Photos and stickers get a thumbnail; videos get a poster made from their
+first frame (needs the ffmpeg binary). Previews live in the group folder:
+
+    previews/<media file name>.webp    (.jpg when Pillow has no WebP support)
+    previews/manifest.json             {media name: [mtime_ns, size, preview name or null, error]}
+
+Rendering runs in a ProcessPoolExecutor inside a `--serve` child process,
+so the scrape's event loop only schedules work and the pool's spawn workers
+import this module instead of the scrape's main module. Each downloaded file
+is submitted as soon as it lands, and the manifest makes reruns incremental:
+a file whose mtime and size match its entry is skipped, including files that
+failed before.
+
+Usage:
+    python3 media_previews.py --group-folder <dir> [--workers 4] [--size 320]
+    python3 media_previews.py --serve [--workers 4]    (started by PreviewBuilder)
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import signal
+import asyncio
+import argparse
+import functools
+import threading
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from disk_writer import write_atomic
+
+PREVIEW_DIR = 'previews'
+MANIFEST_FILE = 'manifest.json'
+PREVIEW_SIZE = 320        # 长边像素
+PREVIEW_QUALITY = 70
+POSTER_TIMEOUT = 60       # 单个视频抽帧的超时（秒）
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.gif', '.bmp'}
+VIDEO_EXTENSIONS = {'.mp4', '.mov', '.webm', '.mkv'}
+
+def preview_format():
+    """'webp' when Pillow can write it, otherwise 'jpg'; raises RuntimeError without Pillow"""
+    try:
+        from PIL import features
+    except ImportError:
+        raise RuntimeError('Media previews require the Pillow package: pip install -r requirements.txt')
+    return 'webp' if features.check('webp') else 'jpg'
+
+def media_kind(name):
+    extension = os.path.splitext(name)[1].lower()
+    if extension in IMAGE_EXTENSIONS:
+        return 'image'
+    if extension in VIDEO_EXTENSIONS:
+        return 'video'
+    return None
+
+# 在工作进程中执行
+def _save_thumbnail(image, target, size, fmt):
+    from PIL import ImageOps
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((size, size))
+    if fmt == 'jpg' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    elif image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+        image = image.convert('RGBA')
+    tmp_path = f'{target}.{os.getpid()}.tmp'
+    try:
+        image.save(tmp_path, 'WEBP' if fmt == 'webp' else 'JPEG', quality=PREVIEW_QUALITY)
+        os.replace(tmp_path, target)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def render_preview(source, target, size=PREVIEW_SIZE, fmt='webp'):
+    """Write the preview of one media file; returns an error message or None"""
+    from PIL import Image
+    try:
+        if media_kind(source) == 'video':
+            ffmpeg = shutil.which('ffmpeg')
+            if ffmpeg is None:
+                return 'ffmpeg not installed'
+            frame = f'{target}.{os.getpid()}.png'
+            try:
+                subprocess.run(
+                    [ffmpeg, '-v', 'error', '-y', '-i', source, '-frames:v', '1', frame],
+                    check=True, capture_output=True, timeout=POSTER_TIMEOUT
+                )
+                with Image.open(frame) as image:
+                    _save_thumbnail(image, target, size, fmt)
+            finally:
+                try:
+                    os.remove(frame)
+                except OSError:
+                    pass
+        else:
+            with Image.open(source) as image:
+                # 动图只取第一帧
+                image.seek(0)
+                _save_thumbnail(image, target, size, fmt)
+        return None
+    except subprocess.CalledProcessError as e:
+        return (e.stderr or b'').decode('utf-8', 'replace').strip()[:200] or f'ffmpeg exited with {e.returncode}'
+    except Exception as e:
+        return f'{type(e).__name__}: {str(e)}'[:200]
+
+def serve(workers):
+    """Render jobs read from stdin until EOF; writes one result line per job to stdout
+
+    Job lines are JSON [name, source, target, size, format]; result lines are
+    [name, error or null]. SIGTERM drops the queued jobs.
+    """
+    lock = threading.Lock()
+
+    def reply(name, future):
+        if future.cancelled():
+            return
+        try:
+            error = future.result()
+        except Exception as e:
+            error = f'{type(e).__name__}: {str(e)}'[:200]
+        with lock:
+            try:
+                sys.stdout.write(json.dumps([name, error]) + '\n')
+                sys.stdout.flush()
+            except OSError:
+                pass  # 抓取进程已退出
+
+    # 工作进程在池的管理线程运行后按需启动，用 spawn 避免 fork 继承线程持有的锁
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        for line in sys.stdin:
+            name, source, target, size, fmt = json.loads(line)
+            future = executor.submit(render_preview, source, target, size, fmt)
+            future.add_done_callback(functools.partial(reply, name))
+    except SystemExit:
+        # SIGTERM：正在渲染的做完，排队中的丢弃
+        executor.shutdown(wait=True, cancel_futures=True)
+        raise
+    executor.shutdown(wait=True)
+
+class PreviewBuilder:
+    """Derives previews for one group folder in a process pool
+
+    add() schedules a freshly downloaded file; finish() also picks up every
+    media file without a current preview, waits for the pool and writes the
+    manifest. The pool runs in a `media_previews.py --serve` child process;
+    a reader thread hands its results back to the event loop.
+    """
+
+    def __init__(self, group_folder, workers=None, size=PREVIEW_SIZE):
+        self.group_folder = group_folder
+        self.media_folder = os.path.join(group_folder, 'media')
+        self.preview_folder = os.path.join(group_folder, PREVIEW_DIR)
+        self.manifest_path = os.path.join(self.preview_folder, MANIFEST_FILE)
+        self.size = size
+        self.format = preview_format()
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.manifest = {}
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                self.manifest = json.load(f)
+        except (OSError, ValueError):
+            pass
+        self._server = None
+        self._futures = {}
+        self.rendered = 0
+        self.failed = 0
+
+    def _stat_key(self, name):
+        try:
+            stat = os.stat(os.path.join(self.media_folder, name))
+        except OSError:
+            return None
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def is_current(self, name):
+        entry = self.manifest.get(name)
+        if not entry or entry[:2] != self._stat_key(name):
+            return False
+        # 预览文件被删掉时重新生成；失败记录（preview 为 null）直到源文件变化前不重试
+        return entry[2] is None or os.path.exists(os.path.join(self.preview_folder, entry[2]))
+
+    def add(self, media_path):
+        """Schedule a media file (path or name inside media/) unless its preview is current"""
+        name = os.path.basename(media_path)
+        if name in self._futures or media_kind(name) is None or self.is_current(name):
+            return
+        key = self._stat_key(name)
+        if key is None:
+            return
+        if self._server is None:
+            self._start()
+        preview = f'{name}.{self.format}'
+        future = asyncio.get_running_loop().create_future()
+        self._futures[name] = (future, key, preview)
+        job = [name, os.path.join(self.media_folder, name), os.path.join(self.preview_folder, preview), self.size, self.format]
+        try:
+            self._server.stdin.write(json.dumps(job) + '\n')
+            self._server.stdin.flush()
+        except OSError as e:
+            future.set_result(f'Preview worker unavailable: {str(e)}'[:200])
+
+    def _start(self):
+        os.makedirs(self.preview_folder, exist_ok=True)
+        # 独立的子进程作为池的主进程：工作进程不会重新导入抓取脚本，也不继承它的线程和锁
+        self._server = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), '--serve', '--workers', str(self.workers)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True
+        )
+        reader = threading.Thread(
+            target=self._read_results, args=(self._server, asyncio.get_running_loop()),
+            name='preview-results', daemon=True
+        )
+        reader.start()
+
+    def _read_results(self, server, loop):
+        try:
+            for line in server.stdout:
+                name, error = json.loads(line)
+                loop.call_soon_threadsafe(self._resolve, name, error)
+            # 子进程退出后，没有结果的任务按失败处理
+            loop.call_soon_threadsafe(self._resolve, None, 'Preview worker exited')
+        except RuntimeError:
+            pass  # 事件循环已关闭
+
+    def _resolve(self, name, error):
+        """Set the result of a job; name None fails every job still waiting"""
+        if name is None:
+            entries = list(self._futures.values())
+        elif name in self._futures:
+            entries = [self._futures[name]]
+        else:
+            return
+        for future, _, _ in entries:
+            if not future.done():
+                future.set_result(error)
+
+    def pending(self):
+        """Media files without a current preview"""
+        try:
+            names = sorted(os.listdir(self.media_folder))
+        except OSError:
+            return []
+        return [name for name in names if media_kind(name) and not self.is_current(name)]
+
+    async def finish(self):
+        """Render everything still missing, wait for the pool and save the manifest; returns counts"""
+        for name in self.pending():
+            self.add(name)
+        started = time.monotonic()
+        try:
+            if self._server is not None:
+                # EOF 让子进程做完剩余任务后退出
+                self._server.stdin.close()
+            for name, (future, key, preview) in list(self._futures.items()):
+                error = await future
+                self.manifest[name] = key + ([None, error] if error else [preview, None])
+                if error:
+                    self.failed += 1
+                else:
+                    self.rendered += 1
+            if self._server is not None:
+                await asyncio.get_running_loop().run_in_executor(None, self._server.wait)
+        finally:
+            self._futures.clear()
+            self.save()
+            self.close()
+        return {'rendered': self.rendered, 'failed': self.failed, 'seconds': round(time.monotonic() - started, 2)}
+
+    def save(self):
+        # 媒体已被删除或淘汰时，连同预览一起清理
+        for name in list(self.manifest):
+            if not os.path.exists(os.path.join(self.media_folder, name)):
+                preview = self.manifest.pop(name)[2]
+                if preview:
+                    try:
+                        os.remove(os.path.join(self.preview_folder, preview))
+                    except OSError:
+                        pass
+        if self.manifest or os.path.exists(self.manifest_path):
+            os.makedirs(self.preview_folder, exist_ok=True)
+            write_atomic(self.manifest_path, json.dumps(self.manifest, ensure_ascii=False))
+
+    def close(self):
+        """Stop the pool; queued work is dropped (it is redone on the next run)"""
+        if self._server is not None:
+            if self._server.poll() is None:
+                self._server.terminate()
+            self._server = None
+
+def main():
+    parser = argparse.ArgumentParser(description='Create preview images for a scraped group folder')
+    parser.add_argument('--group-folder', help='Group folder containing media/')
+    parser.add_argument('--workers', type=int, help='Worker processes (default: up to 4)')
+    parser.add_argument('--size', type=int, default=PREVIEW_SIZE, help='Longest preview side in pixels')
+    parser.add_argument('--serve', action='store_true', help='Render jobs from stdin (JSON lines) for PreviewBuilder')
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.workers or min(4, os.cpu_count() or 1))
+        return
+    if not args.group_folder:
+        parser.error('--group-folder is required')
+
+    try:
+        builder = PreviewBuilder(args.group_folder, args.workers, args.size)
+    except RuntimeError as e:
+        print(json.dumps({'type': 'error', 'message': str(e)}), file=sys.stderr)
+        sys.exit(1)
+    result = asyncio.run(builder.finish())
+    print(json.dumps({'type': 'previews', 'data': result}))
+
+if __name__ == '__main__':
+    main()
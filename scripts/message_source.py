@@ -0,0 +1,212 @@
+"""
+Lightweight message-source loader for auto_chat
+
+Loads a message-source CSV once into compact typed columns (no pandas) and
+gives O(1) row access in either order, so the chat loop never copies or
+re-indexes the whole source. Sources compiled by compile_source.py are
+memory-mapped from a `.pack` file instead of parsed.
+
+Pack layout (native byte order, sections 8-byte aligned):
+    header           magic, row count, length of the type-name JSON
+    type names       JSON list
+    ids              int64 * count
+    content offsets  uint64 * (count + 1), into the string blob
+    media offsets    uint64 * (count + 1), into the string blob
+    type codes       uint8 * count
+    string blob      UTF-8 contents, then UTF-8 media_file values
+"""
+import os
+import csv
+import sys
+import json
+import mmap
+import shutil
+import struct
+import tempfile
+from array import array
+
+# 运行时只需要这几列，其余列（date、username 等）不加载
+FIELDS = ('id', 'type', 'content', 'media_file')
+
+PACK_MAGIC = b'TGMSPK1\x00'
+PACK_HEADER = struct.Struct('<8sQQ')
+
+def iter_csv_rows(path):
+    """Stream (line_number, id, type, content, media_file) from a message-source CSV
+
+    Empty strings become None; an unparsable id is returned as None.
+    """
+    # 导出 CSV 可能已被 storage_manager 压缩到冷存储（.zst）
+    from storage_manager import open_text
+    csv.field_size_limit(sys.maxsize)
+    with open_text(path) as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            try:
+                msg_id = int(row.get('id') or 0)
+            except ValueError:
+                msg_id = None
+            yield (
+                reader.line_num,
+                msg_id,
+                (row.get('type') or '').strip(),
+                row.get('content') or None,
+                (row.get('media_file') or '').strip() or None
+            )
+
+class MessageSource:
+    """Read-only, column-oriented message source"""
+
+    __slots__ = ('ids', 'type_codes', 'type_names', 'contents', 'media_files')
+
+    def __init__(self, ids, type_codes, type_names, contents, media_files):
+        self.ids = ids                  # array('q')
+        self.type_codes = type_codes    # bytearray, 每行一个类型编号
+        self.type_names = type_names    # 类型编号 -> 类型名
+        self.contents = contents        # list[str | None]
+        self.media_files = media_files  # list[str | None]
+
+    @classmethod
+    def from_csv(cls, path):
+        """Stream a message-source CSV into compact columns"""
+        ids = array('q')
+        type_codes = bytearray()
+        type_names = []
+        type_lookup = {}
+        contents = []
+        media_files = []
+
+        for _, msg_id, msg_type, content, media_file in iter_csv_rows(path):
+            ids.append(msg_id or 0)
+            code = type_lookup.get(msg_type)
+            if code is None:
+                code = len(type_names)
+                type_lookup[msg_type] = code
+                type_names.append(msg_type)
+            type_codes.append(code)
+            contents.append(content)
+            media_files.append(media_file)
+
+        return cls(ids, type_codes, type_names, contents, media_files)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def row(self, index):
+        """Return row `index` in file order as a dict"""
+        return {
+            'id': self.ids[index],
+            'type': self.type_names[self.type_codes[index]],
+            'content': self.contents[index],
+            'media_file': self.media_files[index]
+        }
+
+    def row_reversed(self, index):
+        """Return row `index` counting from the end of the file"""
+        return self.row(len(self.ids) - 1 - index)
+
+def _pad8(n):
+    return (n + 7) & ~7
+
+class PackedMessageSource:
+    """Memory-mapped message source compiled by compile_source.py
+
+    Media of every row was checked at compile time, so rows carry
+    `media_verified` and the chat loop skips its own file checks.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, types_len = PACK_HEADER.unpack_from(self._mm, 0)
+        if magic != PACK_MAGIC:
+            raise ValueError(f'Not a message source pack: {path}')
+
+        view = memoryview(self._mm)
+        pos = PACK_HEADER.size
+        self.type_names = json.loads(bytes(view[pos:pos + types_len]).decode('utf-8'))
+        pos = _pad8(pos + types_len)
+        self.ids = view[pos:pos + 8 * count].cast('q')
+        pos += 8 * count
+        self._content_offsets = view[pos:pos + 8 * (count + 1)].cast('Q')
+        pos += 8 * (count + 1)
+        self._media_offsets = view[pos:pos + 8 * (count + 1)].cast('Q')
+        pos += 8 * (count + 1)
+        self.type_codes = view[pos:pos + count]
+        self._blob = view[_pad8(pos + count):]
+        self._count = count
+
+    def _string(self, offsets, index):
+        start, end = offsets[index], offsets[index + 1]
+        if start == end:
+            return None
+        return bytes(self._blob[start:end]).decode('utf-8')
+
+    def __len__(self):
+        return self._count
+
+    def row(self, index):
+        """Return row `index` in file order as a dict"""
+        return {
+            'id': self.ids[index],
+            'type': self.type_names[self.type_codes[index]],
+            'content': self._string(self._content_offsets, index),
+            'media_file': self._string(self._media_offsets, index),
+            'media_verified': True
+        }
+
+    def row_reversed(self, index):
+        """Return row `index` counting from the end of the file"""
+        return self.row(self._count - 1 - index)
+
+def write_pack(path, rows):
+    """Write an iterable of (id, type, content, media_file) rows as a pack file
+
+    Strings are streamed to temporary files; only the fixed-width columns
+    are kept in memory. The pack is replaced atomically.
+    """
+    ids = array('q')
+    type_codes = bytearray()
+    type_names = []
+    type_lookup = {}
+    content_offsets = array('Q', [0])
+    media_offsets = array('Q', [0])
+
+    with tempfile.TemporaryFile() as contents, tempfile.TemporaryFile() as media_files:
+        for msg_id, msg_type, content, media_file in rows:
+            ids.append(msg_id)
+            code = type_lookup.get(msg_type)
+            if code is None:
+                code = len(type_names)
+                type_lookup[msg_type] = code
+                type_names.append(msg_type)
+            type_codes.append(code)
+            content_offsets.append(content_offsets[-1] + contents.write((content or '').encode('utf-8')))
+            media_offsets.append(media_offsets[-1] + media_files.write((media_file or '').encode('utf-8')))
+
+        # media 字符串排在 content 之后
+        media_base = content_offsets[-1]
+        media_offsets = array('Q', (offset + media_base for offset in media_offsets))
+        types_json = json.dumps(type_names).encode('utf-8')
+
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as out:
+            out.write(PACK_HEADER.pack(PACK_MAGIC, len(ids), len(types_json)))
+            out.write(types_json)
+            out.write(b'\x00' * (_pad8(out.tell()) - out.tell()))
+            for column in (ids, content_offsets, media_offsets):
+                column.tofile(out)
+            out.write(type_codes)
+            out.write(b'\x00' * (_pad8(out.tell()) - out.tell()))
+            for blob in (contents, media_files):
+                blob.seek(0)
+                shutil.copyfileobj(blob, out)
+        os.replace(tmp_path, path)
+
+    return len(ids)
+
+def load_message_source(path):
+    """Load a message source file (`.pack` or CSV)"""
+    if path.endswith('.pack'):
+        return PackedMessageSource(path)
+    return MessageSource.from_csv(path)
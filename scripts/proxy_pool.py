@@ -0,0 +1,224 @@
+"""
+Latency-aware proxy selection for Telegram connections
+
+Every configured proxy gets a health record (`.cache/proxy_health.json`,
+shared by all scripts): the last measured time to open a tunnel to a
+Telegram DC through it, or when it last failed. Measurements expire after
+HEALTH_TTL, failures after FAILURE_TTL.
+
+connect_client() ranks the proxies by that record and races tunnel opens to
+the session's own DC: the best candidate starts first and the next one joins
+every STAGGER seconds (or as soon as one fails). The client then connects
+through the first proxy that answered, so a dead proxy costs seconds instead
+of a full connect timeout. check_proxies() measures all proxies in parallel.
+
+Usage:
+    python3 proxy_pool.py            # check all PROXY_CONFIGS and print the ranking
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+from config import PROXY_CONFIGS, ROOT_DIR
+from disk_writer import write_atomic
+
+CACHE_FILE = os.environ.get('PROXY_CACHE_FILE', os.path.join(ROOT_DIR, '.cache', 'proxy_health.json'))
+
+HEALTH_TIMEOUT = 8     # 单个代理打通隧道的超时（秒）
+HEALTH_TTL = 600       # 延迟测量的有效期
+FAILURE_TTL = 120      # 失败的代理在这段时间内排到最后
+STAGGER = 1.5          # 前一个候选多久未连通就启动下一个
+RACE_WIDTH = 3         # 同时竞速的候选数
+CONNECT_TIMEOUT = 30   # 选定代理后客户端连接的超时
+
+# telethon 默认的 DC（会话还没有 DC 信息时使用）
+DEFAULT_DC = ('149.154.167.51', 443)
+
+log = logging.getLogger('proxy_pool')
+
+def proxy_key(proxy):
+    return f"{proxy['proxy_type']}://{proxy['addr']}:{proxy['port']}"
+
+def telethon_proxy(proxy):
+    """Proxy dict as TelegramClient expects it (remote DNS on)"""
+    return dict(proxy, rdns=proxy.get('rdns', True))
+
+class ProxyHealth:
+    """Latency and failure records per proxy, persisted between runs"""
+
+    def __init__(self, path=CACHE_FILE):
+        self.path = path
+        self.records = {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.records = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            write_atomic(self.path, json.dumps(self.records))
+        except OSError as e:
+            log.debug(f'Failed to save proxy health: {str(e)}')
+
+    def success(self, proxy, latency):
+        self.records[proxy_key(proxy)] = {'latency': round(latency, 4), 'checked': time.time(), 'failures': 0}
+
+    def failure(self, proxy, error=None):
+        record = self.records.setdefault(proxy_key(proxy), {})
+        record.update({'failed': time.time(), 'failures': record.get('failures', 0) + 1,
+                       'error': str(error) if error else None})
+        record.pop('latency', None)
+
+    def state(self, proxy, now=None):
+        """('good', latency), ('unknown', None) or ('failed', None)"""
+        now = time.time() if now is None else now
+        record = self.records.get(proxy_key(proxy), {})
+        if record.get('failed') and now - record['failed'] < FAILURE_TTL:
+            return 'failed', None
+        if 'latency' in record and now - record.get('checked', 0) < HEALTH_TTL:
+            return 'good', record['latency']
+        return 'unknown', None
+
+    def rank(self, proxies):
+        """Proxies ordered fastest known first, then unmeasured, then recently failed"""
+        now = time.time()
+        order = {'good': 0, 'unknown': 1, 'failed': 2}
+
+        def key(item):
+            index, proxy = item
+            state, latency = self.state(proxy, now)
+            failures = self.records.get(proxy_key(proxy), {}).get('failures', 0)
+            return order[state], latency or 0, failures, index
+        return [proxy for _, proxy in sorted(enumerate(proxies), key=key)]
+
+_health = None
+
+def get_health():
+    """Process-wide ProxyHealth"""
+    global _health
+    if _health is None:
+        _health = ProxyHealth()
+    return _health
+
+async def probe(proxy, target=DEFAULT_DC, timeout=HEALTH_TIMEOUT):
+    """Seconds needed to open a tunnel to target through proxy; raises on failure"""
+    from python_socks import ProxyType
+    from python_socks.async_.asyncio import Proxy
+
+    proxy_types = {'socks5': ProxyType.SOCKS5, 'socks4': ProxyType.SOCKS4, 'http': ProxyType.HTTP}
+    started = time.monotonic()
+    tunnel = Proxy.create(
+        proxy_type=proxy_types[str(proxy['proxy_type']).lower()],
+        host=proxy['addr'],
+        port=proxy['port'],
+        username=proxy.get('username'),
+        password=proxy.get('password'),
+        rdns=proxy.get('rdns', True)
+    )
+    sock = await tunnel.connect(dest_host=target[0], dest_port=target[1], timeout=timeout)
+    sock.close()
+    return time.monotonic() - started
+
+async def check_proxies(proxies=None, target=DEFAULT_DC, timeout=HEALTH_TIMEOUT):
+    """Measure every proxy in parallel; returns them ranked"""
+    proxies = PROXY_CONFIGS if proxies is None else proxies
+    health = get_health()
+    results = await asyncio.gather(*(probe(proxy, target, timeout) for proxy in proxies), return_exceptions=True)
+    for proxy, result in zip(proxies, results):
+        if isinstance(result, BaseException):
+            health.failure(proxy, result)
+        else:
+            health.success(proxy, result)
+    health.save()
+    return health.rank(proxies)
+
+async def race(candidates, target=DEFAULT_DC, stagger=STAGGER, timeout=HEALTH_TIMEOUT):
+    """Staggered tunnel race; returns the first proxy that connects (None if all fail)"""
+    health = get_health()
+    queue = list(candidates)
+    pending = {}
+    try:
+        while queue or pending:
+            if queue:
+                proxy = queue.pop(0)
+                pending[asyncio.ensure_future(probe(proxy, target, timeout))] = proxy
+            # 还有候选时最多等 stagger 秒；有尝试失败则立即启动下一个
+            done, _ = await asyncio.wait(set(pending), timeout=stagger if queue else None,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                proxy = pending.pop(task)
+                if task.exception() is None:
+                    health.success(proxy, task.result())
+                    return proxy
+                health.failure(proxy, task.exception())
+        return None
+    finally:
+        for task in pending:
+            task.cancel()
+
+def _session_dc(client):
+    session = getattr(client, 'session', None)
+    address = getattr(session, 'server_address', None)
+    port = getattr(session, 'port', None)
+    return (address, port) if address and port else DEFAULT_DC
+
+async def connect_client(client, proxies=None, width=RACE_WIDTH, stagger=STAGGER, connect_timeout=CONNECT_TIMEOUT):
+    """Connect a not yet connected TelegramClient through the healthiest proxy; returns the proxy used
+
+    Clients without set_proxy (cassette replay) and runs without proxies connect directly.
+    Raises ConnectionError when no proxy works.
+    """
+    proxies = PROXY_CONFIGS if proxies is None else proxies
+    if not proxies or not hasattr(client, 'set_proxy'):
+        await client.connect()
+        return None
+
+    health = get_health()
+    target = _session_dc(client)
+    remaining = health.rank(proxies)
+    last_error = None
+    try:
+        while remaining:
+            proxy = await race(remaining[:width], target, stagger)
+            if proxy is None:
+                # 这一批都连不上，换下一批
+                last_error = health.records[proxy_key(remaining[0])].get('error')
+                remaining = remaining[width:]
+                continue
+            # 只排除这次选中的代理，其余候选（包括之前运行中失败过的）仍可尝试
+            remaining = [p for p in remaining if p is not proxy]
+            client.set_proxy(telethon_proxy(proxy))
+            try:
+                await asyncio.wait_for(client.connect(), connect_timeout)
+                log.debug(f'Connected through {proxy_key(proxy)}')
+                return proxy
+            except (OSError, ConnectionError, asyncio.TimeoutError) as e:
+                # 隧道通了但 MTProto 连接失败
+                last_error = e
+                health.failure(proxy, e)
+                try:
+                    await client.disconnect()
+                except Exception:
+                    pass
+        raise ConnectionError(f'No proxy could reach Telegram (last error: {last_error})')
+    finally:
+        health.save()
+
+def main():
+    ranked = asyncio.run(check_proxies())
+    health = get_health()
+    for proxy in ranked:
+        state, latency = health.state(proxy)
+        record = health.records.get(proxy_key(proxy), {})
+        print(json.dumps({
+            'proxy': proxy_key(proxy),
+            'state': state,
+            'latency_ms': round(latency * 1000, 1) if latency is not None else None,
+            'error': record.get('error') if state == 'failed' else None
+        }), flush=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Time budget and graceful stop for a scrape run
+
+`--timeout` gives the run a deadline. ScrapeBudget cancels the attached task
+`margin` seconds before it, or as soon as SIGTERM/SIGINT arrives. The scrape
+functions catch that cancellation, flush their checkpoint and report a
+resumable partial result, so a run stopped by the deadline or by the web
+route loses nothing a rerun would have to fetch again.
+"""
+import time
+import signal
+import asyncio
+import logging
+
+# 截止前预留给落盘和汇报结果的时间（秒）
+MIN_MARGIN = 5
+MAX_MARGIN = 60
+
+STOP_SIGNALS = (signal.SIGTERM, signal.SIGINT)
+
+log = logging.getLogger('scrape_budget')
+
+class ScrapeBudget:
+    def __init__(self, timeout=None, margin=None):
+        """
+        timeout: seconds the whole run may take; None or 0 means no deadline
+        margin: seconds kept in reserve for flushing (default 10% of timeout, 5-60s)
+        """
+        self.timeout = timeout if timeout and timeout > 0 else None
+        if margin is None:
+            margin = min(MAX_MARGIN, max(MIN_MARGIN, self.timeout * 0.1)) if self.timeout else 0
+        self.margin = margin
+        self.started = time.monotonic()
+        self.stop_reason = None
+        self.signum = None
+        self._task = None
+        self._timer = None
+
+    @property
+    def stopping(self):
+        return self.stop_reason is not None
+
+    def remaining(self):
+        """Seconds left before the deadline, or None without one"""
+        if self.timeout is None:
+            return None
+        return self.timeout - (time.monotonic() - self.started)
+
+    def attach(self, task=None):
+        """Cancel `task` (default: the current task) when the budget runs out or a stop signal arrives"""
+        loop = asyncio.get_running_loop()
+        self._task = task or asyncio.current_task()
+        if self.timeout is not None:
+            self._timer = loop.call_later(max(0, self.remaining() - self.margin), self.request_stop, 'timeout')
+        for signum in STOP_SIGNALS:
+            try:
+                loop.add_signal_handler(signum, self._on_signal, signum)
+            except (NotImplementedError, RuntimeError):
+                # Windows 的事件循环不支持 add_signal_handler
+                signal.signal(signum, lambda s, frame: loop.call_soon_threadsafe(self._on_signal, s))
+
+    def detach(self):
+        """Stop watching; called once the run is past the point where stopping early helps"""
+        self._task = None
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _on_signal(self, signum):
+        if self._task is None:
+            log.info(f'Received {signal.Signals(signum).name} while finishing; letting the run complete')
+            return
+        if self.stop_reason is not None:
+            log.warning(f'Received {signal.Signals(signum).name} again; still saving state')
+            return
+        self.signum = signum
+        self.request_stop(signal.Signals(signum).name)
+
+    def request_stop(self, reason):
+        """Stop the attached task; `reason` is 'timeout' or the signal name"""
+        if self.stop_reason is not None or self._task is None:
+            return
+        self.stop_reason = reason
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._task.done():
+            self._task.cancel()
+
+    def exit_code(self):
+        """0 for a finished or timed-out run, 128 + signal number after a stop signal"""
+        return 128 + self.signum if self.signum else 0
@@ -0,0 +1,183 @@
+"""
+Dry-run cost estimate for a scrape
+
+Uses only count queries (get_messages with limit=0 returns the total without
+any messages) plus one small sample page per media filter for file sizes, so
+an estimate costs a dozen requests whatever the size of the group. The
+result says how many rows, media files and bytes a scrape would produce and
+roughly how long it would take, so large jobs can be scheduled (or refused)
+before they hit disk or time limits.
+"""
+import os
+import math
+import time
+import shutil
+from datetime import timedelta
+
+# 计数用的媒体过滤器（telethon.tl.types 中的类名）
+MEDIA_COUNT_FILTERS = {
+    'photos': 'InputMessagesFilterPhotos',
+    'videos': 'InputMessagesFilterVideo',
+    'documents': 'InputMessagesFilterDocument',
+    'voice': 'InputMessagesFilterVoice',
+    'music': 'InputMessagesFilterMusic',
+    'round_videos': 'InputMessagesFilterRoundVideo'
+}
+
+# 每种媒体抽样的消息数（一次请求）
+SAMPLE_SIZE = 20
+
+# 估算下载耗时使用的带宽假设（MB/s），结果中会注明
+ASSUMED_DOWNLOAD_MB_PER_SEC = 2.0
+
+HISTORY_PAGE_SIZE = 100
+
+class _Timer:
+    """Mean round-trip time of the estimate's own requests"""
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+
+    async def call(self, coro):
+        started = time.monotonic()
+        try:
+            return await coro
+        finally:
+            self.calls += 1
+            self.seconds += time.monotonic() - started
+
+    @property
+    def mean(self):
+        return self.seconds / self.calls if self.calls else 0.0
+
+async def _edge_id(client, entity, timer, offset_date=None, reverse=False, params=None):
+    """Id of the first message at/after (reverse) or before offset_date, newest message without a date"""
+    kwargs = dict(params or {}, limit=1)
+    if offset_date is not None:
+        kwargs['offset_date'] = offset_date
+    if reverse:
+        kwargs['reverse'] = True
+    messages = await timer.call(client.get_messages(entity, **kwargs))
+    return messages[0].id if messages else None
+
+def _sample_sizes(messages):
+    sizes = []
+    for message in messages:
+        file = getattr(message, 'file', None)
+        size = getattr(file, 'size', None) if file is not None else None
+        if size:
+            sizes.append(size)
+    return sizes
+
+async def estimate_scrape(client, group, limit=None, start_date=None, end_date=None, topic_id=None,
+                          params=None, skip_media=False, data_dir=None, date_range_lookups=False):
+    """Estimate rows, media files, bytes and duration of a scrape without fetching history
+
+    params: extra iter_messages arguments (server-side filters) the scrape would use
+    date_range_lookups: the scrape does one extra request per row (message links)
+    """
+    from telethon.tl import types
+
+    timer = _Timer()
+    entity = await timer.call(client.get_input_entity(group))
+    params = dict(params or {})
+    topic = {'reply_to': int(topic_id)} if topic_id else {}
+
+    async def count(**kwargs):
+        # limit=0 只返回计数，不返回消息
+        return (await timer.call(client.get_messages(entity, limit=0, **kwargs))).total or 0
+
+    # 历史总数
+    topic_share = None
+    if topic and params:
+        # 带过滤条件时 telethon 无法按话题计数：用话题占全群的比例折算
+        all_total = await count()
+        topic_share = (await count(**topic)) / all_total if all_total else 0.0
+        total = int(round(await count(**params) * topic_share))
+    else:
+        total = await count(**params, **topic)
+
+    # 抓取范围占全部历史的比例
+    fraction = 1.0
+    range_info = {}
+    if start_date is not None:
+        newest = await _edge_id(client, entity, timer, params=topic)
+        first = await _edge_id(client, entity, timer, start_date, reverse=True, params=topic)
+        last = await _edge_id(client, entity, timer, end_date + timedelta(seconds=1), params=topic)
+        if not newest or not first or not last or last < first:
+            fraction = 0.0
+        else:
+            # 消息 id 近似均匀分布，按 id 跨度折算
+            fraction = min(1.0, (last - first + 1) / newest)
+        range_info = {'first_id': first, 'last_id': last, 'newest_id': newest}
+    elif limit:
+        fraction = min(1.0, limit / total) if total else 0.0
+    rows = int(round(total * fraction))
+
+    # 各类媒体的数量与抽样大小
+    media = {}
+    total_files = 0
+    total_bytes = 0
+    if 'filter' not in params:
+        filters = MEDIA_COUNT_FILTERS
+    else:
+        filters = {params['filter'].__name__: params['filter'].__name__}
+    if topic and topic_share is None:
+        all_total = await count()
+        topic_share = (await count(**topic)) / all_total if all_total else 0.0
+    for name, filter_name in filters.items():
+        count_params = dict(params, filter=getattr(types, filter_name))
+        media_count = await count(**count_params)
+        if topic:
+            # 同理，话题内的媒体数按比例折算
+            media_count = int(round(media_count * topic_share))
+        files = int(round(media_count * fraction))
+        entry = {'files': files}
+        if files and not skip_media:
+            sample_params = dict(count_params, limit=SAMPLE_SIZE)
+            if end_date is not None:
+                sample_params['offset_date'] = end_date + timedelta(seconds=1)
+            sizes = _sample_sizes(await timer.call(client.get_messages(entity, **sample_params)))
+            mean_size = sum(sizes) / len(sizes) if sizes else 0
+            entry.update({'sampled': len(sizes), 'mean_bytes': int(mean_size), 'bytes': int(mean_size * files)})
+            total_bytes += entry['bytes']
+        total_files += files
+        media[name] = entry
+
+    # 耗时：计数和抓取两遍历史分页，每个媒体一次取消息加下载
+    rtt = timer.mean
+    history_calls = 2 * math.ceil(rows / HISTORY_PAGE_SIZE)
+    seconds = history_calls * rtt
+    if date_range_lookups:
+        seconds += rows * rtt
+    if not skip_media:
+        seconds += total_files * rtt + total_bytes / (ASSUMED_DOWNLOAD_MB_PER_SEC * 1024 * 1024)
+
+    estimate = {
+        'group': group,
+        'total_messages': total,
+        'rows': rows,
+        'range_fraction': round(fraction, 4),
+        'media_files': 0 if skip_media else total_files,
+        'media_bytes': 0 if skip_media else total_bytes,
+        'media': media,
+        'requests': history_calls + (0 if skip_media else total_files) + (rows if date_range_lookups else 0),
+        'rtt_ms': round(rtt * 1000, 1),
+        'duration_s': round(seconds, 1),
+        'assumed_download_mb_per_sec': ASSUMED_DOWNLOAD_MB_PER_SEC,
+        'estimate_requests': timer.calls
+    }
+    if range_info:
+        estimate['range'] = range_info
+    if data_dir is not None:
+        # 数据目录可能还没创建，取最近的已存在上级目录
+        while not os.path.exists(data_dir) and os.path.dirname(data_dir) != data_dir:
+            data_dir = os.path.dirname(data_dir)
+        try:
+            free = shutil.disk_usage(data_dir).free
+            estimate['disk_free_bytes'] = free
+            estimate['fits_on_disk'] = estimate['media_bytes'] < free
+        except OSError:
+            pass
+    return estimate
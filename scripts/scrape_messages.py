@@ -1,3 +1,4 @@
+from fast_start import mark
 import sys
 import os
 
@@ -6,17 +7,11 @@ os.environ['PYTHONUNBUFFERED'] = '1'
 sys.stdout.reconfigure(encoding='utf-8', line_buffering=True)
 sys.stderr.reconfigure(encoding='utf-8', line_buffering=True)
 
-from telethon import TelegramClient, events, functions, types
-from telethon.errors import FloodWaitError, RPCError
 import csv
 from datetime import datetime
 import asyncio
-import os
-import json
-import logging
 from pathlib import Path
 import argparse
-import random
 import time
 from config import (
     API_ID,
@@ -24,24 +19,23 @@ from config import (
     MEDIA_DIR,
     PROXY_CONFIGS
 )
+from sticker_index import StickerIndex
+from instrumentation import instrument_client
+from scrape_status import ScrapeStatus
+from structured_log import setup_logging, emit
+from disk_writer import get_disk_writer, log_failure, write_csv_atomic, append_csv_rows
+from scrape_budget import ScrapeBudget
+from message_stats import STAT_FIELDS, stats_from_message, refresh_rows
+from storage_manager import StorageGuard, StorageFull, is_disk_full, exists, open_text, thaw, drop_cold_copy
+# telethon、会话存储、代理池和预览进程池在用到时才导入，参数错误和 --help 不必等待它们加载
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('telegram_scraper.log', encoding='utf-8')
-    ]
-)
+# Configure logging: records are queued and written by a background thread
+log = setup_logging('scrape_messages', log_file='telegram_scraper.log')
 
-# Helper function for JSON output with forced flush
+# Helper function for JSON protocol output
 def print_json(data, file=sys.stdout):
-    """Print JSON with forced flush for real-time streaming"""
-    print(json.dumps(data), flush=True, file=file)
-
-# Disable telethon's detailed logging
-logging.getLogger('telethon').setLevel(logging.WARNING)
+    """Queue a JSON protocol line; the logging thread writes it in order and flushes"""
+    emit(data, stderr=file is sys.stderr)
 
 # Configure paths
 DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'scraped_data')
@@ -54,23 +48,117 @@ def get_user_sessions_dir(user_email):
 os.makedirs(DATA_DIR, exist_ok=True)
 os.makedirs(SESSIONS_DIR, exist_ok=True)
 
+def telethon_error(name):
+    """telethon.errors.<name> once telethon is loaded, else None (nothing can have raised it)"""
+    return getattr(sys.modules.get('telethon.errors'), name, None)
+
+def network_errors():
+    """Errors the scrape loops retry; used directly in `except` clauses
+
+    The tuple is built when an exception is matched, so replayed runs, which
+    only load telethon to raise a recorded FloodWaitError, never import it.
+    """
+    rpc_error = telethon_error('RPCError')
+    errors = (ConnectionError, OSError, asyncio.TimeoutError)
+    return errors + (rpc_error,) if rpc_error is not None else errors
+
+def is_flood_wait(error):
+    flood_wait_error = telethon_error('FloodWaitError')
+    return flood_wait_error is not None and isinstance(error, flood_wait_error)
+
 def sanitize_filename(filename):
     """Clean filename, remove illegal characters"""
     return "".join(c for c in filename if c.isalnum() or c in (' ', '-', '_', '.'))
 
+# --media-filter 可选值对应的服务端过滤器（telethon.tl.types 中的类名）
+MEDIA_FILTERS = {
+    'photos': 'InputMessagesFilterPhotos',
+    'videos': 'InputMessagesFilterVideo',
+    'photo_video': 'InputMessagesFilterPhotoVideo',
+    'documents': 'InputMessagesFilterDocument',
+    'voice': 'InputMessagesFilterVoice',
+    'music': 'InputMessagesFilterMusic',
+    'links': 'InputMessagesFilterUrl'
+}
+
+def server_filters(filters):
+    """iter_messages arguments that make Telegram filter server-side
+
+    filters: {'media': MEDIA_FILTERS key, 'from_user': username or id, 'search': text}
+    """
+    params = {}
+    if not filters:
+        return params
+    if filters.get('media'):
+        from telethon.tl import types
+        params['filter'] = getattr(types, MEDIA_FILTERS[filters['media']])
+    from_user = filters.get('from_user')
+    if from_user:
+        params['from_user'] = int(from_user) if from_user.lstrip('-').isdigit() else from_user
+    if filters.get('search'):
+        params['search'] = filters['search']
+    return params
+
+def message_in_topic(message, topic_id):
+    """Whether a message belongs to a forum topic (for requests that cannot be scoped to one)"""
+    reply_to = getattr(message, 'reply_to', None)
+    if reply_to is None:
+        return message.id == topic_id
+    top_id = getattr(reply_to, 'reply_to_top_id', None) or getattr(reply_to, 'reply_to_msg_id', None)
+    return top_id == topic_id
+
+def export_paths(user_email, group_username, topic_id=None, start_date=None, end_date=None, filters=None):
+    """(group folder, CSV file) of a group's export
+
+    Date-range and filtered exports carry the range / filters in the name, so
+    their checkpoints never mix with those of a full export.
+    """
+    group_folder = os.path.join(DATA_DIR, user_email, sanitize_filename(group_username))
+    date_str = f"_{start_date.strftime('%Y%m%d')}_to_{end_date.strftime('%Y%m%d')}" if start_date else ""
+    topic_suffix = f"_topic{topic_id}" if topic_id else ""
+    filter_suffix = ""
+    if filters:
+        parts = [filters.get('media') or '']
+        if filters.get('from_user'):
+            parts.append(f"from-{filters['from_user']}")
+        if filters.get('search'):
+            parts.append(f"search-{filters['search'][:40]}")
+        filter_suffix = sanitize_filename('_'.join(part for part in parts if part).replace(' ', '-'))
+        filter_suffix = f"_{filter_suffix}" if filter_suffix else ""
+    csv_file = os.path.join(group_folder, f'{sanitize_filename(group_username)}_messages{date_str}{topic_suffix}{filter_suffix}.csv')
+    return group_folder, csv_file
+
+# 每个 CSV 已确认写入 checkpoint 文件的行数（写线程成功后才更新）
+_checkpoint_rows = {}
+# 已交给写线程的行数；之后的保存只追加这之后的新行
+_checkpoint_queued = {}
+
+def _reset_checkpoint_rows(csv_file, rows=0):
+    _checkpoint_rows[csv_file] = _checkpoint_queued[csv_file] = rows
+
 def load_checkpoint(csv_file):
     """Load previously scraped message IDs from checkpoint file"""
     checkpoint_file = f'{csv_file}.tmp'
     scraped_messages = []
     scraped_ids = set()
+    _reset_checkpoint_rows(csv_file)
     
-    if os.path.exists(checkpoint_file):
+    if exists(checkpoint_file):
         try:
+            # 转入冷存储的 checkpoint 先解压，之后会继续追加
+            thaw(checkpoint_file)
             with open(checkpoint_file, 'r', encoding='utf-8') as f:
                 reader = csv.DictReader(f)
+                torn = False
                 for row in reader:
+                    # 进程中断时最后一行可能只写了一半
+                    if None in row or None in row.values() or not row['id'].isdigit():
+                        torn = True
+                        continue
                     scraped_messages.append(row)
                     scraped_ids.add(int(row['id']))
+            # 有残缺行时下次保存整体重写，避免新行接在残行后面
+            _reset_checkpoint_rows(csv_file, 0 if torn else len(scraped_messages))
             print_json({
                 'type': 'info',
                 'message': f'Resuming from checkpoint: {len(scraped_messages)} messages already scraped'
@@ -85,29 +173,48 @@ def load_checkpoint(csv_file):
     
     return scraped_messages, scraped_ids
 
-def save_checkpoint(csv_file, messages, fieldnames):
-    """Save current progress to checkpoint file"""
-    checkpoint_file = f'{csv_file}.tmp'
-    try:
-        with open(checkpoint_file, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(messages)
-    except Exception as e:
-        print_json({
-            'type': 'warning',
-            'message': f'Failed to save checkpoint: {str(e)}'
-        })
+def save_checkpoint(csv_file, messages, fieldnames, status=None):
+    """Append messages not yet in the checkpoint file; written on the disk writer thread"""
+    written = _checkpoint_queued.get(csv_file, 0)
+    if written > len(messages):
+        written = 0
+    if written and written == len(messages):
+        return
+    rows = messages[written:]
+    total = len(messages)
+    _checkpoint_queued[csv_file] = total
+    
+    # 没有已写入的行时重写文件（含表头），丢弃可能残留的旧内容
+    future = get_disk_writer().submit(append_csv_rows, f'{csv_file}.tmp', rows, fieldnames, written == 0)
+    future.add_done_callback(log_failure('Saving checkpoint'))
+    loop = asyncio.get_running_loop() if status is not None else None
+    
+    def committed(f):
+        # 在写线程中执行
+        if f.cancelled() or f.exception() is not None:
+            # 写入失败（可能只写了一部分）：下次保存整体重写，这些行不会被跳过
+            _reset_checkpoint_rows(csv_file)
+            return
+        _checkpoint_rows[csv_file] = total
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(status.checkpoint_saved, total)
+            except RuntimeError:
+                pass  # 事件循环已关闭
+    future.add_done_callback(committed)
+
+async def finalize_csv(csv_file, messages, fieldnames):
+    """Finalize CSV file and remove checkpoint (on the disk writer thread)"""
+    await get_disk_writer().run(_finalize_csv, csv_file, list(messages), fieldnames)
+    _checkpoint_rows.pop(csv_file, None)
+    _checkpoint_queued.pop(csv_file, None)
 
-def finalize_csv(csv_file, messages, fieldnames):
-    """Finalize CSV file and remove checkpoint"""
+def _finalize_csv(csv_file, messages, fieldnames):
     checkpoint_file = f'{csv_file}.tmp'
     
     # Write final CSV
-    with open(csv_file, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
-        writer.writerows(messages)
+    write_csv_atomic(csv_file, messages, fieldnames)
+    drop_cold_copy(csv_file)
     
     # Remove checkpoint file
     if os.path.exists(checkpoint_file):
@@ -116,8 +223,46 @@ def finalize_csv(csv_file, messages, fieldnames):
         except:
             pass
 
-async def download_media(message, group_folder):
-    """Download media files"""
+def _save_partial(csv_file, messages, fieldnames):
+    # checkpoint 留给下次续抓（含已下载的 media_file）；同时写出当前结果供直接下载
+    write_csv_atomic(f'{csv_file}.tmp', messages, fieldnames)
+    write_csv_atomic(csv_file, messages, fieldnames)
+    drop_cold_copy(csv_file)
+
+async def report_partial(budget, status, group_username, group_folder, csv_file, messages, fieldnames, sticker_index=None):
+    """Flush everything a rerun needs and report a resumable partial result"""
+    phase = status.phase
+    if sticker_index is not None:
+        sticker_index.close()
+    if csv_file and messages:
+        await get_disk_writer().run(_save_partial, csv_file, list(messages), fieldnames)
+        _reset_checkpoint_rows(csv_file, len(messages))
+        status.checkpoint_saved(len(messages))
+    status.stop(budget.stop_reason)
+    
+    if messages:
+        print_json({
+            'type': 'result',
+            'data': {
+                'group': group_username,
+                'totalMessages': len(messages),
+                'mediaFiles': len([msg for msg in messages if msg.get('media_file')]),
+                'csvFile': csv_file,
+                'folderPath': group_folder,
+                'partial': True,
+                'stopReason': budget.stop_reason,
+                'phase': phase
+            }
+        })
+    print_json({
+        'type': 'complete',
+        'message': f'Stopped early ({budget.stop_reason}) during {phase}: saved {len(messages)} messages. Run again to resume.',
+        'csv_file': csv_file,
+        'partial': True
+    })
+
+async def download_media(message, group_folder, sticker_index=None):
+    """Download media files; sticker references go into the group's sticker index"""
     try:
         if message.media:
             media_folder = os.path.join(group_folder, 'media')
@@ -133,18 +278,14 @@ async def download_media(message, group_folder):
                 if message.sticker:
                     file_name = f"sticker_{message.id}.webp"
                     media_type = "sticker"
-                    # 只为贴纸保存额外信息
+                    # 只为贴纸保存额外信息，写入分组的贴纸索引
                     document = message.media.document
-                    sticker_info = {
-                        'id': document.id,
-                        'access_hash': document.access_hash,
-                        'file_reference': document.file_reference.hex()
-                    }
-                    # 保存sticker信息到json文件
-                    json_file_name = f"sticker_{message.id}.json"
-                    json_file_path = os.path.join(media_folder, json_file_name)
-                    with open(json_file_path, 'w', encoding='utf-8') as f:
-                        json.dump(sticker_info, f, indent=2)
+                    sticker_ref = (f"sticker_{message.id}", document.id, document.access_hash, document.file_reference)
+                    if sticker_index is not None:
+                        sticker_index.add(*sticker_ref)
+                    else:
+                        with StickerIndex(media_folder) as index:
+                            index.add(*sticker_ref)
                 elif message.video:
                     file_name = f"video_{message.id}.mp4"
                     media_type = "video"
@@ -174,6 +315,9 @@ async def download_media(message, group_folder):
                 # 返回相对于group_folder的路径，使用media/作为前缀
                 return f"media/{file_name}"
             except Exception as e:
+                if is_disk_full(e):
+                    _discard(file_path)
+                    raise
                 # If direct download fails, try alternative method
                 try:
                     if hasattr(message.media, 'photo'):
@@ -189,12 +333,44 @@ async def download_media(message, group_folder):
                             await message.client.download_media(document, file_path)
                             return f"media/{file_name}"
                 except Exception as inner_e:
-                    logging.error(f"Alternative download method failed: {str(inner_e)}")
+                    if is_disk_full(inner_e):
+                        _discard(file_path)
+                        raise
+                    log.warning(f"Alternative download method failed: {str(inner_e)}")
                     
     except Exception as e:
-        logging.error(f"Failed to download media: {str(e)}")
+        # 磁盘写满交给调用方停止下载媒体
+        if is_disk_full(e):
+            raise
+        log.warning(f"Failed to download media: {str(e)}")
     return None
 
+def _discard(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+async def fetch_message_media(client, entity, msg, group_folder, sticker_index=None, storage=None):
+    """Download the media of a scraped row; raises StorageFull when it would not fit"""
+    msg_obj = await client.get_messages(entity, ids=int(msg['id']))
+    if not msg_obj or not msg_obj.media:
+        return None
+    size = getattr(getattr(msg_obj, 'file', None), 'size', None) or 0
+    if storage is not None and not storage.allows(size):
+        raise StorageFull(storage.reason)
+    try:
+        media_path = await download_media(msg_obj, group_folder, sticker_index)
+    except OSError as e:
+        if not is_disk_full(e):
+            raise
+        if storage is not None:
+            storage.stop('disk full')
+        raise StorageFull('disk full')
+    if media_path and storage is not None:
+        storage.add(os.path.join(group_folder, media_path))
+    return media_path
+
 async def get_message_content(message):
     """Get message content and type"""
     if message.media:
@@ -214,64 +390,103 @@ async def get_message_content(message):
 
 async def connect_with_session(session_file, user_email):
     """Connect to Telegram using session file with retry mechanism"""
+    from telethon import TelegramClient
+    from session_store import open_session
+    from proxy_pool import connect_client
+    
     MAX_RETRIES = 3
     RETRY_DELAY = 5  # seconds
     
     for attempt in range(MAX_RETRIES):
         try:
-            # Select a random proxy from the list
-            proxy_config = random.choice(PROXY_CONFIGS) if PROXY_CONFIGS else None
-            
+            # 代理由 connect_client 按健康状况竞速选择，不再随机挑选后等待超时
             client = TelegramClient(
-                session_file,
+                open_session(session_file),
                 API_ID,
                 API_HASH,
-                proxy=proxy_config,
                 connection_retries=3,
                 retry_delay=3,
                 timeout=300,  # 增加到 300 秒
                 request_retries=3
             )
+            instrument_client(client)
             
-            await client.connect()
+            await connect_client(client, PROXY_CONFIGS)
             
             if not await client.is_user_authorized():
-                print(json.dumps({
+                print_json({
                     "type": "error",
                     "message": "Session is not authorized"
-                }), flush=True)
+                })
                 return None
                 
-            print(json.dumps({
+            mark('connected')
+            print_json({
                 "type": "info",
                 "message": "Successfully connected"
-            }), flush=True)
+            })
             return client
             
         except Exception as e:
             error_msg = str(e)
             if attempt < MAX_RETRIES - 1:
-                print(json.dumps({
+                print_json({
                     "type": "info",
                     "message": f"Connection attempt {attempt + 1} failed, retrying in {RETRY_DELAY} seconds... Error: {error_msg}"
-                }))
+                })
                 await asyncio.sleep(RETRY_DELAY)
                 continue
             
-            print(json.dumps({
+            print_json({
                 "type": "error",
                 "message": f"Failed to connect with session {session_file}: {error_msg}"
-            }), file=sys.stderr)
+            }, file=sys.stderr)
             return None
     
-    print(json.dumps({
+    print_json({
         "type": "error",
         "message": f"All connection attempts failed after {MAX_RETRIES} retries"
-    }), file=sys.stderr)
+    }, file=sys.stderr)
     return None
 
-async def scrape_group(client, group_username, message_limit=1000, user_email=None, topic_id=None, skip_media=False):
-    """Scrape messages from a group with progress updates"""
+def start_previews(group_folder, enabled=True):
+    """PreviewBuilder for the group's media, or None when disabled or Pillow is missing"""
+    if not enabled:
+        return None
+    from media_previews import PreviewBuilder
+    try:
+        return PreviewBuilder(group_folder)
+    except RuntimeError as e:
+        print_json({
+            'type': 'warning',
+            'message': f'Skipping media previews: {str(e)}'
+        })
+        return None
+
+async def finish_previews(previews, status):
+    """Wait for the preview workers after the media step; failures never fail the scrape"""
+    if previews is None:
+        return None
+    status.set_phase('previews')
+    try:
+        result = await previews.finish()
+    except Exception as e:
+        log.warning(f'Failed to create media previews: {str(e)}')
+        return None
+    print_json({
+        'type': 'info',
+        'message': f"Created {result['rendered']} media previews ({result['failed']} failed)"
+    })
+    return result
+
+async def scrape_group(client, group_username, message_limit=1000, user_email=None, topic_id=None, skip_media=False, status=None, budget=None, enrich=False,
+                       filters=None, storage=None, previews=False):
+    """Scrape messages from a group with progress updates; returns the result data (None if stopped early)"""
+    if status is None:
+        status = ScrapeStatus()
+    # 被 budget 提前停止时需要落盘的状态
+    group_folder = csv_file = fieldnames = sticker_index = preview_builder = None
+    messages = []
     try:
         # Get the input entity with retry
         MAX_RETRIES = 3
@@ -295,27 +510,30 @@ async def scrape_group(client, group_username, message_limit=1000, user_email=No
         if not entity:
             raise Exception("Failed to get group entity after all retries")
             
-        # Create necessary directories
-        group_folder = os.path.join(DATA_DIR, user_email, sanitize_filename(group_username))
+        # Create necessary directories (CSV file path with optional topic)
+        group_folder, csv_file = export_paths(user_email, group_username, topic_id, filters=filters)
         os.makedirs(group_folder, exist_ok=True)
-        
-        # CSV file path with optional topic
-        topic_suffix = f"_topic{topic_id}" if topic_id else ""
-        csv_file = os.path.join(group_folder, f'{sanitize_filename(group_username)}_messages{topic_suffix}.csv')
+        status.bind(group_username, group_folder, csv_file)
         
         # Prepare iter_messages parameters
         iter_params = {'limit': message_limit}
-        if topic_id:
+        # 媒体类型、发送者、关键词由服务端过滤
+        iter_params.update(server_filters(filters))
+        # 带过滤条件时 telethon 无法同时按话题请求，话题改为本地判断
+        local_topic = int(topic_id) if topic_id and iter_params.keys() & {'filter', 'from_user', 'search'} else None
+        if topic_id and not local_topic:
             iter_params['reply_to'] = int(topic_id)
         
         topic_msg = f" (Topic ID: {topic_id})" if topic_id else ""
         media_msg = " (media will be skipped)" if skip_media else " (including media)"
+        filter_msg = f" (filters: {', '.join(f'{k}={v}' for k, v in filters.items() if v)})" if filters else ""
         print_json({
             'type': 'info',
-            'message': f'Scraping up to {message_limit} messages{topic_msg}{media_msg}'
+            'message': f'Scraping up to {message_limit} messages{topic_msg}{media_msg}{filter_msg}'
         })
         
         # Get total message count with retry
+        status.set_phase('counting')
         total_messages = 0
         for attempt in range(MAX_RETRIES):
             try:
@@ -324,6 +542,8 @@ async def scrape_group(client, group_username, message_limit=1000, user_email=No
                     # Skip bot messages
                     if msg.sender and hasattr(msg.sender, 'bot') and msg.sender.bot:
                         continue
+                    if local_topic and not message_in_topic(msg, local_topic):
+                        continue
                     total_messages += 1
                 break
             except Exception as e:
@@ -346,8 +566,13 @@ async def scrape_group(client, group_username, message_limit=1000, user_email=No
         
         # 加载断点（如果存在）
         fieldnames = ['id', 'date', 'type', 'content', 'media_file']
+        if enrich:
+            # 统计列直接取自历史消息页，不产生额外请求
+            fieldnames += STAT_FIELDS
         messages, scraped_ids = load_checkpoint(csv_file)
         processed = len(messages)
+        status.checkpoint_rows = processed
+        status.set_phase('fetching', target_messages)
         
         # 第一步：先抓取所有消息内容
         last_progress = -1
@@ -369,12 +594,15 @@ async def scrape_group(client, group_username, message_limit=1000, user_email=No
                     # Skip bot messages
                     if message.sender and hasattr(message.sender, 'bot') and message.sender.bot:
                         continue
+                    if local_topic and not message_in_topic(message, local_topic):
+                        continue
                     
                     # Skip already scraped messages
                     if message.id in scraped_ids:
                         continue
                         
                     processed += 1
+                    status.progress(processed)
                     progress = int((processed / target_messages) * 100) if target_messages > 0 else 0
                     current_time = time.time()
                     
@@ -390,34 +618,37 @@ async def scrape_group(client, group_username, message_limit=1000, user_email=No
                     
                     try:
                         content, msg_type = await get_message_content(message)
-                        messages.append({
+                        row = {
                             'id': message.id,
                             'date': message.date.isoformat(),
                             'type': msg_type,
                             'content': content,
                             'media_file': ''  # Will be filled if media is downloaded
-                        })
+                        }
+                        if enrich:
+                            row.update(stats_from_message(message))
+                        messages.append(row)
                         scraped_ids.add(message.id)
                         
                         # 增量保存
                         if len(messages) % SAVE_INTERVAL == 0:
-                            save_checkpoint(csv_file, messages, fieldnames)
+                            save_checkpoint(csv_file, messages, fieldnames, status)
                             
                     except Exception as e:
-                        print_json({
-                            'type': 'warning',
-                            'message': f'Error processing message {message.id}: {str(e)}'
-                        })
+                        # 逐条的警告走日志（同类重复会被限流）
+                        log.warning(f'Error processing message {message.id}: {str(e)}')
                         continue
                 
                 # 成功完成，退出重试循环
                 break
                 
-            except (RPCError, ConnectionError, OSError, asyncio.TimeoutError) as e:
+            except network_errors() as e:
                 network_retry_count += 1
+                if is_flood_wait(e):
+                    status.record_flood_wait(e.seconds)
                 if network_retry_count < MAX_NETWORK_RETRIES:
                     # 保存当前进度
-                    save_checkpoint(csv_file, messages, fieldnames)
+                    save_checkpoint(csv_file, messages, fieldnames, status)
                     print_json({
                         'type': 'warning',
                         'message': f'Network error occurred: {str(e)}. Retrying {network_retry_count}/{MAX_NETWORK_RETRIES} in {NETWORK_RETRY_DELAY} seconds...'
@@ -425,7 +656,7 @@ async def scrape_group(client, group_username, message_limit=1000, user_email=No
                     await asyncio.sleep(NETWORK_RETRY_DELAY)
                 else:
                     # 保存当前进度后抛出错误
-                    save_checkpoint(csv_file, messages, fieldnames)
+                    save_checkpoint(csv_file, messages, fieldnames, status)
                     print_json({
                         'type': 'error',
                         'message': f'Network error after {MAX_NETWORK_RETRIES} retries. Saved {len(messages)} messages to checkpoint.'
@@ -438,7 +669,9 @@ async def scrape_group(client, group_username, message_limit=1000, user_email=No
             'message': 'Finalizing CSV file...'
         })
         
-        finalize_csv(csv_file, messages, fieldnames)
+        status.set_phase('finalizing')
+        await finalize_csv(csv_file, messages, fieldnames)
+        status.checkpoint_saved(len(messages))
         
         # 如果不跳过媒体，则处理媒体文件
         if not skip_media:
@@ -448,7 +681,17 @@ async def scrape_group(client, group_username, message_limit=1000, user_email=No
             })
             
             media_messages = [msg for msg in messages if msg['type'] in ['photo', 'video', 'sticker', 'file']]
+            status.set_phase('media', len(media_messages))
+            media_trimmed = None
+            sticker_index = StickerIndex(os.path.join(group_folder, 'media'), writer=get_disk_writer())
+            # 预览图在进程池中生成，与后续下载并行
+            preview_builder = start_previews(group_folder, previews)
             for i, msg in enumerate(media_messages, 1):
+                media_path = None
+                # 续抓时跳过上次已下载的媒体
+                if msg.get('media_file') and os.path.exists(os.path.join(group_folder, msg['media_file'])):
+                    status.media_progress(i)
+                    continue
                 try:
                     print_json({
                         'type': 'progress',
@@ -458,18 +701,24 @@ async def scrape_group(client, group_username, message_limit=1000, user_email=No
                         'message': f'Processing media file {i}/{len(media_messages)}'
                     })
                     
-                    msg_obj = await client.get_messages(entity, ids=msg['id'])
-                    if msg_obj and msg_obj.media:
-                        media_folder = os.path.join(group_folder, 'media')
-                        os.makedirs(media_folder, exist_ok=True)
-                        media_path = await download_media(msg_obj, group_folder)
-                        if media_path:
-                            msg['media_file'] = media_path
-                except Exception as e:
+                    media_path = await fetch_message_media(client, entity, msg, group_folder, sticker_index, storage)
+                    if media_path:
+                        msg['media_file'] = media_path
+                        if preview_builder is not None:
+                            preview_builder.add(media_path)
+                except StorageFull as e:
+                    # 配额或磁盘空间不足：保留已下载的媒体，其余行不带媒体完成
+                    media_trimmed = str(e)
                     print_json({
                         'type': 'warning',
-                        'message': f'Failed to process media for message {msg["id"]}: {str(e)}'
+                        'message': f'Stopped downloading media after {i - 1}/{len(media_messages)} files: {media_trimmed}'
                     })
+                    break
+                except Exception as e:
+                    log.warning(f'Failed to process media for message {msg["id"]}: {str(e)}')
+                status.media_progress(i, os.path.join(group_folder, media_path) if media_path else None)
+            sticker_index.close()
+            sticker_index = None
             
             # 更新CSV中的媒体文件路径
             print_json({
@@ -477,41 +726,71 @@ async def scrape_group(client, group_username, message_limit=1000, user_email=No
                 'message': 'Updating CSV with media file paths...'
             })
             
-            with open(csv_file, 'w', newline='', encoding='utf-8') as f:
-                writer = csv.DictWriter(f, fieldnames=['id', 'date', 'type', 'content', 'media_file'])
-                writer.writeheader()
-                writer.writerows(messages)
+            await get_disk_writer().run(write_csv_atomic, csv_file, list(messages), fieldnames)
+            status.checkpoint_saved(len(messages))
+            
+            # 补齐之前运行缺少的预览并等待全部完成
+            await finish_previews(preview_builder, status)
+            preview_builder = None
+        
+        # 结果已完整落盘，之后的停止信号不再中断
+        if budget is not None:
+            budget.detach()
         
         # 发送完成结果（无论是否跳过媒体）
         media_count = 0 if skip_media else len([msg for msg in messages if msg.get('media_file')])
+        result = {
+            'group': group_username,
+            'totalMessages': len(messages),
+            'mediaFiles': media_count,
+            'csvFile': csv_file,
+            'folderPath': group_folder
+        }
+        if not skip_media and media_trimmed:
+            result['mediaTrimmed'] = media_trimmed
         print_json({
             'type': 'result',
-            'data': {
-                'group': group_username,
-                'totalMessages': len(messages),
-                'mediaFiles': media_count,
-                'csvFile': csv_file,
-                'folderPath': group_folder
-            }
+            'data': result
         })
         
         # 发送完成消息
         media_status = ' (media skipped)' if skip_media else ''
+        if not skip_media and media_trimmed:
+            media_status = f' (media trimmed: {media_trimmed})'
         print_json({
             'type': 'complete',
             'message': f'Successfully scraped messages{media_status}',
             'csv_file': csv_file
         })
+        status.finish()
+        return result
+        
+    except asyncio.CancelledError:
+        if budget is None or not budget.stopping:
+            raise
+        await report_partial(budget, status, group_username, group_folder, csv_file, messages, fieldnames, sticker_index)
         
     except Exception as e:
+        status.finish(e)
         print_json({
             'type': 'error',
             'message': str(e)
         }, file=sys.stderr)
         raise e
+    
+    finally:
+        # 提前停止或出错时丢弃排队的预览任务，下次运行会补齐
+        if preview_builder is not None:
+            preview_builder.close()
 
-async def scrape_group_by_date_range(client, group_username, start_date, end_date, user_email=None, topic_id=None, skip_media=True):
+async def scrape_group_by_date_range(client, group_username, start_date, end_date, user_email=None, topic_id=None, skip_media=True, status=None, budget=None, enrich=False,
+                                     filters=None, storage=None, previews=False):
     """Scrape messages from a group within a date range with progress updates"""
+    if status is None:
+        status = ScrapeStatus()
+    # 被 budget 提前停止时需要落盘的状态
+    group_folder = csv_file = fieldnames = sticker_index = preview_builder = None
+    messages = []
     try:
         # Get the input entity with retry
         MAX_RETRIES = 3
@@ -524,10 +803,10 @@ async def scrape_group_by_date_range(client, group_username, start_date, end_dat
                 break
             except Exception as e:
                 if attempt < MAX_RETRIES - 1:
-                    print(json.dumps({
+                    print_json({
                         "type": "info",
                         "message": f"Failed to get entity, attempt {attempt + 1}/{MAX_RETRIES}. Retrying in {RETRY_DELAY} seconds..."
-                    }))
+                    })
                     await asyncio.sleep(RETRY_DELAY)
                 else:
                     raise e
@@ -535,23 +814,21 @@ async def scrape_group_by_date_range(client, group_username, start_date, end_dat
         if not entity:
             raise Exception("Failed to get group entity after all retries")
             
-        # Create necessary directories
-        group_folder = os.path.join(DATA_DIR, user_email, sanitize_filename(group_username))
+        # Create necessary directories (CSV file path with date range and optional topic)
+        group_folder, csv_file = export_paths(user_email, group_username, topic_id, start_date, end_date, filters)
         os.makedirs(group_folder, exist_ok=True)
-        
-        # CSV file path with date range and optional topic
-        date_str = f"{start_date.strftime('%Y%m%d')}_to_{end_date.strftime('%Y%m%d')}"
-        topic_suffix = f"_topic{topic_id}" if topic_id else ""
-        csv_file = os.path.join(group_folder, f'{sanitize_filename(group_username)}_messages_{date_str}{topic_suffix}.csv')
+        status.bind(group_username, group_folder, csv_file)
         
         topic_msg = f" (Topic ID: {topic_id})" if topic_id else ""
         media_msg = " (media will be skipped)" if skip_media else " (including media)"
+        filter_msg = f" (filters: {', '.join(f'{k}={v}' for k, v in filters.items() if v)})" if filters else ""
         print_json({
             'type': 'info',
-            'message': f'Scraping messages from {start_date} to {end_date}{topic_msg}{media_msg}'
+            'message': f'Scraping messages from {start_date} to {end_date}{topic_msg}{media_msg}{filter_msg}'
         })
         
         # 第一步：先计算消息总数
+        status.set_phase('counting')
         print_json({
             'type': 'info',
             'message': 'Counting messages in date range...'
@@ -559,7 +836,11 @@ async def scrape_group_by_date_range(client, group_username, start_date, end_dat
         
         # Prepare iter_messages parameters
         iter_params = {'offset_date': start_date, 'reverse': True}
-        if topic_id:
+        # 媒体类型、发送者、关键词由服务端过滤
+        iter_params.update(server_filters(filters))
+        # 带过滤条件时 telethon 无法同时按话题请求，话题改为本地判断
+        local_topic = int(topic_id) if topic_id and iter_params.keys() & {'filter', 'from_user', 'search'} else None
+        if topic_id and not local_topic:
             iter_params['reply_to'] = int(topic_id)
         
         total_messages = 0
@@ -569,6 +850,8 @@ async def scrape_group_by_date_range(client, group_username, start_date, end_dat
             # Skip bot messages
             if message.sender and hasattr(message.sender, 'bot') and message.sender.bot:
                 continue
+            if local_topic and not message_in_topic(message, local_topic):
+                continue
             total_messages += 1
             if total_messages % 100 == 0:  # 每100条更新一次计数
                 print_json({
@@ -583,8 +866,13 @@ async def scrape_group_by_date_range(client, group_username, start_date, end_dat
         
         # 加载断点（如果存在）
         fieldnames = ['id', 'date', 'type', 'content', 'username', 'message_link', 'media_file']
+        if enrich:
+            # 统计列直接取自历史消息页，不产生额外请求
+            fieldnames += STAT_FIELDS
         messages, scraped_ids = load_checkpoint(csv_file)
         processed = len(messages)
+        status.checkpoint_rows = processed
+        status.set_phase('fetching', total_messages)
         
         # 第二步：抓取所有消息内容
         last_progress = -1
@@ -609,12 +897,15 @@ async def scrape_group_by_date_range(client, group_username, start_date, end_dat
                     # Skip bot messages
                     if message.sender and hasattr(message.sender, 'bot') and message.sender.bot:
                         continue
+                    if local_topic and not message_in_topic(message, local_topic):
+                        continue
                     
                     # Skip already scraped messages
                     if message.id in scraped_ids:
                         continue
                         
                     processed += 1
+                    status.progress(processed)
                     progress = int((processed / total_messages) * 100) if total_messages > 0 else 0
                     current_time = time.time()
                     
@@ -656,10 +947,10 @@ async def scrape_group_by_date_range(client, group_username, start_date, end_dat
                                 if chat_id.startswith('-100'):
                                     chat_id = chat_id[4:]  # 去掉 -100 前缀
                                 message_link = f'https://t.me/c/{chat_id}/{message.id}'
-                        except:
+                        except Exception:
                             message_link = f'Message ID: {message.id}'
                         
-                        messages.append({
+                        row = {
                             'id': message.id,
                             'date': message.date.isoformat(),
                             'type': msg_type,
@@ -667,28 +958,31 @@ async def scrape_group_by_date_range(client, group_username, start_date, end_dat
                             'username': username,
                             'message_link': message_link,
                             'media_file': ''  # Will be filled if media is downloaded
-                        })
+                        }
+                        if enrich:
+                            row.update(stats_from_message(message))
+                        messages.append(row)
                         scraped_ids.add(message.id)
                         
                         # 增量保存
                         if len(messages) % SAVE_INTERVAL == 0:
-                            save_checkpoint(csv_file, messages, fieldnames)
+                            save_checkpoint(csv_file, messages, fieldnames, status)
                             
                     except Exception as e:
-                        print_json({
-                            'type': 'warning',
-                            'message': f'Error processing message {message.id}: {str(e)}'
-                        })
+                        # 逐条的警告走日志（同类重复会被限流）
+                        log.warning(f'Error processing message {message.id}: {str(e)}')
                         continue
                 
                 # 成功完成，退出重试循环
                 break
                 
-            except (RPCError, ConnectionError, OSError, asyncio.TimeoutError) as e:
+            except network_errors() as e:
                 network_retry_count += 1
+                if is_flood_wait(e):
+                    status.record_flood_wait(e.seconds)
                 if network_retry_count < MAX_NETWORK_RETRIES:
                     # 保存当前进度
-                    save_checkpoint(csv_file, messages, fieldnames)
+                    save_checkpoint(csv_file, messages, fieldnames, status)
                     print_json({
                         'type': 'warning',
                         'message': f'Network error occurred: {str(e)}. Retrying {network_retry_count}/{MAX_NETWORK_RETRIES} in {NETWORK_RETRY_DELAY} seconds...'
@@ -696,7 +990,7 @@ async def scrape_group_by_date_range(client, group_username, start_date, end_dat
                     await asyncio.sleep(NETWORK_RETRY_DELAY)
                 else:
                     # 保存当前进度后抛出错误
-                    save_checkpoint(csv_file, messages, fieldnames)
+                    save_checkpoint(csv_file, messages, fieldnames, status)
                     print_json({
                         'type': 'error',
                         'message': f'Network error after {MAX_NETWORK_RETRIES} retries. Saved {len(messages)} messages to checkpoint.'
@@ -709,7 +1003,9 @@ async def scrape_group_by_date_range(client, group_username, start_date, end_dat
             'message': 'Finalizing CSV file...'
         })
         
-        finalize_csv(csv_file, messages, fieldnames)
+        status.set_phase('finalizing')
+        await finalize_csv(csv_file, messages, fieldnames)
+        status.checkpoint_saved(len(messages))
         
         # 如果不跳过媒体，则处理媒体文件
         if not skip_media:
@@ -720,7 +1016,17 @@ async def scrape_group_by_date_range(client, group_username, start_date, end_dat
             
             # 处理媒体文件
             media_messages = [msg for msg in messages if msg['type'] in ['photo', 'video', 'sticker', 'file']]
+            status.set_phase('media', len(media_messages))
+            media_trimmed = None
+            sticker_index = StickerIndex(os.path.join(group_folder, 'media'), writer=get_disk_writer())
+            # 预览图在进程池中生成，与后续下载并行
+            preview_builder = start_previews(group_folder, previews)
             for i, msg in enumerate(media_messages, 1):
+                media_path = None
+                # 续抓时跳过上次已下载的媒体
+                if msg.get('media_file') and os.path.exists(os.path.join(group_folder, msg['media_file'])):
+                    status.media_progress(i)
+                    continue
                 try:
                     print_json({
                         'type': 'progress',
@@ -731,18 +1037,24 @@ async def scrape_group_by_date_range(client, group_username, start_date, end_dat
                     })
                     
                     # 获取原始消息对象
-                    msg_obj = await client.get_messages(entity, ids=msg['id'])
-                    if msg_obj and msg_obj.media:
-                        media_folder = os.path.join(group_folder, 'media')
-                        os.makedirs(media_folder, exist_ok=True)
-                        media_path = await download_media(msg_obj, group_folder)
-                        if media_path:
-                            msg['media_file'] = media_path
-                except Exception as e:
+                    media_path = await fetch_message_media(client, entity, msg, group_folder, sticker_index, storage)
+                    if media_path:
+                        msg['media_file'] = media_path
+                        if preview_builder is not None:
+                            preview_builder.add(media_path)
+                except StorageFull as e:
+                    # 配额或磁盘空间不足：保留已下载的媒体，其余行不带媒体完成
+                    media_trimmed = str(e)
                     print_json({
                         'type': 'warning',
-                        'message': f'Failed to process media for message {msg["id"]}: {str(e)}'
+                        'message': f'Stopped downloading media after {i - 1}/{len(media_messages)} files: {media_trimmed}'
                     })
+                    break
+                except Exception as e:
+                    log.warning(f'Failed to process media for message {msg["id"]}: {str(e)}')
+                status.media_progress(i, os.path.join(group_folder, media_path) if media_path else None)
+            sticker_index.close()
+            sticker_index = None
             
             # 更新CSV中的媒体文件路径
             print_json({
@@ -750,38 +1062,389 @@ async def scrape_group_by_date_range(client, group_username, start_date, end_dat
                 'message': 'Updating CSV with media file paths...'
             })
             
-            with open(csv_file, 'w', newline='', encoding='utf-8') as f:
-                writer = csv.DictWriter(f, fieldnames=['id', 'date', 'type', 'content', 'username', 'message_link', 'media_file'])
-                writer.writeheader()
-                writer.writerows(messages)
+            await get_disk_writer().run(write_csv_atomic, csv_file, list(messages), fieldnames)
+            status.checkpoint_saved(len(messages))
+            
+            # 补齐之前运行缺少的预览并等待全部完成
+            await finish_previews(preview_builder, status)
+            preview_builder = None
+        
+        # 结果已完整落盘，之后的停止信号不再中断
+        if budget is not None:
+            budget.detach()
         
         # 发送完成结果（无论是否跳过媒体）
         media_count = 0 if skip_media else len([msg for msg in messages if msg.get('media_file')])
+        result = {
+            'group': group_username,
+            'totalMessages': len(messages),
+            'mediaFiles': media_count,
+            'csvFile': csv_file,
+            'folderPath': group_folder
+        }
+        if not skip_media and media_trimmed:
+            result['mediaTrimmed'] = media_trimmed
         print_json({
             'type': 'result',
-            'data': {
-                'group': group_username,
-                'totalMessages': len(messages),
-                'mediaFiles': media_count,
-                'csvFile': csv_file,
-                'folderPath': group_folder
-            }
+            'data': result
         })
         
         # 发送完成消息
         media_status = ' (media skipped)' if skip_media else ''
+        if not skip_media and media_trimmed:
+            media_status = f' (media trimmed: {media_trimmed})'
         print_json({
             'type': 'complete',
             'message': f'Successfully scraped messages{media_status}',
             'csv_file': csv_file
         })
+        status.finish()
+        
+    except asyncio.CancelledError:
+        if budget is None or not budget.stopping:
+            raise
+        await report_partial(budget, status, group_username, group_folder, csv_file, messages, fieldnames, sticker_index)
         
     except Exception as e:
+        status.finish(e)
         print_json({
             'type': 'error',
             'message': str(e)
         }, file=sys.stderr)
         raise e
+    
+    finally:
+        # 提前停止或出错时丢弃排队的预览任务，下次运行会补齐
+        if preview_builder is not None:
+            preview_builder.close()
+
+async def refresh_export_stats(client, group_username, csv_file, limit=None, status=None, budget=None):
+    """Refresh the statistics columns of an existing export without re-scraping content"""
+    if status is None:
+        status = ScrapeStatus()
+    if not exists(csv_file):
+        raise Exception(f'No export to refresh: {csv_file}')
+    with open_text(csv_file) as f:
+        reader = csv.DictReader(f)
+        fieldnames = list(reader.fieldnames or [])
+        rows = list(reader)
+    fieldnames += [field for field in STAT_FIELDS if field not in fieldnames]
+    group_folder = os.path.dirname(csv_file)
+    status.bind(group_username, group_folder, csv_file)
+    status.set_phase('enriching', min(len(rows), limit) if limit else len(rows))
+    print_json({
+        'type': 'info',
+        'message': f'Refreshing statistics of {status.total} messages...'
+    })
+    
+    refreshed = 0
+    def progress(count):
+        nonlocal refreshed
+        refreshed = count
+        status.progress(count)
+    try:
+        entity = await client.get_input_entity(group_username)
+        await refresh_rows(client, entity, rows, limit, progress)
+    except asyncio.CancelledError:
+        if budget is None or not budget.stopping:
+            raise
+    # 被提前停止时已刷新的行同样写回
+    await get_disk_writer().run(write_csv_atomic, csv_file, rows, fieldnames)
+    drop_cold_copy(csv_file)
+    status.checkpoint_saved(len(rows))
+    
+    result = {
+        'group': group_username,
+        'totalMessages': len(rows),
+        'statsRefreshed': refreshed,
+        'csvFile': csv_file,
+        'folderPath': group_folder
+    }
+    if budget is not None and budget.stopping:
+        result.update({'partial': True, 'stopReason': budget.stop_reason})
+        status.stop(budget.stop_reason)
+    else:
+        status.finish()
+    print_json({
+        'type': 'result',
+        'data': result
+    })
+    print_json({
+        'type': 'complete',
+        'message': f'Refreshed statistics of {refreshed} messages',
+        'csv_file': csv_file
+    })
+
+# --follow：回填完成后实时追加新消息
+FOLLOW_FLUSH_INTERVAL = 2   # 最多每 2 秒写一次
+FOLLOW_FLUSH_ROWS = 100     # 攒够 100 行立即写
+FOLLOW_WATCH_INTERVAL = 5   # 检查连接状态的间隔（本地检查，不产生 API 调用）
+
+class LiveTail:
+    """Keeps a finished export current from NewMessage/MessageEdited events
+
+    Event handlers only build rows; rows are appended to the CSV in batches,
+    and the file is rewritten only when an already written row was edited.
+    The newest message id seen is tracked; at start-up and after a reconnect
+    everything above it is fetched with one min_id query. Update gaps while
+    connected are recovered by telethon itself (getDifference), and id jumps
+    from service or deleted messages are not gaps, so otherwise no API calls
+    are made.
+    """
+
+    def __init__(self, client, entity, csv_file, group_folder, topic_id=None, skip_media=False, status=None,
+                 stats_interval=0, stats_limit=None, storage=None):
+        self.client = client
+        self.entity = entity
+        self.csv_file = csv_file
+        self.group_folder = group_folder
+        self.topic_id = int(topic_id) if topic_id else None
+        self.skip_media = skip_media
+        self.status = status or ScrapeStatus()
+        self.stats_interval = stats_interval  # 定期刷新统计列的间隔（秒），0 为不刷新
+        self.stats_limit = stats_limit
+        self.storage = storage      # StorageGuard：空间不足时不再下载媒体
+        self.fieldnames = ['id', 'date', 'type', 'content', 'media_file']
+        self.rows = []              # 已写入文件的行
+        self.by_id = {}
+        self.last_id = 0            # 见过的最新消息 id（含被过滤掉的）
+        self.pending = []           # 已接收、尚未写入的行
+        self.waiting_media = set()  # 媒体尚未下载完成的消息 id，对应行暂不写入
+        self.rewrite = False        # 已写入的行被编辑过，下次整体重写
+        self.appended = 0
+        self.sticker_index = None
+        self._wakeup = asyncio.Event()
+        self._media_queue = asyncio.Queue()
+
+    def load(self):
+        """Read the export written by the backfill"""
+        with open(self.csv_file, 'r', encoding='utf-8', newline='') as f:
+            reader = csv.DictReader(f)
+            if reader.fieldnames:
+                self.fieldnames = reader.fieldnames
+            for row in reader:
+                if row.get('id', '').isdigit():
+                    self.rows.append(row)
+                    self.by_id[int(row['id'])] = row
+        self.last_id = max(self.by_id, default=0)
+        if self.stats_interval and 'views' not in self.fieldnames:
+            self.fieldnames = self.fieldnames + [field for field in STAT_FIELDS if field not in self.fieldnames]
+
+    async def accept(self, message):
+        """Queue a row for a new message and advance the id watermark"""
+        self.last_id = max(self.last_id, message.id)
+        if message.id in self.by_id:
+            return
+        # Skip bot messages
+        if message.sender and getattr(message.sender, 'bot', False):
+            return
+        if self.topic_id and not message_in_topic(message, self.topic_id):
+            return
+
+        content, msg_type = await get_message_content(message)
+        row = dict.fromkeys(self.fieldnames, '')
+        row.update({'id': message.id, 'date': message.date.isoformat(), 'type': msg_type, 'content': content})
+        if 'views' in self.fieldnames:
+            row.update(stats_from_message(message))
+        self.by_id[message.id] = row
+        self.pending.append(row)
+        if not self.skip_media and msg_type in ('photo', 'video', 'sticker', 'file'):
+            self.waiting_media.add(message.id)
+            self._media_queue.put_nowait((message, row))
+        if len(self.pending) >= FOLLOW_FLUSH_ROWS:
+            self._wakeup.set()
+
+    async def edit(self, message):
+        """Apply an edit to a row that is already in the export or waiting to be written"""
+        row = self.by_id.get(message.id)
+        if row is None:
+            return
+        content, msg_type = await get_message_content(message)
+        if (row['content'], row['type']) == (content, msg_type):
+            return
+        row['content'], row['type'] = content, msg_type
+        if not any(pending is row for pending in self.pending):
+            self.rewrite = True
+
+    async def _on_new(self, event):
+        await self.accept(event.message)
+
+    async def _on_edit(self, event):
+        await self.edit(event.message)
+
+    async def _fetch_range(self, min_id, max_id=0):
+        """Fetch messages with min_id < id < max_id (no upper bound when max_id is 0)"""
+        params = {'min_id': min_id, 'max_id': max_id, 'reverse': True}
+        if self.topic_id:
+            params['reply_to'] = self.topic_id
+        found = 0
+        async for message in self.client.iter_messages(self.entity, **params):
+            if message.id not in self.by_id:
+                found += 1
+            await self.accept(message)
+        return found
+
+    async def catch_up(self):
+        """Fetch everything newer than the newest id seen (start-up and after reconnects)"""
+        after = self.last_id
+        found = await self._fetch_range(after)
+        if found:
+            log.info(f'Caught up {found} messages after message {after}')
+
+    async def flush(self):
+        """Write every pending row whose media is done (all rows when rewriting after an edit)"""
+        ready = [row for row in self.pending if int(row['id']) not in self.waiting_media]
+        if not ready and not self.rewrite:
+            return
+        self.pending = [row for row in self.pending if int(row['id']) in self.waiting_media]
+        ready.sort(key=lambda row: int(row['id']))
+        self.rows.extend(ready)
+        self.appended += len(ready)
+
+        writer = get_disk_writer()
+        if self.rewrite:
+            self.rewrite = False
+            future = await writer.put(write_csv_atomic, self.csv_file, list(self.rows), self.fieldnames)
+        else:
+            future = await writer.put(append_csv_rows, self.csv_file, ready, self.fieldnames)
+        future.add_done_callback(log_failure('Updating export'))
+        if self.sticker_index is not None:
+            self.sticker_index.flush()
+        self.status.progress(len(self.rows))
+        self.status.checkpoint_saved(len(self.rows))
+        if ready:
+            print_json({
+                'type': 'info',
+                'message': f'Appended {len(ready)} new messages ({len(self.rows)} total)'
+            })
+
+    async def refresh_stats(self):
+        """Refresh the counters of written rows; the next flush rewrites the export"""
+        try:
+            refreshed = await refresh_rows(self.client, self.entity, self.rows, self.stats_limit)
+        except network_errors() as e:
+            log.warning(f'Failed to refresh statistics: {str(e)}')
+            return
+        if refreshed:
+            self.rewrite = True
+
+    async def _download_media(self):
+        while True:
+            message, row = await self._media_queue.get()
+            try:
+                size = getattr(getattr(message, 'file', None), 'size', None) or 0
+                if self.storage is not None and not self.storage.allows(size):
+                    continue
+                media_path = await download_media(message, self.group_folder, self.sticker_index)
+                if media_path:
+                    row['media_file'] = media_path
+                    self.status.media_progress(self.status.media_done + 1, os.path.join(self.group_folder, media_path))
+                    if self.storage is not None:
+                        self.storage.add(os.path.join(self.group_folder, media_path))
+            except OSError as e:
+                if is_disk_full(e):
+                    if self.storage is not None:
+                        self.storage.stop('disk full')
+                else:
+                    # 单个文件失败不影响后续下载，行不带媒体写入
+                    log.warning(f'Failed to download media for message {message.id}: {str(e)}')
+            finally:
+                self.waiting_media.discard(message.id)
+
+    def _transport_connected(self):
+        # 传输层状态是 telethon 的私有接口；不可用时只看用户层连接
+        check = getattr(getattr(self.client, '_sender', None), '_transport_connected', None)
+        return check() if check is not None else self.client.is_connected()
+
+    async def _watch_connection(self):
+        was_connected = True
+        while True:
+            await asyncio.sleep(FOLLOW_WATCH_INTERVAL)
+            try:
+                if not self.client.is_connected():
+                    # telethon 放弃自动重连后由这里重新连接
+                    was_connected = False
+                    await self.client.connect()
+                connected = self._transport_connected()
+                if connected and not was_connected:
+                    log.info(f'Reconnected; catching up after message {self.last_id}')
+                    await self.catch_up()
+                    self._wakeup.set()
+                was_connected = connected
+            except network_errors() as e:
+                log.warning(f'Connection check failed: {str(e)}')
+                was_connected = False
+
+    async def run(self):
+        """Follow until cancelled (deadline or signal); pending rows are written before returning"""
+        from telethon import events
+        self.load()
+        if not self.skip_media:
+            self.sticker_index = StickerIndex(os.path.join(self.group_folder, 'media'), writer=get_disk_writer())
+        handlers = [
+            (self._on_new, events.NewMessage(chats=self.entity)),
+            (self._on_edit, events.MessageEdited(chats=self.entity))
+        ]
+        for callback, event in handlers:
+            self.client.add_event_handler(callback, event)
+        tasks = [asyncio.ensure_future(self._watch_connection())]
+        if not self.skip_media:
+            tasks.append(asyncio.ensure_future(self._download_media()))
+        self.status.set_phase('following')
+        print_json({
+            'type': 'info',
+            'message': f'Following new messages after message {self.last_id}...'
+        })
+        try:
+            # 先订阅再补抓，回填结束到订阅之间的消息不会漏掉
+            await self.catch_up()
+            last_refresh = time.monotonic()
+            while True:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), FOLLOW_FLUSH_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                if self.stats_interval and time.monotonic() - last_refresh >= self.stats_interval:
+                    await self.refresh_stats()
+                    last_refresh = time.monotonic()
+                await self.flush()
+        finally:
+            for callback, event in handlers:
+                self.client.remove_event_handler(callback, event)
+            for task in tasks:
+                task.cancel()
+            # 未下载完的媒体留空，行照常写入
+            self.waiting_media.clear()
+            await self.flush()
+            if self.sticker_index is not None:
+                self.sticker_index.close()
+            await get_disk_writer().drain()
+
+async def follow_group(client, group_username, csv_file, group_folder, topic_id=None, skip_media=False, status=None, budget=None,
+                       stats_interval=0, stats_limit=None, storage=None):
+    """Append new messages of the group to the export written by scrape_group until stopped"""
+    if status is None:
+        status = ScrapeStatus()
+    if budget is not None:
+        budget.attach()
+    tail = None
+    try:
+        entity = await client.get_input_entity(group_username)
+        tail = LiveTail(client, entity, csv_file, group_folder, topic_id, skip_media, status, stats_interval, stats_limit, storage)
+        await tail.run()
+    except asyncio.CancelledError:
+        if budget is None or not budget.stopping:
+            raise
+    appended = tail.appended if tail else 0
+    stop_reason = budget.stop_reason if budget is not None else 'stopped'
+    status.stop(stop_reason)
+    print_json({
+        'type': 'complete',
+        'message': f'Stopped following ({stop_reason}): appended {appended} new messages',
+        'csv_file': csv_file,
+        'appended': appended
+    })
 
 async def main():
     parser = argparse.ArgumentParser(description='Scrape messages from Telegram group')
@@ -789,39 +1452,126 @@ async def main():
     parser.add_argument('--group', required=True, help='Group username or ID')
     parser.add_argument('--limit', type=int, default=1000, help='Maximum number of messages to scrape')
     parser.add_argument('--user-email', required=True, help='User email for organizing data')
-    parser.add_argument('--timeout', type=int, default=90, help='Timeout in seconds')
+    parser.add_argument('--timeout', type=int, default=0, help='Time budget in seconds; stops early with a resumable partial result (0 = no limit)')
     parser.add_argument('--start-date', help='Start date for date range scraping (YYYY-MM-DD)')
     parser.add_argument('--end-date', help='End date for date range scraping (YYYY-MM-DD)')
     parser.add_argument('--topic-id', help='Topic ID for topic groups (optional)')
     parser.add_argument('--skip-media', action='store_true', help='Skip media download (only text messages)')
+    parser.add_argument('--previews', action='store_true', help='Also create preview images for downloaded media (uses extra CPU and disk)')
+    parser.add_argument('--follow', action='store_true', help='After the backfill keep appending new messages until stopped (not with a date range)')
+    parser.add_argument('--media-filter', choices=sorted(MEDIA_FILTERS), help='Only messages with this media type (filtered by Telegram)')
+    parser.add_argument('--from-user', help='Only messages from this member (username or user ID)')
+    parser.add_argument('--search', help='Only messages containing this text (searched by Telegram)')
+    parser.add_argument('--estimate', action='store_true', help='Only print a JSON estimate of rows, media, bytes and duration (count queries, nothing is scraped)')
+    parser.add_argument('--enrich', action='store_true', help='Add view/forward/reply/reaction count columns')
+    parser.add_argument('--refresh-stats', action='store_true', help='Only refresh the count columns of the existing export (no re-scrape)')
+    parser.add_argument('--stats-interval', type=int, default=0, help='With --follow, refresh count columns every N seconds (0 = never)')
+    parser.add_argument('--stats-limit', type=int, help='Refresh counts of the newest N messages only')
+    parser.add_argument('--record', help='Record Telegram traffic to this cassette file')
+    parser.add_argument('--replay', help='Replay Telegram traffic from this cassette file instead of connecting')
+    parser.add_argument('--replay-speed', type=float, default=1.0, help='Replay timing multiplier (0 = no delays)')
+    parser.add_argument('--status-file', help='Live status JSON path (default: scrape_status.json in the group folder)')
+    parser.add_argument('--metrics-file', help='Also write Prometheus text-format metrics to this path')
     
     args = parser.parse_args()
+    if args.follow and (args.start_date or args.end_date):
+        parser.error('--follow cannot be combined with --start-date/--end-date')
+    if args.follow and (args.media_filter or args.from_user or args.search):
+        parser.error('--follow cannot be combined with --media-filter/--from-user/--search')
+    if args.follow and args.replay:
+        parser.error('--follow cannot be combined with --replay (cassettes do not carry live updates)')
+    mark('args_parsed')
     
+    status = ScrapeStatus(args.status_file, args.metrics_file)
+    # 超时前或收到 SIGTERM/SIGINT 时停止抓取并保存可续抓的状态
+    budget = ScrapeBudget(args.timeout)
+    budget.attach()
+    status.budget = budget
+    client = None
     try:
-        client = await connect_with_session(args.session, args.user_email)
+        storage = None
+        if not (args.estimate or args.refresh_stats):
+            # 配额或磁盘余量不足时（先按策略清理旧数据）拒绝开始
+            group_folder, _ = export_paths(args.user_email, args.group)
+            storage = StorageGuard(args.user_email, DATA_DIR, group_folder)
+            storage.admit()
         
-        # 如果提供了日期范围参数，使用日期范围抓取
+        if args.replay:
+            from cassette import ReplayClient
+            client = ReplayClient(args.replay, speed=args.replay_speed)
+        else:
+            client = await connect_with_session(args.session, args.user_email)
+            if client and args.record:
+                from cassette import CassetteWriter, record_client
+                record_client(client, CassetteWriter(args.record))
+        
+        topic_id = args.topic_id if args.topic_id else None
+        skip_media = args.skip_media  # 从参数获取
+        start_date = end_date = None
+        filters = {'media': args.media_filter, 'from_user': args.from_user, 'search': args.search}
+        filters = {key: value for key, value in filters.items() if value} or None
         if args.start_date and args.end_date:
             from datetime import datetime, timezone
             # 将日期字符串转换为UTC时区的datetime对象
             start_date = datetime.strptime(args.start_date, '%Y-%m-%d').replace(tzinfo=timezone.utc)
             end_date = datetime.strptime(args.end_date, '%Y-%m-%d').replace(hour=23, minute=59, second=59, tzinfo=timezone.utc)
-            topic_id = args.topic_id if args.topic_id else None
-            skip_media = args.skip_media  # 从参数获取
-            await scrape_group_by_date_range(client, args.group, start_date, end_date, args.user_email, topic_id, skip_media)
+        
+        if args.estimate:
+            # 只做计数查询和少量抽样，不抓取任何消息
+            from scrape_estimate import estimate_scrape
+            estimate = await estimate_scrape(
+                client, args.group, None if start_date else args.limit, start_date, end_date, topic_id,
+                server_filters(filters), skip_media, os.path.join(DATA_DIR, args.user_email),
+                date_range_lookups=start_date is not None
+            )
+            print_json({
+                'type': 'estimate',
+                'data': estimate
+            })
+        elif args.refresh_stats:
+            # 只刷新已有导出的统计列，不重新抓取内容
+            _, csv_file = export_paths(args.user_email, args.group, topic_id, start_date, end_date, filters)
+            await refresh_export_stats(client, args.group, csv_file, args.stats_limit, status, budget)
+        elif start_date:
+            # 如果提供了日期范围参数，使用日期范围抓取
+            await scrape_group_by_date_range(client, args.group, start_date, end_date, args.user_email, topic_id, skip_media, status, budget,
+                                             enrich=args.enrich, filters=filters, storage=storage, previews=args.previews)
         else:
             # 否则使用原来的limit方式
-            topic_id = args.topic_id if args.topic_id else None
-            skip_media = args.skip_media  # 从参数获取
-            await scrape_group(client, args.group, args.limit, args.user_email, topic_id, skip_media)
+            result = await scrape_group(client, args.group, args.limit, args.user_email, topic_id, skip_media, status, budget,
+                                        enrich=args.enrich, filters=filters, storage=storage, previews=args.previews)
+            if result and args.follow:
+                await follow_group(client, args.group, result['csvFile'], result['folderPath'], topic_id, skip_media, status, budget,
+                                   stats_interval=args.stats_interval, stats_limit=args.stats_limit, storage=storage)
+    except asyncio.CancelledError:
+        if not budget.stopping:
+            raise
+        # 连接阶段就被停止，没有需要保存的状态
+        status.stop(budget.stop_reason)
+        print_json({
+            'type': 'complete',
+            'message': f'Stopped early ({budget.stop_reason}) before scraping started',
+            'partial': True
+        })
+    except StorageFull as e:
+        status.finish(e)
+        print_json({
+            'type': 'error',
+            'message': str(e),
+            'code': 'storage_full'
+        }, file=sys.stderr)
+        sys.exit(1)
     except Exception as e:
-        logging.error(f"Error: {str(e)}")
+        log.error(f"Error: {str(e)}")
         sys.exit(1)
     finally:
+        budget.detach()
         try:
             await client.disconnect()
         except:
             pass
+    if budget.exit_code():
+        sys.exit(budget.exit_code())
 
 if __name__ == "__main__":
     import sys
@@ -0,0 +1,243 @@
+"""
+Live status file and Prometheus metrics for long-running scrapes
+
+ScrapeStatus keeps a small JSON snapshot of a scrape (phase, progress,
+rows/sec, media MB/sec, ETA, flood-wait seconds, checkpoint lag, RSS) and
+rewrites it atomically at most every `interval` seconds, so the web app and
+dashboards can poll the file instead of holding the stdout pipe open. The
+snapshot is taken on the event loop; the files are written by the disk writer
+thread.
+
+When a metrics path is given the same numbers are also written in the
+Prometheus text exposition format (e.g. for node_exporter's textfile
+collector).
+"""
+import os
+import sys
+import json
+import time
+from collections import deque
+from instrumentation import flood_wait_counter
+from disk_writer import get_disk_writer, write_atomic
+
+STATUS_FILE_NAME = 'scrape_status.json'
+
+# 计算速率时使用的滑动窗口（秒）
+RATE_WINDOW = 30
+
+def current_rss_bytes():
+    """Resident set size of this process, or peak RSS where /proc is unavailable"""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class ScrapeStatus:
+    """Progress tracker for one scrape run
+
+    Args:
+        path: status JSON path; defaults to <group_folder>/scrape_status.json once bound
+        metrics_path: optional Prometheus text file path
+        interval: minimum seconds between rewrites (phase changes always write)
+    """
+
+    def __init__(self, path=None, metrics_path=None, interval=2.0):
+        self.path = path
+        self.metrics_path = metrics_path
+        self.interval = interval
+        self.started = time.time()
+        self.group = None
+        self.csv_file = None
+        self.phase = 'starting'
+        self.total = 0
+        self.processed = 0
+        self.media_total = 0
+        self.media_done = 0
+        self.media_files = 0
+        self.media_bytes = 0
+        # 计数器是进程级的，记下起点只统计本次抓取
+        self._flood_waits = flood_wait_counter()
+        self._flood_base = (self._flood_waits.count, self._flood_waits.seconds)
+        self.checkpoint_rows = 0
+        self.checkpoint_time = None
+        self.error = None
+        self.stop_reason = None
+        self.budget = None  # ScrapeBudget，设置后快照中包含剩余时间
+        self._samples = deque()
+        self._last_write = 0.0
+
+    def bind(self, group, group_folder, csv_file):
+        """Attach the run to its group folder and output file"""
+        self.group = group
+        self.csv_file = csv_file
+        if self.path is None:
+            self.path = os.path.join(group_folder, STATUS_FILE_NAME)
+        self.write(force=True)
+
+    # 状态更新
+    def set_phase(self, phase, total=None):
+        self.phase = phase
+        if total is not None:
+            if phase == 'media':
+                self.media_total = total
+            else:
+                self.total = total
+        self._samples.clear()
+        self.write(force=True)
+
+    def progress(self, processed):
+        self.processed = processed
+        self.write()
+
+    def media_progress(self, done, file_path=None):
+        """Record one handled media message; file_path is the downloaded file, if any"""
+        self.media_done = done
+        if file_path:
+            self.media_files += 1
+            try:
+                self.media_bytes += os.path.getsize(file_path)
+            except OSError:
+                pass
+        self.write()
+
+    def record_flood_wait(self, seconds):
+        """A FloodWaitError reached the scraper (waits telethon sleeps through are counted by its logger hook)"""
+        self._flood_waits.record(seconds)
+        self.write()
+
+    def checkpoint_saved(self, rows):
+        self.checkpoint_rows = rows
+        self.checkpoint_time = time.time()
+        self.write()
+
+    def finish(self, error=None):
+        self.error = str(error) if error else None
+        self.phase = 'error' if error else 'complete'
+        self.write(force=True)
+
+    def stop(self, reason):
+        """The run stopped early (deadline or signal) with resumable state saved"""
+        self.stop_reason = reason
+        self.phase = 'stopped'
+        self.write(force=True)
+
+    # 计算
+    def _rates(self, now):
+        """(rows/sec, media messages/sec, media bytes/sec) over the recent window"""
+        self._samples.append((now, self.processed, self.media_done, self.media_bytes))
+        while len(self._samples) > 2 and now - self._samples[0][0] > RATE_WINDOW:
+            self._samples.popleft()
+        first = self._samples[0]
+        elapsed = now - first[0]
+        if elapsed <= 0:
+            return 0.0, 0.0, 0.0
+        return ((self.processed - first[1]) / elapsed,
+                (self.media_done - first[2]) / elapsed,
+                (self.media_bytes - first[3]) / elapsed)
+
+    def _flood_wait_totals(self):
+        """Flood waits since this status was created, raised or slept through inside telethon"""
+        return self._flood_waits.count - self._flood_base[0], self._flood_waits.seconds - self._flood_base[1]
+
+    def _budget_remaining(self):
+        remaining = self.budget.remaining() if self.budget is not None else None
+        return round(max(0, remaining), 1) if remaining is not None else None
+
+    def snapshot(self):
+        now = time.time()
+        rows_per_sec, media_per_sec, media_bytes_per_sec = self._rates(now)
+
+        eta = None
+        if self.phase == 'fetching' and rows_per_sec > 0 and self.total:
+            eta = max(0, self.total - self.processed) / rows_per_sec
+        elif self.phase == 'media' and media_per_sec > 0 and self.media_total:
+            eta = max(0, self.media_total - self.media_done) / media_per_sec
+
+        flood_waits, flood_wait_seconds = self._flood_wait_totals()
+        return {
+            'pid': os.getpid(),
+            'group': self.group,
+            'csv_file': self.csv_file,
+            'phase': self.phase,
+            'error': self.error,
+            'stop_reason': self.stop_reason,
+            'started_at': self.started,
+            'updated_at': now,
+            'elapsed_s': round(now - self.started, 1),
+            'total': self.total,
+            'processed': self.processed,
+            'percentage': int(self.processed / self.total * 100) if self.total else 0,
+            'rows_per_sec': round(rows_per_sec, 1),
+            'media_total': self.media_total,
+            'media_done': self.media_done,
+            'media_files': self.media_files,
+            'media_bytes': self.media_bytes,
+            'media_mb_per_sec': round(media_bytes_per_sec / (1024 * 1024), 2),
+            'eta_s': round(eta, 1) if eta is not None else None,
+            'flood_waits': flood_waits,
+            'flood_wait_s': flood_wait_seconds,
+            'checkpoint_rows': self.checkpoint_rows,
+            'checkpoint_lag_rows': max(0, self.processed - self.checkpoint_rows),
+            'checkpoint_lag_s': round(now - self.checkpoint_time, 1) if self.checkpoint_time else None,
+            'budget_remaining_s': self._budget_remaining(),
+            'rss_bytes': current_rss_bytes()
+        }
+
+    # 输出
+    def _metrics_text(self, snap):
+        labels = f'group="{_escape_label(snap["group"] or "")}"'
+        gauges = [
+            ('tg_scrape_up', 'Scrape is running (1) or finished (0)', 0 if snap['phase'] in ('complete', 'error', 'stopped') else 1),
+            ('tg_scrape_failed', 'Scrape ended with an error', 1 if snap['phase'] == 'error' else 0),
+            ('tg_scrape_messages_total', 'Messages expected in this run', snap['total']),
+            ('tg_scrape_messages_processed', 'Messages fetched so far', snap['processed']),
+            ('tg_scrape_rows_per_second', 'Recent message fetch rate', snap['rows_per_sec']),
+            ('tg_scrape_media_files', 'Media files downloaded', snap['media_files']),
+            ('tg_scrape_media_bytes', 'Media bytes downloaded', snap['media_bytes']),
+            ('tg_scrape_media_megabytes_per_second', 'Recent media download rate', snap['media_mb_per_sec']),
+            ('tg_scrape_eta_seconds', 'Estimated seconds left in the current phase', snap['eta_s'] if snap['eta_s'] is not None else 'NaN'),
+            ('tg_scrape_flood_waits', 'Flood waits hit', snap['flood_waits']),
+            ('tg_scrape_flood_wait_seconds', 'Seconds spent in flood waits', snap['flood_wait_s']),
+            ('tg_scrape_checkpoint_lag_rows', 'Rows fetched since the last checkpoint', snap['checkpoint_lag_rows']),
+            ('tg_scrape_checkpoint_lag_seconds', 'Seconds since the last checkpoint', snap['checkpoint_lag_s'] if snap['checkpoint_lag_s'] is not None else 'NaN'),
+            ('tg_scrape_rss_bytes', 'Resident memory of the scraper', snap['rss_bytes'] if snap['rss_bytes'] is not None else 'NaN'),
+            ('tg_scrape_updated_timestamp_seconds', 'Time of this snapshot', round(snap['updated_at'], 3))
+        ]
+        lines = []
+        for name, help_text, value in gauges:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name}{{{labels}}} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, force=False):
+        """Rewrite the status (and metrics) file, throttled to `interval` unless forced"""
+        if not self.path and not self.metrics_path:
+            return
+        now = time.time()
+        if not force and now - self._last_write < self.interval:
+            return
+        self._last_write = now
+        snap = self.snapshot()
+        # 同一个状态对象排队中的旧快照会被新的替换
+        get_disk_writer().submit(self._write_files, snap, key=('status', id(self)))
+
+    def _write_files(self, snap):
+        try:
+            if self.path:
+                write_atomic(self.path, json.dumps(snap, ensure_ascii=False))
+            if self.metrics_path:
+                write_atomic(self.metrics_path, self._metrics_text(snap))
+        except OSError as e:
+            # 状态文件写入失败不影响抓取本身
+            print(json.dumps({'type': 'warning', 'message': f'Failed to write status file: {e}'}), file=sys.stderr, flush=True)
@@ -0,0 +1,118 @@
+"""
+Telethon-free half of the per-user session store
+
+The store database (schema, connection settings) and listing a user's
+accounts, kept apart from session_store so scripts that only list sessions,
+such as cassette replays, never import telethon.
+"""
+import os
+import sqlite3
+
+STORE_FILENAME = 'sessions.db'
+EXTENSION = '.session'
+STORE_VERSION = 1
+
+# 'files'：每个账号一个 .session 文件（默认）；'store'：每个用户一个数据库
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'files')
+
+# 其他进程正在写入时最多等待的毫秒数
+BUSY_TIMEOUT_MS = 5000
+
+SCHEMA = (
+    'version (version integer primary key)',
+    """sessions (
+        name text primary key,
+        dc_id integer,
+        server_address text,
+        port integer,
+        auth_key blob,
+        takeout_id integer,
+        source_mtime real,
+        updated_at real
+    )""",
+    """entities (
+        session text,
+        id integer,
+        hash integer not null,
+        username text,
+        phone integer,
+        name text,
+        date integer,
+        primary key (session, id)
+    )""",
+    """sent_files (
+        session text,
+        md5_digest blob,
+        file_size integer,
+        type integer,
+        id integer,
+        hash integer,
+        primary key (session, md5_digest, file_size, type)
+    )""",
+    """update_state (
+        session text,
+        id integer,
+        pts integer,
+        qts integer,
+        date integer,
+        seq integer,
+        primary key (session, id)
+    )"""
+)
+INDEXES = (
+    'entities_username on entities (session, username)',
+    'entities_phone on entities (session, phone)',
+    'entities_name on entities (session, name)'
+)
+
+def store_path(sessions_dir):
+    return os.path.join(sessions_dir, STORE_FILENAME)
+
+def connect(path):
+    """Open (creating if needed) a store database in WAL mode with autocommit"""
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None, check_same_thread=False)
+    conn.execute(f'pragma busy_timeout = {BUSY_TIMEOUT_MS}')
+    if conn.execute('pragma journal_mode').fetchone()[0] != 'wal':
+        conn.execute('pragma journal_mode = wal')
+    conn.execute('pragma synchronous = normal')
+    if not conn.execute("select 1 from sqlite_master where type = 'table' and name = 'version'").fetchone():
+        with _transaction(conn):
+            if not conn.execute("select 1 from sqlite_master where type = 'table' and name = 'version'").fetchone():
+                for definition in SCHEMA:
+                    conn.execute(f'create table {definition}')
+                for definition in INDEXES:
+                    conn.execute(f'create index {definition}')
+                conn.execute('insert into version values (?)', (STORE_VERSION,))
+    return conn
+
+class _transaction:
+    """BEGIN IMMEDIATE ... COMMIT around a group of writes (the store runs in autocommit mode)"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute('begin immediate')
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute('rollback' if exc_type else 'commit')
+
+def list_names(conn):
+    return [row[0] for row in conn.execute('select name from sessions order by name')]
+
+# 供各脚本使用
+def list_session_files(sessions_dir):
+    """Session file names (`<name>.session`) of a user, including accounts only in the store"""
+    try:
+        names = {f for f in os.listdir(sessions_dir) if f.endswith(EXTENSION)}
+    except OSError:
+        return []
+    path = store_path(sessions_dir)
+    if SESSION_BACKEND == 'store' and os.path.exists(path):
+        conn = connect(path)
+        try:
+            names.update(f'{name}{EXTENSION}' for name in list_names(conn))
+        finally:
+            conn.close()
+    return sorted(names)
@@ -12,6 +12,7 @@ from config import (
     get_user_sessions_dir,
     DEFAULT_PROXY
 )
+from instrumentation import instrument_client
 
 async def try_connect(phone, user_email, max_attempts=3):
     """Try to connect with retry mechanism"""
@@ -30,6 +31,7 @@ async def try_connect(phone, user_email, max_attempts=3):
                 API_HASH,
                 proxy=DEFAULT_PROXY
             )
+            instrument_client(client)
             
             await client.connect()
             
@@ -0,0 +1,336 @@
+"""
+Consolidated per-user Telethon session store
+
+All accounts of a user live in one SQLite database,
+`sessions/<email>/sessions.db`, instead of one `.session` file each. The
+database uses WAL mode and every row is keyed by the session name, so many
+processes can read and update different accounts at the same time. Writes
+commit immediately instead of holding a transaction open until save(), as
+Telethon's SQLiteSession does, so one client never blocks the others.
+Listing the accounts takes a single query.
+
+The backend is optional (SESSION_BACKEND=store). The `.session` files stay
+the source of truth for uploads. A file missing from the store, or newer
+than its copy there, is imported the first time it is opened.
+
+Usage:
+    python3 session_store.py import --user-email a@b.c [--remove]
+    python3 session_store.py export --user-email a@b.c [--name +123] [--output-dir dir]
+    python3 session_store.py list --user-email a@b.c
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import datetime
+import argparse
+from telethon import utils
+from telethon.crypto import AuthKey
+from telethon.sessions import MemorySession, SQLiteSession
+from telethon.sessions.memory import _SentFileType
+from telethon.tl import types
+from telethon.tl.types import InputPhoto, InputDocument, PeerUser, PeerChat, PeerChannel
+from config import BASE_SESSIONS_DIR
+from session_db import (
+    EXTENSION, SESSION_BACKEND, store_path, connect, _transaction, list_names
+)
+
+class StoreSession(MemorySession):
+    """Telethon session backed by one account's rows of a per-user store
+
+    conn: an already open store connection to take over (closed with the session)
+    """
+
+    def __init__(self, path, name, conn=None):
+        super().__init__()
+        self.store = path
+        self.name = name
+        # 日志里沿用 session.filename
+        self.filename = f'{path}#{name}'
+        self.save_entities = True
+        self._conn = conn or connect(path)
+        row = self._db().execute(
+            'select dc_id, server_address, port, auth_key, takeout_id from sessions where name = ?', (name,)
+        ).fetchone()
+        if row:
+            self._dc_id, self._server_address, self._port, key, self._takeout_id = row
+            self._auth_key = AuthKey(data=key) if key else None
+
+    def clone(self, to_instance=None):
+        cloned = super().clone(to_instance)
+        cloned.save_entities = self.save_entities
+        return cloned
+
+    def _update_session_table(self):
+        self._db().execute(
+            'insert into sessions (name, dc_id, server_address, port, auth_key, takeout_id, updated_at) '
+            'values (?,?,?,?,?,?,?) on conflict(name) do update set dc_id = excluded.dc_id, '
+            'server_address = excluded.server_address, port = excluded.port, auth_key = excluded.auth_key, '
+            'takeout_id = excluded.takeout_id, updated_at = excluded.updated_at',
+            (self.name, self._dc_id, self._server_address, self._port,
+             self._auth_key.key if self._auth_key else b'', self._takeout_id, time.time())
+        )
+
+    def set_dc(self, dc_id, server_address, port):
+        super().set_dc(dc_id, server_address, port)
+        self._update_session_table()
+
+    @MemorySession.auth_key.setter
+    def auth_key(self, value):
+        self._auth_key = value
+        self._update_session_table()
+
+    @MemorySession.takeout_id.setter
+    def takeout_id(self, value):
+        self._takeout_id = value
+        self._update_session_table()
+
+    def get_update_state(self, entity_id):
+        row = self._db().execute(
+            'select pts, qts, date, seq from update_state where session = ? and id = ?', (self.name, entity_id)
+        ).fetchone()
+        if row:
+            pts, qts, date, seq = row
+            date = datetime.datetime.fromtimestamp(date, tz=datetime.timezone.utc)
+            return types.updates.State(pts, qts, date, seq, unread_count=0)
+
+    def set_update_state(self, entity_id, state):
+        self._db().execute(
+            'insert or replace into update_state values (?,?,?,?,?,?)',
+            (self.name, entity_id, state.pts, state.qts, state.date.timestamp(), state.seq)
+        )
+
+    def get_update_states(self):
+        rows = self._db().execute(
+            'select id, pts, qts, date, seq from update_state where session = ?', (self.name,)
+        ).fetchall()
+        return ((row[0], types.updates.State(
+            pts=row[1], qts=row[2],
+            date=datetime.datetime.fromtimestamp(row[3], tz=datetime.timezone.utc),
+            seq=row[4], unread_count=0
+        )) for row in rows)
+
+    def save(self):
+        # 每次写入都已提交，无需额外保存
+        pass
+
+    def _db(self):
+        # 断开后重新连接时按需重新打开
+        if self._conn is None:
+            self._conn = connect(self.store)
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+        self._conn = None
+
+    def delete(self):
+        """Remove this account's rows from the store"""
+        with _transaction(self._db()):
+            for table in ('sessions', 'entities', 'sent_files', 'update_state'):
+                key = 'name' if table == 'sessions' else 'session'
+                self._db().execute(f'delete from {table} where {key} = ?', (self.name,))
+        return True
+
+    # 实体缓存
+    def process_entities(self, tlo):
+        if not self.save_entities:
+            return
+        rows = self._entities_to_rows(tlo)
+        if not rows:
+            return
+        now = int(time.time())
+        with _transaction(self._db()):
+            self._db().executemany(
+                'insert or replace into entities values (?,?,?,?,?,?,?)',
+                [(self.name,) + row + (now,) for row in rows]
+            )
+
+    def _one(self, stmt, *values):
+        return self._db().execute(stmt, (self.name,) + values).fetchone()
+
+    def get_entity_rows_by_phone(self, phone):
+        return self._one('select id, hash from entities where session = ? and phone = ?', phone)
+
+    def get_entity_rows_by_username(self, username):
+        results = self._db().execute(
+            'select id, hash, date from entities where session = ? and username = ?', (self.name, username)
+        ).fetchall()
+        if not results:
+            return None
+        # 同一用户名有多条记录时保留最新的
+        if len(results) > 1:
+            results.sort(key=lambda t: t[2] or 0)
+            with _transaction(self._db()):
+                self._db().executemany(
+                    'update entities set username = null where session = ? and id = ?',
+                    [(self.name, t[0]) for t in results[:-1]]
+                )
+        return results[-1][0], results[-1][1]
+
+    def get_entity_rows_by_name(self, name):
+        return self._one('select id, hash from entities where session = ? and name = ?', name)
+
+    def get_entity_rows_by_id(self, id, exact=True):
+        if exact:
+            return self._one('select id, hash from entities where session = ? and id = ?', id)
+        return self._one(
+            'select id, hash from entities where session = ? and id in (?,?,?)',
+            utils.get_peer_id(PeerUser(id)), utils.get_peer_id(PeerChat(id)), utils.get_peer_id(PeerChannel(id))
+        )
+
+    # 已上传文件缓存
+    def get_file(self, md5_digest, file_size, cls):
+        row = self._one(
+            'select id, hash from sent_files where session = ? and md5_digest = ? and file_size = ? and type = ?',
+            md5_digest, file_size, _SentFileType.from_type(cls).value
+        )
+        if row:
+            return cls(row[0], row[1])
+
+    def cache_file(self, md5_digest, file_size, instance):
+        if not isinstance(instance, (InputDocument, InputPhoto)):
+            raise TypeError('Cannot cache %s instance' % type(instance))
+        self._db().execute(
+            'insert or replace into sent_files values (?,?,?,?,?,?)',
+            (self.name, md5_digest, file_size, _SentFileType.from_type(type(instance)).value,
+             instance.id, instance.access_hash)
+        )
+
+# 与 .session 文件互相导入导出
+def _columns(conn, table):
+    return [row[1] for row in conn.execute(f'pragma table_info({table})')]
+
+def import_file(conn, session_file, name=None):
+    """Copy a Telethon .session file into the store (replacing that account's rows); returns the name"""
+    name = name or os.path.basename(session_file)[:-len(EXTENSION)]
+    source = sqlite3.connect(f'file:{session_file}?mode=ro', uri=True)
+    try:
+        session_columns = _columns(source, 'sessions')
+        row = source.execute(
+            'select dc_id, server_address, port, auth_key, '
+            f"{'takeout_id' if 'takeout_id' in session_columns else 'null'} from sessions"
+        ).fetchone()
+        entity_date = 'date' if 'date' in _columns(source, 'entities') else 'null'
+        entities = source.execute(f'select id, hash, username, phone, name, {entity_date} from entities').fetchall()
+        sent_files = source.execute('select md5_digest, file_size, type, id, hash from sent_files').fetchall() \
+            if _columns(source, 'sent_files') else []
+        states = source.execute('select id, pts, qts, date, seq from update_state').fetchall() \
+            if _columns(source, 'update_state') else []
+    finally:
+        source.close()
+    if row is None:
+        raise ValueError(f'{session_file} has no session data')
+
+    with _transaction(conn):
+        for table in ('entities', 'sent_files', 'update_state'):
+            conn.execute(f'delete from {table} where session = ?', (name,))
+        conn.execute('insert or replace into sessions values (?,?,?,?,?,?,?,?)',
+                     (name,) + tuple(row) + (os.path.getmtime(session_file), time.time()))
+        conn.executemany('insert into entities values (?,?,?,?,?,?,?)', [(name,) + tuple(r) for r in entities])
+        conn.executemany('insert into sent_files values (?,?,?,?,?,?)', [(name,) + tuple(r) for r in sent_files])
+        conn.executemany('insert into update_state values (?,?,?,?,?,?)', [(name,) + tuple(r) for r in states])
+    return name
+
+def export_file(conn, name, session_file):
+    """Write one account of the store as a regular Telethon .session file"""
+    row = conn.execute(
+        'select dc_id, server_address, port, auth_key, takeout_id from sessions where name = ?', (name,)
+    ).fetchone()
+    if row is None:
+        raise KeyError(f'No session named {name} in the store')
+    tmp_base = f'{session_file[:-len(EXTENSION)]}.{os.getpid()}.export'
+    session = SQLiteSession(tmp_base)
+    try:
+        session.set_dc(row[0], row[1], row[2])
+        session.auth_key = AuthKey(data=row[3]) if row[3] else None
+        session.takeout_id = row[4]
+        c = session._cursor()
+        c.executemany('insert or replace into entities values (?,?,?,?,?,?)', conn.execute(
+            'select id, hash, username, phone, name, date from entities where session = ?', (name,)))
+        c.executemany('insert or replace into sent_files values (?,?,?,?,?)', conn.execute(
+            'select md5_digest, file_size, type, id, hash from sent_files where session = ?', (name,)))
+        c.executemany('insert or replace into update_state values (?,?,?,?,?)', conn.execute(
+            'select id, pts, qts, date, seq from update_state where session = ?', (name,)))
+        c.close()
+        session.save()
+    finally:
+        session.close()
+    os.replace(session.filename, session_file)
+
+# 供各脚本使用
+def open_session(session_path):
+    """What to pass to TelegramClient for a session path (with or without `.session`)
+
+    With the store backend this is a StoreSession; a `.session` file that is
+    not in the store yet, or was replaced since it was imported, is imported
+    first. Otherwise the path itself (Telethon opens the file).
+    """
+    base = session_path[:-len(EXTENSION)] if session_path.endswith(EXTENSION) else session_path
+    if SESSION_BACKEND != 'store':
+        return base
+    session_file = base + EXTENSION
+    sessions_dir = os.path.dirname(session_file)
+    name = os.path.basename(base)
+    path = store_path(sessions_dir)
+    conn = connect(path)
+    try:
+        row = conn.execute('select source_mtime from sessions where name = ?', (name,)).fetchone()
+        if os.path.exists(session_file) and (row is None or (row[0] or 0) < os.path.getmtime(session_file)):
+            import_file(conn, session_file, name)
+    except BaseException:
+        conn.close()
+        raise
+    return StoreSession(path, name, conn)
+
+def main():
+    parser = argparse.ArgumentParser(description='Import/export Telethon sessions to the per-user session store')
+    parser.add_argument('command', choices=['import', 'export', 'list'])
+    parser.add_argument('--user-email', required=True, help='User email')
+    parser.add_argument('--name', action='append', help='Only this session (repeatable, without .session)')
+    parser.add_argument('--output-dir', help='Export destination (default: the user\'s sessions directory)')
+    parser.add_argument('--remove', action='store_true', help='Delete .session files after importing them')
+    args = parser.parse_args()
+
+    sessions_dir = os.path.join(BASE_SESSIONS_DIR, args.user_email)
+    if not os.path.isdir(sessions_dir):
+        print(json.dumps({'type': 'error', 'message': f'No sessions directory found for {args.user_email}'}))
+        sys.exit(1)
+    conn = connect(store_path(sessions_dir))
+    started = time.perf_counter()
+    done, errors = [], {}
+    try:
+        if args.command == 'list':
+            print(json.dumps({'type': 'sessions', 'data': list_names(conn)}))
+            return
+        if args.command == 'import':
+            names = args.name or [f[:-len(EXTENSION)] for f in sorted(os.listdir(sessions_dir)) if f.endswith(EXTENSION)]
+            for name in names:
+                session_file = os.path.join(sessions_dir, name + EXTENSION)
+                try:
+                    import_file(conn, session_file, name)
+                    if args.remove:
+                        os.remove(session_file)
+                    done.append(name)
+                except (OSError, sqlite3.Error, ValueError) as e:
+                    errors[name] = str(e)
+        else:
+            output_dir = args.output_dir or sessions_dir
+            os.makedirs(output_dir, exist_ok=True)
+            for name in args.name or list_names(conn):
+                try:
+                    export_file(conn, name, os.path.join(output_dir, name + EXTENSION))
+                    done.append(name)
+                except (OSError, sqlite3.Error, KeyError) as e:
+                    errors[name] = str(e)
+    finally:
+        conn.close()
+    result = {'type': args.command, 'sessions': done, 'elapsed_s': round(time.perf_counter() - started, 3)}
+    if errors:
+        result['errors'] = errors
+    print(json.dumps(result))
+
+if __name__ == '__main__':
+    main()
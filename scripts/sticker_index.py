@@ -0,0 +1,144 @@
+"""
+Per-group sticker reference index
+
+All sticker references (id, access_hash, file_reference) of a group live in a
+single SQLite file `media/stickers.db` instead of one `sticker_<id>.json` per
+sticker. The scraper writes in batches (on the disk writer thread when one is
+given); auto_chat loads the whole index once.
+Legacy `.json` files are migrated into the index and removed automatically.
+"""
+import os
+import json
+import sqlite3
+import threading
+from disk_writer import log_failure
+
+INDEX_FILENAME = 'stickers.db'
+
+def _connect(media_folder, check_same_thread=True):
+    os.makedirs(media_folder, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(media_folder, INDEX_FILENAME), check_same_thread=check_same_thread)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stickers (
+            name TEXT PRIMARY KEY,
+            id INTEGER NOT NULL,
+            access_hash INTEGER NOT NULL,
+            file_reference BLOB NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    return conn
+
+def _migrate_json(conn, media_folder):
+    """Import legacy sticker_*.json files into the index and delete them"""
+    try:
+        names = [n for n in os.listdir(media_folder) if n.startswith('sticker_') and n.endswith('.json')]
+    except OSError:
+        return 0
+    if not names:
+        return 0
+
+    rows = []
+    for name in names:
+        try:
+            with open(os.path.join(media_folder, name), 'r', encoding='utf-8') as f:
+                info = json.load(f)
+            rows.append((
+                os.path.splitext(name)[0],
+                int(info['id']),
+                int(info['access_hash']),
+                bytes.fromhex(info['file_reference'])
+            ))
+        except (OSError, ValueError, KeyError):
+            # 损坏的文件保留在原处，方便排查
+            continue
+
+    with conn:
+        conn.executemany('INSERT OR REPLACE INTO stickers VALUES (?, ?, ?, ?)', rows)
+    for row in rows:
+        try:
+            os.remove(os.path.join(media_folder, row[0] + '.json'))
+        except OSError:
+            pass
+    return len(rows)
+
+class StickerIndex:
+    """Batched writer for a group's sticker index
+
+    With a DiskWriter, the SQLite connection is used on the writer thread and
+    every batch is committed there; add() never touches the disk. Once the
+    writer has closed (e.g. at exit) its jobs run on the calling thread, so
+    the connection may be shared across threads and is used under a lock.
+    """
+
+    def __init__(self, media_folder, batch_size=500, writer=None):
+        self.media_folder = media_folder
+        self.batch_size = batch_size
+        self.writer = writer
+        self.migrated = None
+        self._pending = []
+        self._conn = None
+        self._lock = threading.Lock()
+        self._run(self._open, 'Opening sticker index')
+
+    def _run(self, fn, description, *args):
+        if self.writer is None:
+            fn(*args)
+        else:
+            self.writer.submit(self._locked, fn, *args).add_done_callback(log_failure(description))
+
+    def _locked(self, fn, *args):
+        with self._lock:
+            fn(*args)
+
+    def _open(self):
+        self._conn = _connect(self.media_folder, check_same_thread=False)
+        self.migrated = _migrate_json(self._conn, self.media_folder)
+
+    def _commit(self, rows):
+        with self._conn:
+            self._conn.executemany('INSERT OR REPLACE INTO stickers VALUES (?, ?, ?, ?)', rows)
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def add(self, name, doc_id, access_hash, file_reference):
+        """Queue a sticker reference; `name` is the media file name without extension"""
+        self._pending.append((name, int(doc_id), int(access_hash), bytes(file_reference)))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        rows, self._pending = self._pending, []
+        self._run(self._commit, 'Writing sticker index', rows)
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._run(self._close, 'Closing sticker index')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def load_sticker_index(media_folder):
+    """Load all sticker references of a group as {name: (id, access_hash, file_reference)}"""
+    if not os.path.isdir(media_folder):
+        return {}
+    conn = _connect(media_folder)
+    try:
+        _migrate_json(conn, media_folder)
+        return {
+            name: (doc_id, access_hash, bytes(file_reference))
+            for name, doc_id, access_hash, file_reference in conn.execute('SELECT * FROM stickers')
+        }
+    finally:
+        conn.close()
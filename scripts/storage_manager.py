@@ -0,0 +1,475 @@
+"""
+Per-user storage quota, retention and cold-tier compression for scraped data
+
+Every user folder under the data directory gets a usage index
+(`<data dir>/.storage/<email>.json`) listing the size and times of each file.
+Rescans are incremental: media files are write-once, so a directory whose
+mtime has not changed keeps its cached entries and only CSVs, checkpoints
+and databases are re-stat'ed.
+
+Policy (environment, overridable per user in `.storage/quotas.json`, e.g.
+{"default": 2048, "heavy@user.com": 10240} in MB):
+
+    STORAGE_QUOTA_MB               per-user quota, 0 = unlimited
+    STORAGE_MEDIA_RETENTION_DAYS   delete media older than this, 0 = keep
+    STORAGE_COLD_AFTER_DAYS        zstd-compress CSVs/checkpoints untouched this long, 0 = never (default)
+    STORAGE_MIN_FREE_MB            disk space scrapes always leave free
+    STORAGE_EVICTION               'lru' (least recently accessed) or 'age' (oldest first)
+
+Compressed files keep their name plus `.zst`; open_text() reads either form
+and thaw() restores the plain file before something appends to it.
+
+Usage:
+    python3 storage_manager.py usage --user-email a@b.c
+    python3 storage_manager.py enforce [--user-email a@b.c] [--dry-run]
+    python3 storage_manager.py cat <path>          # decompressed CSV to stdout
+"""
+import io
+import os
+import sys
+import json
+import time
+import errno
+import shutil
+import argparse
+from config import MEDIA_DIR
+from disk_writer import write_atomic
+
+MB = 1024 * 1024
+DAY = 86400
+
+QUOTA_MB = float(os.environ.get('STORAGE_QUOTA_MB', '0'))
+MEDIA_RETENTION_DAYS = float(os.environ.get('STORAGE_MEDIA_RETENTION_DAYS', '0'))
+COLD_AFTER_DAYS = float(os.environ.get('STORAGE_COLD_AFTER_DAYS', '0'))
+MIN_FREE_MB = float(os.environ.get('STORAGE_MIN_FREE_MB', '512'))
+EVICTION_POLICY = os.environ.get('STORAGE_EVICTION', 'lru')
+
+# 超出配额时清理到配额的这个比例，避免每次抓取都触发清理
+EVICT_TARGET = 0.9
+
+INDEX_DIR_NAME = '.storage'
+INDEX_VERSION = 1
+
+# 会被原地修改的文件，目录 mtime 不变时也要重新 stat
+MUTABLE_SUFFIXES = ('.csv', '.tmp', '.json', '.db', '.db-wal', '.db-shm')
+# 可以压缩到冷存储的文件（导出 CSV 和 checkpoint）
+COLD_SUFFIXES = ('.csv', '.csv.tmp')
+COMPRESSED_SUFFIX = '.zst'
+COMPRESSION_LEVEL = 10
+
+class StorageFull(Exception):
+    """A scrape cannot start (or continue downloading) within the quota or disk reserve"""
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError('Cold-tier compression requires the zstandard package: pip install -r requirements.txt')
+    return zstandard
+
+def is_disk_full(error):
+    return isinstance(error, OSError) and error.errno in (errno.ENOSPC, getattr(errno, 'EDQUOT', errno.ENOSPC))
+
+# 压缩文件的透明读写
+def resolve(path):
+    """The file backing `path`: itself, or its compressed copy; FileNotFoundError when neither exists"""
+    if os.path.exists(path):
+        return path
+    if os.path.exists(path + COMPRESSED_SUFFIX):
+        return path + COMPRESSED_SUFFIX
+    raise FileNotFoundError(errno.ENOENT, 'No such file', path)
+
+def exists(path):
+    return os.path.exists(path) or os.path.exists(path + COMPRESSED_SUFFIX)
+
+def open_text(path):
+    """Open a CSV for reading whether it is plain or was moved to the cold tier"""
+    actual = resolve(path)
+    if not actual.endswith(COMPRESSED_SUFFIX):
+        return open(actual, 'r', encoding='utf-8', newline='')
+    raw = open(actual, 'rb')
+    try:
+        stream = _zstd().ZstdDecompressor().stream_reader(raw, closefd=True)
+    except BaseException:
+        raw.close()
+        raise
+    return io.TextIOWrapper(stream, encoding='utf-8', newline='')
+
+def compress_file(path, level=COMPRESSION_LEVEL):
+    """Replace path with path.zst (same mtime); returns the bytes saved
+
+    The original is kept (0 returned) when compression would not make it smaller.
+    """
+    zstd = _zstd()
+    stat = os.stat(path)
+    target = path + COMPRESSED_SUFFIX
+    tmp_path = f'{target}.{os.getpid()}.part'
+    try:
+        with open(path, 'rb') as src, open(tmp_path, 'wb') as dst:
+            zstd.ZstdCompressor(level=level).copy_stream(src, dst)
+        # 保留原 mtime：冷热判断和 LRU 都以它为准
+        os.utime(tmp_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        # 压缩期间文件被改写（抓取恢复），或压缩后没有变小时放弃
+        if os.stat(path).st_mtime_ns != stat.st_mtime_ns or os.path.getsize(tmp_path) >= stat.st_size:
+            os.remove(tmp_path)
+            return 0
+        os.replace(tmp_path, target)
+        os.remove(path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    return stat.st_size - os.path.getsize(target)
+
+def thaw(path):
+    """Decompress path.zst back to path before it is appended to; no-op for plain files"""
+    compressed = path + COMPRESSED_SUFFIX
+    if os.path.exists(path) or not os.path.exists(compressed):
+        return False
+    tmp_path = f'{path}.{os.getpid()}.part'
+    try:
+        with open(compressed, 'rb') as src, open(tmp_path, 'wb') as dst:
+            _zstd().ZstdDecompressor().copy_stream(src, dst)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    os.remove(compressed)
+    return True
+
+def drop_cold_copy(path):
+    """Remove a compressed copy superseded by a freshly written plain file"""
+    try:
+        os.remove(path + COMPRESSED_SUFFIX)
+    except FileNotFoundError:
+        pass
+
+# 使用量索引
+def quota_bytes(user_email, data_dir=None):
+    """Quota of a user in bytes (0 = unlimited): quotas.json entry, its default, then STORAGE_QUOTA_MB"""
+    quotas_file = os.path.join(data_dir or MEDIA_DIR, INDEX_DIR_NAME, 'quotas.json')
+    quota = QUOTA_MB
+    try:
+        with open(quotas_file, 'r', encoding='utf-8') as f:
+            quotas = json.load(f)
+        quota = float(quotas.get(user_email, quotas.get('default', quota)))
+    except (OSError, ValueError, TypeError, AttributeError):
+        pass
+    return int(quota * MB)
+
+def is_media(rel_path):
+    parts = rel_path.split('/')
+    return 'media' in parts[:-1] and not parts[-1].startswith('stickers.db')
+
+class UsageIndex:
+    """Size, mtime and atime of every file in a user's data folder, rescanned incrementally"""
+
+    def __init__(self, user_email, data_dir=None):
+        data_dir = data_dir or MEDIA_DIR
+        self.user_email = user_email
+        self.user_dir = os.path.join(data_dir, user_email)
+        self.path = os.path.join(data_dir, INDEX_DIR_NAME, f'{user_email}.json')
+        # 相对目录 -> {'mtime_ns', 'dirs': [子目录名], 'files': {文件名: [size, mtime, atime]}}
+        self.dirs = {}
+        self.rescanned = 0
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == INDEX_VERSION:
+                self.dirs = data['dirs']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def scan(self):
+        """Bring the index up to date; returns the total bytes used"""
+        dirs = {}
+        self.rescanned = 0
+        stack = ['']
+        while stack:
+            rel_dir = stack.pop()
+            abs_dir = os.path.join(self.user_dir, rel_dir)
+            try:
+                mtime_ns = os.stat(abs_dir).st_mtime_ns
+            except OSError:
+                continue
+            cached = self.dirs.get(rel_dir)
+            if cached is not None and cached['mtime_ns'] == mtime_ns:
+                files = {}
+                for name, entry in cached['files'].items():
+                    if name.endswith(MUTABLE_SUFFIXES):
+                        try:
+                            stat = os.stat(os.path.join(abs_dir, name))
+                        except OSError:
+                            continue
+                        entry = [stat.st_size, stat.st_mtime, stat.st_atime]
+                    files[name] = entry
+                sub_dirs = cached['dirs']
+            else:
+                # 目录内容有变化，重新列出
+                self.rescanned += 1
+                files = {}
+                sub_dirs = []
+                try:
+                    entries = list(os.scandir(abs_dir))
+                except OSError:
+                    continue
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            sub_dirs.append(entry.name)
+                        elif entry.is_file(follow_symlinks=False):
+                            stat = entry.stat(follow_symlinks=False)
+                            files[entry.name] = [stat.st_size, stat.st_mtime, stat.st_atime]
+                    except OSError:
+                        continue
+            dirs[rel_dir] = {'mtime_ns': mtime_ns, 'dirs': sub_dirs, 'files': files}
+            stack.extend(f'{rel_dir}/{name}' if rel_dir else name for name in sub_dirs)
+        self.dirs = dirs
+        return self.total
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        write_atomic(self.path, json.dumps({'version': INDEX_VERSION, 'dirs': self.dirs}, ensure_ascii=False))
+
+    @property
+    def total(self):
+        return sum(entry[0] for info in self.dirs.values() for entry in info['files'].values())
+
+    def files(self):
+        """Yield (relative path, size, mtime, atime)"""
+        for rel_dir, info in self.dirs.items():
+            for name, (size, mtime, atime) in info['files'].items():
+                yield (f'{rel_dir}/{name}' if rel_dir else name), size, mtime, atime
+
+    def by_group(self):
+        usage = {}
+        for rel_path, size, _, _ in self.files():
+            group = rel_path.split('/', 1)[0] if '/' in rel_path else ''
+            usage[group] = usage.get(group, 0) + size
+        return usage
+
+    def update(self, rel_path):
+        """Refresh (or drop) one file's entry after changing it; its directory is rescanned next time"""
+        rel_dir, _, name = rel_path.rpartition('/')
+        info = self.dirs.get(rel_dir)
+        if info is None:
+            return
+        try:
+            stat = os.stat(os.path.join(self.user_dir, rel_path))
+            info['files'][name] = [stat.st_size, stat.st_mtime, stat.st_atime]
+        except OSError:
+            info['files'].pop(name, None)
+
+def _remove(index, rel_path, dry_run):
+    if not dry_run:
+        try:
+            os.remove(os.path.join(index.user_dir, rel_path))
+        except FileNotFoundError:
+            pass
+        index.update(rel_path)
+
+def _protected(rel_path, protect):
+    return rel_path.split('/', 1)[0] in protect
+
+def compiled_sources(index):
+    """Group folders with a compile_source.py pack; auto_chat trusts their media without checking"""
+    return {rel_path.split('/', 1)[0] for rel_path, _, _, _ in index.files()
+            if '/' in rel_path and rel_path.endswith('.pack')}
+
+def enforce(user_email, data_dir=None, quota=None, protect=(), dry_run=False, now=None):
+    """Apply retention, cold compression and quota eviction to one user's folder; returns a report
+
+    protect: group folder names left untouched (a scrape is writing there)
+    """
+    index = UsageIndex(user_email, data_dir)
+    before = index.scan()
+    quota = quota_bytes(user_email, data_dir) if quota is None else quota
+    now = time.time() if now is None else now
+    report = {'user': user_email, 'used_before': before, 'quota': quota, 'expired': 0, 'compressed': 0,
+              'compressed_saved': 0, 'evicted': 0, 'freed': 0, 'dry_run': dry_run}
+    # 编译过的消息源的媒体不参与保留期和配额淘汰
+    keep_media = set(protect) | compiled_sources(index)
+
+    # 1. 媒体保留期
+    if MEDIA_RETENTION_DAYS > 0:
+        cutoff = now - MEDIA_RETENTION_DAYS * DAY
+        for rel_path, size, mtime, _ in list(index.files()):
+            if is_media(rel_path) and mtime < cutoff and not _protected(rel_path, keep_media):
+                _remove(index, rel_path, dry_run)
+                report['expired'] += 1
+                report['freed'] += size
+
+    # 2. 冷数据压缩
+    if COLD_AFTER_DAYS > 0:
+        cutoff = now - COLD_AFTER_DAYS * DAY
+        for rel_path, size, mtime, _ in list(index.files()):
+            name = os.path.basename(rel_path)
+            if (name.endswith(COLD_SUFFIXES) and not name.startswith('.') and mtime < cutoff
+                    and not _protected(rel_path, protect)):
+                if dry_run:
+                    report['compressed'] += 1
+                    continue
+                try:
+                    saved = compress_file(os.path.join(index.user_dir, rel_path))
+                except (OSError, RuntimeError) as e:
+                    report.setdefault('errors', []).append(f'{rel_path}: {e}')
+                    continue
+                if saved:
+                    index.update(rel_path)
+                    index.update(rel_path + COMPRESSED_SUFFIX)
+                    report['compressed'] += 1
+                    report['compressed_saved'] += saved
+
+    # 3. 配额：按 LRU（访问时间）或文件年龄淘汰媒体
+    used = index.total if not dry_run else before - report['freed'] - report['compressed_saved']
+    if quota and used > quota:
+        target = quota * EVICT_TARGET
+        candidates = []
+        for rel_path, size, mtime, atime in index.files():
+            if not is_media(rel_path) or _protected(rel_path, keep_media):
+                continue
+            if EVICTION_POLICY == 'lru':
+                # 访问时间不会改变目录 mtime，索引中的 atime 可能已过期，淘汰前重新读取
+                try:
+                    atime = os.stat(os.path.join(index.user_dir, rel_path)).st_atime
+                except OSError:
+                    continue
+                candidates.append((max(atime, mtime), rel_path, size))
+            else:
+                candidates.append((mtime, rel_path, size))
+        candidates.sort()
+        for _, rel_path, size in candidates:
+            if used <= target:
+                break
+            _remove(index, rel_path, dry_run)
+            used -= size
+            report['evicted'] += 1
+            report['freed'] += size
+
+    report['used_after'] = used if dry_run else index.total
+    report['over_quota'] = bool(quota) and report['used_after'] > quota
+    if not dry_run:
+        index.save()
+    return report
+
+def disk_free(path):
+    """Free bytes on the filesystem holding path (or its nearest existing parent)"""
+    while not os.path.exists(path) and os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+    return shutil.disk_usage(path).free
+
+class StorageGuard:
+    """Quota and free-space checks for one scrape
+
+    admit() runs before the scrape (enforcing the policy first, so old data
+    makes room) and raises StorageFull when it still cannot start; allows()
+    is asked before each media download so the scrape trims media instead of
+    running into ENOSPC.
+    """
+
+    def __init__(self, user_email, data_dir=None, group_folder=None, min_free=None):
+        self.user_email = user_email
+        self.data_dir = data_dir or MEDIA_DIR
+        self.protect = (os.path.basename(group_folder),) if group_folder else ()
+        self.min_free = int(MIN_FREE_MB * MB) if min_free is None else min_free
+        self.quota = quota_bytes(user_email, self.data_dir)
+        self.used = 0
+        self.written = 0
+        self.reason = None
+        self._evicted = False
+
+    def _shortfall(self, size):
+        """Why `size` more bytes do not fit, or None"""
+        if self.quota and self.used + self.written + size > self.quota:
+            return f'storage quota of {self.quota // MB} MB reached'
+        if disk_free(self.data_dir) - size < self.min_free:
+            return f'less than {self.min_free // MB} MB of disk space left'
+        return None
+
+    def _make_room(self):
+        report = enforce(self.user_email, self.data_dir, self.quota, self.protect)
+        self.used = report['used_after']
+        self.written = 0
+        return report
+
+    def admit(self):
+        """Check before scraping; returns the policy report, raises StorageFull"""
+        report = self._make_room()
+        reason = self._shortfall(0)
+        if reason is not None:
+            raise StorageFull(f'Cannot start scraping: {reason} '
+                              f'({self.used // MB} MB used by {self.user_email})')
+        return report
+
+    def allows(self, size):
+        """Whether a download of `size` bytes fits; sets `reason` when it does not"""
+        if self.reason is not None:
+            return False
+        reason = self._shortfall(size or 0)
+        if reason is not None and not self._evicted:
+            # 抓取期间只额外清理一次（不动正在抓取的群组）
+            self._evicted = True
+            self._make_room()
+            reason = self._shortfall(size or 0)
+        self.reason = reason
+        return reason is None
+
+    def add(self, path):
+        """Count a file the scrape has written"""
+        try:
+            self.written += os.path.getsize(path)
+        except OSError:
+            pass
+
+    def stop(self, reason):
+        self.reason = self.reason or reason
+
+def _users(data_dir):
+    try:
+        return sorted(name for name in os.listdir(data_dir)
+                      if not name.startswith('.') and os.path.isdir(os.path.join(data_dir, name)))
+    except OSError:
+        return []
+
+def main():
+    parser = argparse.ArgumentParser(description='Storage usage, quota and retention for scraped data')
+    parser.add_argument('command', choices=['usage', 'enforce', 'cat'])
+    parser.add_argument('path', nargs='?', help='File to print (cat)')
+    parser.add_argument('--user-email', help='Only this user (default: all users)')
+    parser.add_argument('--data-dir', default=MEDIA_DIR, help='Scraped data directory')
+    parser.add_argument('--dry-run', action='store_true', help='Report what enforce would do without changing files')
+    args = parser.parse_args()
+
+    if args.command == 'cat':
+        if not args.path:
+            parser.error('cat requires a path')
+        # 解压输出，供 Node 端下载冷存储中的 CSV
+        with open_text(args.path) as f:
+            out = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', newline='')
+            shutil.copyfileobj(f, out)
+            out.flush()
+        return
+
+    users = [args.user_email] if args.user_email else _users(args.data_dir)
+    for user in users:
+        if args.command == 'usage':
+            index = UsageIndex(user, args.data_dir)
+            started = time.perf_counter()
+            total = index.scan()
+            index.save()
+            result = {'type': 'usage', 'data': {
+                'user': user, 'used': total, 'quota': quota_bytes(user, args.data_dir),
+                'groups': index.by_group(), 'rescanned_dirs': index.rescanned,
+                'scan_s': round(time.perf_counter() - started, 3)
+            }}
+        else:
+            result = {'type': 'enforce', 'data': enforce(user, args.data_dir, dry_run=args.dry_run)}
+        print(json.dumps(result, ensure_ascii=False), flush=True)
+
+if __name__ == '__main__':
+    main()
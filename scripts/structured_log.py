@@ -0,0 +1,205 @@
+"""
+Structured, non-blocking logging for the long-running scripts
+
+Records are put on a queue by a QueueHandler and written by a listener
+thread, so a slow pipe or disk never blocks the event loop. Output is one
+JSON object per line:
+
+    {"type": "info", "time": 1718000000.123, "logger": "auto_chat", "message": "..."}
+
+`type` is the lower-case level, matching the `type` field of the protocol
+lines the web app already parses. Protocol lines themselves (progress,
+start, result...) go through emit() and are written verbatim whatever the
+level, in order with the log records.
+
+Identical messages (digits ignored) are rate limited: after `burst`
+repeats within `window` seconds the rest are dropped and counted, and the
+next one that gets through says how many were suppressed.
+
+Environment:
+    TG_LOG_LEVEL   DEBUG / INFO / WARNING / ERROR; defaults to WARNING when
+                   NODE_ENV=production (quiet), INFO otherwise
+"""
+import os
+import re
+import sys
+import copy
+import json
+import queue
+import atexit
+import logging
+import logging.handlers
+
+PROTOCOL_LOGGER = 'tg.protocol'
+
+_DIGITS = re.compile(r'\d+')
+_EXC_FORMATTER = logging.Formatter()
+_listener = None
+_rate_limit = None
+
+def default_level():
+    level = os.environ.get('TG_LOG_LEVEL')
+    if level:
+        return getattr(logging, level.upper(), logging.INFO)
+    return logging.WARNING if os.environ.get('NODE_ENV') == 'production' else logging.INFO
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        payload = getattr(record, 'payload', None)
+        if payload is not None:
+            return json.dumps(payload)
+        data = {
+            'type': record.levelname.lower(),
+            'time': round(record.created, 3),
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        fields = getattr(record, 'fields', None)
+        if fields:
+            data.update(fields)
+        if record.exc_text:
+            data['exc'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False)
+
+class RateLimitFilter(logging.Filter):
+    """Drop repeats of the same message beyond `burst` per `window` seconds"""
+
+    def __init__(self, burst=5, window=60.0):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self._seen = {}  # key -> [window_start, count, suppressed]
+
+    def filter(self, record):
+        if getattr(record, 'payload', None) is not None or record.levelno >= logging.ERROR:
+            return True
+        key = (record.name, record.levelno, _DIGITS.sub('#', str(record.msg))[:200])
+        now = record.created
+        entry = self._seen.get(key)
+        if entry is None or now - entry[0] > self.window:
+            suppressed = entry[2] if entry else 0
+            self._seen[key] = [now, 1, 0]
+            if suppressed:
+                record.msg = f'{record.getMessage()} ({suppressed} similar messages suppressed)'
+                record.args = None
+            if len(self._seen) > 10000:
+                self._seen.clear()
+            return True
+        entry[1] += 1
+        if entry[1] > self.burst:
+            entry[2] += 1
+            return False
+        return True
+
+    def flush_suppressed(self):
+        """Log one summary line per message that still has suppressed repeats"""
+        pending = [(key, entry[2]) for key, entry in self._seen.items() if entry[2]]
+        self._seen.clear()
+        for (name, levelno, template), suppressed in pending:
+            logging.getLogger(name).log(levelno, f'{suppressed} similar messages suppressed: {template}')
+
+class _StreamHandler(logging.StreamHandler):
+    """Writes without flushing each record; the listener flushes when the queue drains"""
+
+    def emit(self, record):
+        try:
+            stream = sys.stderr if getattr(record, 'to_stderr', False) else self.stream
+            stream.write(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        self.acquire()
+        try:
+            for stream in (self.stream, sys.stderr):
+                if stream and hasattr(stream, 'flush'):
+                    stream.flush()
+        finally:
+            self.release()
+
+class _Listener(logging.handlers.QueueListener):
+    def dequeue(self, block):
+        # 队列空了再刷新输出，连续写入时合并成一次系统调用
+        if block and self.queue.empty():
+            for handler in self.handlers:
+                handler.flush()
+        return self.queue.get(block)
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # 只合并参数、展开异常文本（保证可跨线程），JSON 格式化留给监听线程
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _EXC_FORMATTER.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+def setup_logging(name, level=None, log_file=None, stream=None):
+    """Route all logging through a queue to a JSON stream (and optional file); returns `name`'s logger
+
+    Safe to call more than once; only the first call installs handlers.
+    """
+    global _listener, _rate_limit
+    logger = logging.getLogger(name)
+    if _listener is not None:
+        return logger
+
+    log_queue = queue.SimpleQueue()
+    formatter = JsonFormatter()
+    handlers = []
+    stream_handler = _StreamHandler(stream or sys.stdout)
+    stream_handler.setFormatter(formatter)
+    handlers.append(stream_handler)
+    if log_file:
+        file_handler = logging.FileHandler(log_file, encoding='utf-8')
+        file_handler.setFormatter(formatter)
+        # 协议行只写到输出流
+        file_handler.addFilter(lambda record: getattr(record, 'payload', None) is None)
+        handlers.append(file_handler)
+
+    queue_handler = _QueueHandler(log_queue)
+    _rate_limit = RateLimitFilter()
+    queue_handler.addFilter(_rate_limit)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(default_level() if level is None else level)
+    logging.getLogger('telethon').setLevel(logging.WARNING)
+
+    protocol = logging.getLogger(PROTOCOL_LOGGER)
+    protocol.setLevel(logging.DEBUG)
+    protocol.propagate = False
+    protocol.addHandler(queue_handler)
+
+    _listener = _Listener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+    return logger
+
+def shutdown_logging():
+    """Drain the queue and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _rate_limit.flush_suppressed()
+        listener, _listener = _listener, None
+        # 之后的日志回退为直接输出
+        logging.getLogger(PROTOCOL_LOGGER).handlers.clear()
+        for handler in list(logging.getLogger().handlers):
+            if isinstance(handler, _QueueHandler):
+                logging.getLogger().removeHandler(handler)
+        listener.stop()
+        for handler in listener.handlers:
+            handler.flush()
+
+def emit(payload, stderr=False):
+    """Queue a protocol line (dict) to be written verbatim as JSON, regardless of log level"""
+    logger = logging.getLogger(PROTOCOL_LOGGER)
+    if not logger.handlers:
+        # 未初始化日志时直接输出
+        print(json.dumps(payload), file=sys.stderr if stderr else sys.stdout, flush=True)
+        return
+    logger.info('', extra={'payload': payload, 'to_stderr': stderr})
@@ -2,38 +2,50 @@ import os
 import sys
 import json
 import asyncio
-from telethon import TelegramClient
 from datetime import datetime
 import argparse
-from config import API_ID, API_HASH, PROXY_CONFIGS
+from config import API_ID, API_HASH
+from instrumentation import instrument_client
+from proxy_pool import check_proxies, connect_client, proxy_key
 
-async def test_session(session_path):
-    """Test a single session file"""
+async def test_session(session_path, cassette_writer=None, replay_calls=None, replay_speed=1.0):
+    """Test a single session file
+
+    Args:
+        cassette_writer: CassetteWriter to record this session's traffic to
+        replay_calls: Loaded cassette to answer from instead of connecting
+    """
     try:
         # 从session文件名中提取电话号码
         session_name = os.path.basename(session_path)
         phone = session_name.replace('.session', '')
         
-        proxy_config = PROXY_CONFIGS[0]  # 使用第一个代理配置
-        sys.stderr.write(f"Testing session {session_name} with proxy {proxy_config['addr']}:{proxy_config['port']}\n")
+        sys.stderr.write(f"Testing session {session_name}\n")
         sys.stderr.flush()
         
-        client = TelegramClient(
-            session_path.replace('.session', ''),
-            API_ID,
-            API_HASH,
-            proxy={
-                'proxy_type': proxy_config['proxy_type'],
-                'addr': proxy_config['addr'],
-                'port': proxy_config['port'],
-                'username': proxy_config['username'],
-                'password': proxy_config['password'],
-                'rdns': True
-            }
-        )
+        if replay_calls is not None:
+            from cassette import ReplayClient
+            client = ReplayClient(replay_calls, label=session_name, speed=replay_speed)
+        else:
+            # telethon 只在真正连接时导入，回放不需要
+            from telethon import TelegramClient
+            from session_store import open_session
+            # 代理由 connect_client 按健康状况选择
+            client = TelegramClient(
+                open_session(session_path),
+                API_ID,
+                API_HASH
+            )
+            instrument_client(client)
+            if cassette_writer is not None:
+                from cassette import record_client
+                record_client(client, cassette_writer, label=session_name)
         
         try:
-            await client.connect()
+            proxy = await connect_client(client)
+            if proxy is not None:
+                sys.stderr.write(f"Session {session_name} connected through {proxy_key(proxy)}\n")
+                sys.stderr.flush()
             if not await client.is_user_authorized():
                 sys.stderr.write(f"Session {session_name} is not authorized\n")
                 sys.stderr.flush()
@@ -87,8 +99,20 @@ async def test_session(session_path):
 async def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--sessions-dir', required=True, help='Sessions directory path')
+    parser.add_argument('--record', help='Record Telegram traffic to this cassette file')
+    parser.add_argument('--replay', help='Replay Telegram traffic from this cassette file instead of connecting')
+    parser.add_argument('--replay-speed', type=float, default=1.0, help='Replay timing multiplier (0 = no delays)')
     args = parser.parse_args()
     
+    cassette_writer = None
+    replay_calls = None
+    if args.record:
+        from cassette import CassetteWriter
+        cassette_writer = CassetteWriter(args.record)
+    elif args.replay:
+        from cassette import load_cassette
+        replay_calls = load_cassette(args.replay)
+    
     sys.stderr.write(f"Checking sessions in directory: {args.sessions_dir}\n")
     sys.stderr.flush()
     
@@ -100,7 +124,8 @@ async def main():
         return
         
     # 获取所有session文件
-    session_files = [f for f in os.listdir(args.sessions_dir) if f.endswith('.session')]
+    from session_db import list_session_files
+    session_files = list_session_files(args.sessions_dir)
     sys.stderr.write(f"Found {len(session_files)} session files\n")
     sys.stderr.flush()
     
@@ -109,11 +134,15 @@ async def main():
         sys.stdout.flush()
         return
         
+    # 先并行检查所有代理，之后每个会话直接使用最快的
+    if replay_calls is None:
+        await check_proxies()
+    
     # 测试每个session文件
     results = []
     for session_file in session_files:
         session_path = os.path.join(args.sessions_dir, session_file)
-        result = await test_session(session_path)
+        result = await test_session(session_path, cassette_writer, replay_calls, args.replay_speed)
         results.append(result)
     
     # 确保只输出 JSON 到标准输出
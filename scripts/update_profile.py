@@ -15,6 +15,9 @@ from telethon.tl.functions.account import UpdateProfileRequest, UpdateUsernameRe
 from telethon.tl.functions.photos import UploadProfilePhotoRequest
 from telethon.tl.types import InputFile
 from config import API_ID, API_HASH, DEFAULT_PROXY, get_user_sessions_dir
+from instrumentation import instrument_client
+from session_db import list_session_files
+from session_store import open_session
 
 # 配置日志，使用utf-8编码
 logging.basicConfig(
@@ -51,7 +54,7 @@ async def update_profile(user_email: str, session_name: str, first_name: str = N
 
         # 构建session文件路径
         session_file = os.path.join(sessions_dir, f"{session_name}.session")
-        if not os.path.exists(session_file):
+        if os.path.basename(session_file) not in list_session_files(sessions_dir):
             logger.error(f"Session文件不存在: {session_file}")
             return {
                 'success': False,
@@ -62,11 +65,12 @@ async def update_profile(user_email: str, session_name: str, first_name: str = N
 
         # 创建客户端实例，使用代理
         client = TelegramClient(
-            session_file,
+            open_session(session_file),
             API_ID,
             API_HASH,
             proxy=DEFAULT_PROXY
         )
+        instrument_client(client)
         
         try:
             await client.connect()